@@ -0,0 +1,59 @@
+"""
+Compares serial `vision.enhance_image` against the process-pool `vision.enhance_images`
+on a synthetic page set.
+
+Usage: python -m benchmarks.enhance_throughput --pages 32 --workers 8
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# Measure the enhancement pipeline itself, not hits in the on-disk cache the serial pass
+# would otherwise fill for the parallel one (override via env)
+os.environ.setdefault("ENHANCE_CACHE", "0")
+
+import cv2
+
+from benchmarks.synthetic import make_page
+from src.services import vision
+
+def _write_corpus(folder: str, count: int, width: int, height: int) -> list:
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"BenchXImage{i + 1}.png")
+        cv2.imwrite(path, make_page(i, width=width, height=height))
+        paths.append(path)
+    return paths
+
+def _run(label: str, fn, pages: list) -> float:
+    start = time.perf_counter()
+    count = sum(1 for _ in fn(pages))
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"{label:<24} {count} pages in {elapsed:6.2f}s  {rate:6.2f} pages/sec")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--width", type=int, default=1700)
+    parser.add_argument("--height", type=int, default=2200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        pages = _write_corpus(folder, args.pages, args.width, args.height)
+        print(f"Synthetic corpus: {args.pages} pages at {args.width}x{args.height}")
+
+        serial = _run("serial", lambda ps: (vision.enhance_image(p, use_cache=False) for p in ps), pages)
+        # Warm the pool up so spawn start-up isn't billed to the parallel run.
+        list(vision.enhance_images(pages[:args.workers], workers=args.workers))
+        parallel = _run(f"parallel ({args.workers} workers)", lambda ps: vision.enhance_images(ps, workers=args.workers), pages)
+
+        if serial > 0:
+            print(f"Speed-up: {parallel / serial:.2f}x")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Local stand-in for `genai.Client` used by the offline benchmarks. It answers generate
+calls (plain, async and streamed) with valid DocumentPayload / PackedDocumentPayload JSON
+after a configurable latency, fails a configurable share of calls with a 503, and reports
+`usage_metadata`, so the whole transcription path runs without network or quota.
+"""
+import json
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import Iterable, Optional
+
+class FakeServerError(Exception):
+    """503 from the fake backend; the rate limiter classifies it as transient and retries."""
+    code = 503
+
+def _is_packed(config) -> bool:
+    schema = getattr(config, "response_schema", None)
+    return getattr(schema, "__name__", "") == "PackedDocumentPayload"
+
+def _page_count(contents: list) -> int:
+    labels = sum(1 for part in contents if (getattr(part, "text", None) or "").startswith("Page "))
+    return max(1, labels)
+
+def _page_text(chars: int, page: int, placeholder: bool) -> dict:
+    lines = [f"\\section*{{Page {page + 1}}}"]
+    i = 0
+    while sum(len(line) + 1 for line in lines) < chars:
+        lines.append(f"Line {i}: let $f_{{{i}}}(x) = x^{{{i % 7 + 2}}} + {i}$ on the interval $[0, {i + 1}]$.")
+        i += 1
+    if placeholder:
+        lines.append("[COMPLEX/OMITTED CONTENT]")
+    latex = "\n".join(lines)
+    return {
+        "base_latex_md": {"latex": latex, "markdown": latex.replace("\\section*", "## ")},
+        "annotations_metadata": []
+    }
+
+class FakeGenaiClient:
+    """
+    `latency` (seconds, +/- `jitter`) is spent per generate call; `error_rate` of calls raise
+    `FakeServerError`; responses carry about `response_chars` characters of LaTeX per page.
+    `placeholder_rate` of the responses from `weak_models` contain [COMPLEX/OMITTED CONTENT],
+    which makes the model cascade escalate them.
+    """
+    def __init__(
+            self,
+            latency: float = 0.5,
+            jitter: float = 0.2,
+            error_rate: float = 0.0,
+            response_chars: int = 3000,
+            placeholder_rate: float = 0.0,
+            weak_models: Iterable[str] = (),
+            seed: int = 0
+        ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self.placeholder_rate = placeholder_rate
+        self.weak_models = set(weak_models)
+        self.stats = {"calls": 0, "errors": 0, "pages": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._uploads = 0
+
+        self.models = SimpleNamespace(generate_content=self._generate_content)
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self._agenerate_content, generate_content_stream=self._agenerate_content_stream),
+            files=SimpleNamespace(upload=self._aupload)
+        )
+        self.files = SimpleNamespace(upload=self._upload)
+        self.caches = SimpleNamespace(
+            create=lambda **kwargs: SimpleNamespace(name=f"cachedContents/fake-{id(kwargs)}"),
+            update=lambda **kwargs: None,
+            delete=lambda **kwargs: None
+        )
+
+    def _plan(self, model: str, contents: list, config):
+        """Returns (delay, response text, usage_metadata, error or None) for one call."""
+        pages = _page_count(contents) if _is_packed(config) else 1
+        with self._lock:
+            self.stats["calls"] += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+            placeholders = [model in self.weak_models and self._random.random() < self.placeholder_rate for _ in range(pages)]
+            if failed:
+                self.stats["errors"] += 1
+            else:
+                self.stats["pages"] += pages
+        if failed:
+            return delay, None, None, FakeServerError("503 UNAVAILABLE (fake backend)")
+
+        payloads = [_page_text(self.response_chars, page, placeholders[page]) for page in range(pages)]
+        if _is_packed(config):
+            text = json.dumps({"pages": [dict(payload, page_index=page) for page, payload in enumerate(payloads)]})
+        else:
+            text = json.dumps(payloads[0])
+        usage = SimpleNamespace(
+            prompt_token_count=1500 + 258 * pages,
+            cached_content_token_count=0,
+            candidates_token_count=len(text) // 4,
+            thoughts_token_count=0,
+            total_token_count=1500 + 258 * pages + len(text) // 4
+        )
+        return delay, text, usage, None
+
+    def _generate_content(self, model: str, contents: list, config=None, **kwargs):
+        delay, text, usage, error = self._plan(model, contents, config)
+        time.sleep(delay)
+        if error:
+            raise error
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    async def _agenerate_content(self, model: str, contents: list, config=None, **kwargs):
+        delay, text, usage, error = self._plan(model, contents, config)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    async def _agenerate_content_stream(self, model: str, contents: list, config=None, **kwargs):
+        delay, text, usage, error = self._plan(model, contents, config)
+        # A third of the latency passes before the first chunk, the rest is spread over the chunks
+        await asyncio.sleep(delay / 3)
+        if error:
+            raise error
+
+        async def _chunks():
+            chunk_size = 512
+            count = max(1, -(-len(text) // chunk_size))
+            for i in range(count):
+                last = i == count - 1
+                yield SimpleNamespace(text=text[i * chunk_size:(i + 1) * chunk_size], usage_metadata=usage if last else None)
+                if not last:
+                    await asyncio.sleep(2 * delay / 3 / count)
+        return _chunks()
+
+    def _upload(self, file=None, config: Optional[dict] = None, **kwargs):
+        with self._lock:
+            self._uploads += 1
+            number = self._uploads
+        mime_type = (config or {}).get("mime_type", "application/octet-stream")
+        return SimpleNamespace(name=f"files/fake-{number}", uri=f"https://fake.invalid/files/fake-{number}", mime_type=mime_type, expiration_time=None)
+
+    async def _aupload(self, file=None, config: Optional[dict] = None, **kwargs):
+        return self._upload(file=file, config=config)
@@ -0,0 +1,104 @@
+"""
+Compares input tokens and wall time of one-page-per-request transcription against packed
+requests of K consecutive pages (`Intelligence.atranscribe_pages`).
+
+By default only the input token estimate is computed (offline): the prompt is estimated at
+~4 characters per token, and each image at 258 tokens per 768x768 tile. With --live, every
+configuration is run against Gemini on synthetic pages and the reported usage_metadata and
+wall time are printed instead (needs GOOGLE_API_KEY; costs real tokens).
+
+Usage: python -m benchmarks.packing --pages 12 --k 1 2 4 6 [--live]
+"""
+import os
+import sys
+import math
+import time
+import argparse
+import tempfile
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import make_page
+from src.services import vision
+from src.services.intelligence import ContextMerger, Intelligence, split_packed_response
+from src.models.data_models import DocumentPayload, PackedDocumentPayload
+from src.utils import llm_utils
+
+def _image_tokens(width: int, height: int) -> int:
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+def _estimate(payloads: list, k: int, mode: str) -> int:
+    tokens = 0
+    for start in range(0, len(payloads), k):
+        group = payloads[start:start + k]
+        prompt = ContextMerger.get_master_prompt(mode) if len(group) == 1 else ContextMerger.get_packed_prompt(mode, len(group))
+        tokens += len(prompt) // 4 + 4 * (len(group) if len(group) > 1 else 0)
+        for payload in group:
+            image = cv2.imdecode(np.frombuffer(payload.data, np.uint8), cv2.IMREAD_UNCHANGED)
+            tokens += _image_tokens(image.shape[1], image.shape[0])
+    return tokens
+
+def _run_live(intel: Intelligence, payloads: list, k: int, mode: str) -> dict:
+    totals = {"prompt_tokens": 0, "output_tokens": 0, "requests": 0, "missing": 0}
+    start_time = time.perf_counter()
+    for start in range(0, len(payloads), k):
+        group = payloads[start:start + k]
+        parts = [intel.prepare_image(payload, inline) for payload, inline in zip(group, intel.inline_plan(group))]
+        if len(group) == 1:
+            contents, schema = [parts[0], ContextMerger.get_master_prompt(mode)], DocumentPayload
+        else:
+            contents, _ = intel.packed_contents(parts, mode)
+            schema = PackedDocumentPayload
+        response = llm_utils.generate_content(intel.client, intel.model_name, contents, llm_utils.json_config(schema))
+        usage = response.usage_metadata
+        totals["prompt_tokens"] += usage.prompt_token_count or 0
+        totals["output_tokens"] += usage.candidates_token_count or 0
+        totals["requests"] += 1
+        if len(group) > 1:
+            try:
+                packed = llm_utils.validate_with_repair(PackedDocumentPayload, response.text).model_dump()
+            except Exception:
+                packed = {}
+            totals["missing"] += len(group) - len(split_packed_response(packed, len(group)))
+    totals["seconds"] = time.perf_counter() - start_time
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 4, 6])
+    parser.add_argument("--mode", default="both", choices=["latex", "markdown", "both"])
+    parser.add_argument("--live", action="store_true", help="Call Gemini and report real usage and wall time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i in range(args.pages):
+            path = os.path.join(folder, f"BenchXImage{i + 1}.png")
+            cv2.imwrite(path, make_page(i))
+            paths.append(path)
+        payloads = list(vision.enhance_images(paths))
+    print(f"Synthetic corpus: {args.pages} enhanced pages")
+
+    if not args.live:
+        baseline = None
+        for k in args.k:
+            tokens = _estimate(payloads, k, args.mode)
+            baseline = baseline or tokens
+            print(f"K={k:<3} ~{tokens:8d} input tokens  ({tokens / args.pages:7.0f}/page, {tokens / baseline:5.2f}x of first K)")
+        return 0
+
+    intel = Intelligence()
+    for k in args.k:
+        totals = _run_live(intel, payloads, k, args.mode)
+        print(
+            f"K={k:<3} {totals['requests']:3d} requests  {totals['prompt_tokens']:8d} prompt + {totals['output_tokens']:7d} output tokens"
+            f"  {totals['seconds']:7.1f}s  ({totals['seconds'] / args.pages:5.1f}s/page)  missing pages: {totals['missing']}"
+        )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Offline end-to-end benchmark of the pipeline against a fake Gemini backend.
+
+Generates a synthetic corpus (multi-page PDFs and loose TitleXImageN.png pages rendered with
+`cv2.putText`), then times each stage on it: `vision.process_pdf`, `vision.enhance_image`,
+`vision.get_image_grouping` (cold and warm index), the `Memory` cache, the transcription
+loop (`Intelligence.transcribe_many` on `benchmarks.fake_genai.FakeGenaiClient`), output
+assembly (`latex` / `markdown`), and finally the CLI flow end to end on a fresh copy.
+Each stage reports pages/sec and the peak RSS reached so far. No API key or quota is used.
+
+--json writes the results; --baseline compares against an earlier --json file and exits
+with status 1 when a stage got slower (or peak RSS grew) by more than --tolerance.
+
+Usage: python -m benchmarks.pipeline --pdfs 2 --pdf-pages 8 --images 16 --latency 0.5 --error-rate 0.02 [--json out.json] [--baseline base.json]
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+from pathlib import Path
+
+# Keep the run self-contained and the fake backend the only bottleneck (override via env)
+os.environ.setdefault("GEMINI_RPM", "1000000")
+os.environ.setdefault("GEMINI_TPM", "1000000000000")
+os.environ.setdefault("RESULT_CACHE", "0")
+os.environ.setdefault("ENHANCE_CACHE", "0")
+
+import cv2
+from PIL import Image
+
+from benchmarks.synthetic import make_page
+from benchmarks.fake_genai import FakeGenaiClient
+from src.services import vision
+from src.services import text_layer
+from src.services import cascade
+from src.services.intelligence import Intelligence
+from src.services.preflight import Preflight
+from src.interfaces.cli import process_group
+from src.utils import memory
+from src.utils import latex
+from src.utils import markdown
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process and its (waited-for) children, in MB."""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(max(own, children) / 1e6, 1)
+
+def _stage(results: dict, name: str, pages: int, fn, quiet: bool = True):
+    """Runs `fn()`, records pages/sec and peak RSS under `name`, and returns its result."""
+    sink = io.StringIO() if quiet else sys.stdout
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sink):
+        out = fn()
+    elapsed = time.perf_counter() - start
+    results[name] = {
+        "pages": pages,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2) if elapsed > 0 else 0.0,
+        "peak_rss_mb": _peak_rss_mb()
+    }
+    print(f"{name:<22} {pages:4d} pages in {elapsed:7.2f}s  {results[name]['pages_per_sec']:8.2f} pages/sec  peak RSS {results[name]['peak_rss_mb']:7.1f}MB")
+    return out
+
+def _write_corpus(folder: str, pdfs: int, pdf_pages: int, images: int, width: int, height: int):
+    """Writes `pdfs` PDFs of `pdf_pages` pages and `images` loose pages split over two titles."""
+    index = 0
+    for d in range(pdfs):
+        pages = []
+        for _ in range(pdf_pages):
+            page = make_page(index, width=width, height=height)
+            pages.append(Image.fromarray(cv2.cvtColor(page, cv2.COLOR_BGR2RGB)))
+            index += 1
+        pages[0].save(os.path.join(folder, f"BenchDoc{d + 1}.pdf"), "PDF", save_all=True, append_images=pages[1:], resolution=200.0)
+    for i in range(images):
+        title = "BenchNotes" if i % 2 == 0 else "BenchSlides"
+        cv2.imwrite(os.path.join(folder, f"{title}XImage{i // 2 + 1}.png"), make_page(index, width=width, height=height))
+        index += 1
+
+def _make_intelligence(args) -> Intelligence:
+    intel = Intelligence(api_key="offline-benchmark")
+    intel.client = FakeGenaiClient(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        placeholder_rate=args.placeholder_rate,
+        weak_models=intel.cascade[:-1],
+        seed=args.seed
+    )
+    return intel
+
+def _run_cli_flow(corpus: str, mode: str, intel: Intelligence) -> int:
+    """The CLI's main loop without the prompt: streamed PDFs first, then loose image groups."""
+    mem = memory.Memory(os.path.join(corpus, "processed_log.json"))
+    preflight = Preflight()
+    pdf_files = sorted(f for f in os.listdir(corpus) if f.endswith(".pdf"))
+    for pdf in pdf_files:
+        pdf_path = os.path.join(corpus, pdf)
+        text_pages, vision_pages = text_layer.split_pdf_pages(pdf_path)
+        images = vision.iter_pdf_pages(pdf_path, corpus, pages=vision_pages)
+        process_group(os.path.splitext(pdf)[0], images, Path(corpus), mode, mem, intel, preflight, text_pages=text_pages)
+    pdf_titles = {os.path.splitext(pdf)[0] for pdf in pdf_files}
+    for title, images in vision.get_image_grouping(corpus).items():
+        if title not in pdf_titles:
+            process_group(title, images, Path(corpus), mode, mem, intel, preflight)
+    processed = len(mem)
+    mem.close()
+    return processed
+
+def _compare(results: dict, baseline_path: str, tolerance: float) -> list:
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)["stages"]
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base["pages_per_sec"] and stats["pages_per_sec"] < base["pages_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {stats['pages_per_sec']} pages/sec vs {base['pages_per_sec']} in baseline")
+        if base["peak_rss_mb"] and stats["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {stats['peak_rss_mb']}MB vs {base['peak_rss_mb']}MB in baseline")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=2)
+    parser.add_argument("--pdf-pages", type=int, default=8)
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--width", type=int, default=1700)
+    parser.add_argument("--height", type=int, default=2200)
+    parser.add_argument("--mode", default="both", choices=["latex", "markdown", "both"])
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds per fake Gemini call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls failing with a 503")
+    parser.add_argument("--response-chars", type=int, default=3000, help="Characters of LaTeX per page in responses")
+    parser.add_argument("--placeholder-rate", type=float, default=0.0, help="Share of cheap-tier pages returned with placeholders (escalated)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against an earlier --json file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown / RSS growth before a stage counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+    quiet = not args.verbose
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        corpus = os.path.join(root, "corpus")
+        os.makedirs(corpus)
+        _write_corpus(corpus, args.pdfs, args.pdf_pages, args.images, args.width, args.height)
+        e2e_corpus = os.path.join(root, "e2e")
+        shutil.copytree(corpus, e2e_corpus)
+        total_pages = args.pdfs * args.pdf_pages + args.images
+        print(f"Synthetic corpus: {args.pdfs} PDFs x {args.pdf_pages} pages + {args.images} loose pages; fake latency {args.latency}s, error rate {args.error_rate:.0%}")
+
+        raster_dir = os.path.join(root, "raster")
+        pdfs = sorted(os.path.join(corpus, f) for f in os.listdir(corpus) if f.endswith(".pdf"))
+        loose = sorted(os.path.join(corpus, f) for f in os.listdir(corpus) if f.endswith(".png"))
+
+        rendered = _stage(results, "process_pdf", args.pdfs * args.pdf_pages,
+                          lambda: [path for pdf in pdfs for path in vision.process_pdf(pdf, raster_dir)], quiet)
+        pages = rendered + loose
+        payloads = _stage(results, "enhance_image", len(pages),
+                          lambda: [vision.enhance_image(path, use_cache=False) for path in pages], quiet)
+        _stage(results, "get_image_grouping", len(loose), lambda: vision.get_image_grouping(corpus), quiet)
+        _stage(results, "get_image_grouping_warm", len(loose), lambda: vision.get_image_grouping(corpus), quiet)
+
+        def _memory():
+            mem = memory.Memory(os.path.join(root, "memory_log.json"))
+            content = {"base_latex_md": {"latex": "x" * args.response_chars, "markdown": "x" * args.response_chars}}
+            for path in pages:
+                mem.mark_processed(path, content)
+            processed = sum(1 for path in pages if mem.is_processed(path))
+            mem.close()
+            return processed
+        _stage(results, "memory", len(pages), _memory, quiet)
+
+        intel = _make_intelligence(args)
+        transcribed = _stage(results, "transcribe", len(payloads), lambda: intel.transcribe_many(payloads, mode=args.mode), quiet)
+
+        def _assemble():
+            out_dir = os.path.join(root, "assembled")
+            os.makedirs(out_dir, exist_ok=True)
+            latex.generate_tex_file("Bench", [r["base_latex_md"]["latex"] or "" for r in transcribed], out_dir)
+            markdown.generate_md_file("Bench", [r["base_latex_md"]["markdown"] or "" for r in transcribed], out_dir)
+        _stage(results, "assembly", len(transcribed), _assemble, quiet)
+
+        e2e_intel = _make_intelligence(args)
+        _stage(results, "end_to_end", total_pages, lambda: _run_cli_flow(e2e_corpus, args.mode, e2e_intel), quiet)
+        print(f"Fake backend: {e2e_intel.client.stats['calls']} calls, {e2e_intel.client.stats['errors']} injected errors in the end-to-end run; cascade: {json.dumps(e2e_intel.cascade_stats.summary()['escalations'])} escalations")
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "baseline", "verbose")},
+        "cascade": cascade.MODEL_CASCADE,
+        "stages": results
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+    if args.baseline:
+        regressions = _compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No stage regressed by more than {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
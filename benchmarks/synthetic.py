@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+
+WORDS = ["theorem", "lemma", "proof", "velocity", "integral", "matrix", "vector", "limit", "series", "function"]
+EQUATIONS = ["f(x) = x^2 + 2x + 1", "E = m c^2", "a^2 + b^2 = c^2", "dy/dx = k y", "sum 1/n^2 = pi^2/6"]
+
+def make_page(index: int, width: int = 1700, height: int = 2200, noise: float = 12.0, seed: int = 0) -> np.ndarray:
+    """
+    Renders a synthetic scanned page with `cv2.putText`: a heading, lines of words,
+    a few "equations", and Gaussian sensor noise. Deterministic for a given index and seed.
+    """
+    rng = np.random.default_rng(seed + index)
+    page = np.full((height, width, 3), 245, dtype=np.uint8)
+
+    cv2.putText(page, f"Chapter {index + 1}", (120, 180), cv2.FONT_HERSHEY_DUPLEX, 2.4, (20, 20, 20), 4, cv2.LINE_AA)
+
+    y = 300
+    line = 0
+    while y < height - 150:
+        if line % 6 == 5:
+            text = EQUATIONS[int(rng.integers(len(EQUATIONS)))]
+            cv2.putText(page, text, (300, y), cv2.FONT_HERSHEY_COMPLEX_SMALL, 2.0, (10, 10, 10), 2, cv2.LINE_AA)
+        else:
+            text = " ".join(WORDS[i] for i in rng.integers(len(WORDS), size=6))
+            cv2.putText(page, text, (120, y), cv2.FONT_HERSHEY_SIMPLEX, 1.3, (30, 30, 30), 2, cv2.LINE_AA)
+        y += 70
+        line += 1
+
+    if noise > 0:
+        grain = rng.normal(0, noise, page.shape)
+        page = np.clip(page.astype(np.float32) + grain, 0, 255).astype(np.uint8)
+    return page
+
+def make_pages(count: int, **kwargs) -> list:
+    """Returns `count` synthetic pages as BGR ndarrays."""
+    return [make_page(i, **kwargs) for i in range(count)]
@@ -1,11 +1,160 @@
 import sys
+import time
 from pathlib import Path
 from src.services import vision
 from src.utils import memory
 from src.services import intelligence
+from src.services.preflight import Preflight, blank_page_content
+from src.services import text_layer
+from src.utils.image_index import parse_image_name
 from src.utils import latex
 from src.utils import markdown
-import time
+from src.utils import llm_utils
+from src.utils import hedging
+from src.utils import result_cache
+from src.utils import usage
+
+def process_group(title, images, source_dir, mode, mem, intel, preflight, text_pages=None):
+    """
+    Transcribes one group of page images and writes its outputs.
+    `images` may be a lazy iterator (e.g. `vision.iter_pdf_pages`), in which case
+    pages are enhanced and uploaded while later pages are still being rendered.
+    `text_pages` are born-digital PDF pages from the text-layer pre-pass; they are
+    structured from their embedded text and merged back in page order.
+    """
+    print(f"\n--- Processing Group: {title} ---")
+    latex_list = []
+    markdown_list = []
+    
+    # Setup Output Directories
+    doc_dir = source_dir / title
+    fig_dir = doc_dir / "figures"
+    latex_dir = doc_dir / "latex"
+    md_dir = doc_dir / "markdown"
+    
+    fig_dir.mkdir(parents=True, exist_ok=True)
+    latex_dir.mkdir(parents=True, exist_ok=True)
+    md_dir.mkdir(parents=True, exist_ok=True)
+
+    pages = []
+    contents = {}
+    page_numbers = {}
+
+    for page in text_pages or []:
+        # The extracted text is kept next to the figures so Memory can track it like a page image
+        text_path = fig_dir / f"{title}XImage{page['page']}.txt"
+        structured_text_path = str(text_path)
+        page_numbers[structured_text_path] = page["page"]
+        if text_path.exists() and text_path.read_text(encoding="utf-8") == page["text"] and mem.is_processed(structured_text_path):
+            print(f"Loading cached: {text_path.name}")
+            contents[structured_text_path] = mem.get_cached_content(structured_text_path)
+            continue
+        text_path.write_text(page["text"], encoding="utf-8")
+        print(f"Processing (text layer): {text_path.name}")
+        content = text_layer.transcribe_text_page(intel, page, mode, text_path.name)
+        mem.mark_processed(structured_text_path, content)
+        contents[structured_text_path] = content
+
+    def _pending_pages():
+        """Moves each page into place and yields only those that still need the API."""
+        for img_path_str in images:
+            img_path = Path(img_path_str)
+            # Move image to its structured figures folder to keep root clean
+            new_img_path = fig_dir / img_path.name
+            if img_path.exists() and img_path != new_img_path:
+                img_path.rename(new_img_path)
+            
+            structured_img_path = str(new_img_path)
+            pages.append(structured_img_path)
+            page_numbers[structured_img_path] = parse_image_name(new_img_path.name)[1] or len(pages)
+
+            if mem.is_processed(structured_img_path):
+                print(f"Loading cached: {new_img_path.name}")
+                contents[structured_img_path] = mem.get_cached_content(structured_img_path)
+            else:
+                print(f"Processing: {new_img_path.name}")
+                yield structured_img_path
+
+    skipped = {}
+
+    def _api_pages():
+        """Enhances pending pages on the process pool (in memory, no temp files) and yields those the API must see."""
+        for enhanced in vision.enhance_images(_pending_pages()):
+            structured_img_path = enhanced.source_path
+            if enhanced.original_bytes:
+                print(f"  Payload {Path(structured_img_path).name}: {enhanced.original_bytes // 1024}KB -> {len(enhanced.data) // 1024}KB ({enhanced.encoding}, {enhanced.enhancement} enhancement)")
+
+            # Skip blank pages and reuse transcriptions of repeated pages
+            decision, original_path = preflight.check(enhanced, structured_img_path)
+            if decision == "blank":
+                print(f"  Skipping blank page: {Path(structured_img_path).name}")
+                skipped[structured_img_path] = None
+            elif decision == "duplicate":
+                print(f"  Duplicate of {Path(original_path).name}, reusing its transcription")
+                skipped[structured_img_path] = original_path
+            else:
+                yield enhanced
+
+    def _save(index, enhanced, content):
+        contents[enhanced.source_path] = content
+        # Save to Memory as soon as each page finishes, so an interrupted run resumes here
+        mem.mark_processed(enhanced.source_path, content)
+
+    # Transcribe concurrently; pages are pulled from the pipeline as request slots free up
+    intel.transcribe_many(_api_pages(), mode=mode, on_result=_save)
+
+    for structured_img_path, original_path in skipped.items():
+        if original_path is None:
+            content = blank_page_content()
+        else:
+            content = contents.get(original_path) or mem.get_cached_content(original_path)
+        mem.mark_processed(structured_img_path, content)
+        contents[structured_img_path] = content
+
+    if text_pages:
+        pages = sorted(pages + [path for path in page_numbers if path not in pages], key=page_numbers.get)
+
+    for structured_img_path in pages:
+        content = contents[structured_img_path]
+        img_basename = Path(structured_img_path).name
+
+        # Separate content
+        if isinstance(content, dict):
+            base_info = content.get("base_latex_md", {})
+            annotations = content.get("annotations_metadata", [])
+            
+            # Save annotations to a separate markdown file
+            if annotations:
+                anno_path = md_dir / f"{title}_annotations.md"
+                with open(anno_path, "a") as f:
+                    f.write(f"\n## Annotations for {img_basename}\n")
+                    for anno in annotations:
+                        f.write(f"- **{anno.get('category')}**: {anno.get('content')} ({anno.get('context')})\n")
+            
+            if mode in ["latex", "both"]:
+                latex_list.append(base_info.get("latex", ""))
+            if mode in ["markdown", "both"]:
+                markdown_list.append(base_info.get("markdown", ""))
+        else:
+            # Fallback for old cached strings
+            if mode in ["latex", "both"]:
+                latex_list.append(content)
+            if mode in ["markdown", "both"]:
+                markdown_list.append("*(Markdown not generated for this cached page)*\n\n```latex\n" + str(content) + "\n```")
+
+    # Commit this document's progress before writing its outputs
+    mem.flush()
+
+    # Generate Output
+    if mode in ["latex", "both"]:
+        tex_output_path = latex.generate_tex_file(title, latex_list, str(latex_dir))
+        if tex_output_path:
+            print(f"Generated LaTeX: {tex_output_path}")
+        
+    if mode in ["markdown", "both"]:
+        md_output_path = markdown.generate_md_file(title, markdown_list, str(md_dir))
+        if md_output_path:
+            print(f"Generated Markdown: {md_output_path}")
 
 def main():
     if len(sys.argv) < 2:
@@ -38,108 +187,66 @@ def main():
         sys.exit(1)
 
     print(f"Processing directory: {source_dir}")
+    # Gemini calls are accounted to this run and to the document they belong to (see `usage`)
+    job_id = f"cli-{time.strftime('%Y%m%d-%H%M%S')}"
+    # Shared across groups so a cover sheet repeated in several documents is only sent once
+    preflight = Preflight()
 
-    # 1. Pre-processing
+    # 1. PDFs are streamed: each page is transcribed as soon as it is rendered
     pdf_files = list(source_dir.glob('*.pdf'))
     
     for pdf in pdf_files:
         print(f"Found PDF: {pdf.name}. Converting to images...")
-        vision.process_pdf(str(pdf), str(source_dir))
+        # Born-digital pages skip rasterization; only math/figure and scanned pages are rendered
+        text_pages, vision_pages = text_layer.split_pdf_pages(pdf)
+        images = vision.iter_pdf_pages(str(pdf), str(source_dir), pages=vision_pages)
+        with usage.scope(job=job_id, document=pdf.stem):
+            process_group(pdf.stem, images, source_dir, mode, mem, intel, preflight, text_pages=text_pages)
 
-    # 2. Grouping
+    # 2. Grouping of loose images
+    pdf_titles = {pdf.stem for pdf in pdf_files}
     groups = vision.get_image_grouping(str(source_dir))
-    if not groups:
+    if not groups and not pdf_files:
         print("No images found matching pattern 'TitleXImageY.format'.")
 
     # 3. Processing Loop
     for title, images in groups.items():
-        print(f"\n--- Processing Group: {title} ({len(images)} images) ---")
-        latex_list = []
-        markdown_list = []
-        
-        # Setup Output Directories
-        doc_dir = source_dir / title
-        fig_dir = doc_dir / "figures"
-        latex_dir = doc_dir / "latex"
-        md_dir = doc_dir / "markdown"
-        
-        fig_dir.mkdir(parents=True, exist_ok=True)
-        latex_dir.mkdir(parents=True, exist_ok=True)
-        md_dir.mkdir(parents=True, exist_ok=True)
-
-        for img_path_str in images:
-            img_path = Path(img_path_str)
-            # Move image to its structured figures folder to keep root clean
-            new_img_path = fig_dir / img_path.name
-            if img_path.exists() and img_path != new_img_path:
-                img_path.rename(new_img_path)
-            
-            structured_img_path = str(new_img_path)
-            img_basename = new_img_path.name
-
-            if mem.is_processed(structured_img_path):
-                print(f"Loading cached: {img_basename}")
-                content = mem.get_cached_content(structured_img_path)
-            else:
-                print(f"Processing: {img_basename}")
-                
-                # Enhance
-                enhanced_path = vision.enhance_image(structured_img_path)
-                
-                # Transcribe
-                content = intel.transcribe_image(enhanced_path, mode=mode)
-                
-                # Cleanup enhanced temp file
-                if enhanced_path != structured_img_path and "_enhanced" in enhanced_path:
-                    try:
-                        Path(enhanced_path).unlink()
-                    except:
-                        pass
-                
-                # Save to Memory
-                mem.mark_processed(structured_img_path, content)
-                
-                # Rate limit to be nice to API
-                time.sleep(1) 
-
-            # Separate content
-            if isinstance(content, dict):
-                base_info = content.get("base_latex_md", {})
-                annotations = content.get("annotations_metadata", [])
-                
-                # Save annotations to a separate markdown file
-                if annotations:
-                    anno_path = md_dir / f"{title}_annotations.md"
-                    with open(anno_path, "a") as f:
-                        f.write(f"\n## Annotations for {img_basename}\n")
-                        for anno in annotations:
-                            f.write(f"- **{anno.get('category')}**: {anno.get('content')} ({anno.get('context')})\n")
-                
-                if mode in ["latex", "both"]:
-                    latex_list.append(base_info.get("latex", ""))
-                if mode in ["markdown", "both"]:
-                    markdown_list.append(base_info.get("markdown", ""))
-            else:
-                # Fallback for old cached strings
-                if mode in ["latex", "both"]:
-                    latex_list.append(content)
-                if mode in ["markdown", "both"]:
-                    markdown_list.append("*(Markdown not generated for this cached page)*\n\n```latex\n" + str(content) + "\n```")
-
-        # 4. Generate Output
-        if mode in ["latex", "both"]:
-            tex_output_path = latex.generate_tex_file(title, latex_list, str(latex_dir))
-            if tex_output_path:
-                print(f"Generated LaTeX: {tex_output_path}")
-            
-        if mode in ["markdown", "both"]:
-            md_output_path = markdown.generate_md_file(title, markdown_list, str(md_dir))
-            if md_output_path:
-                print(f"Generated Markdown: {md_output_path}")
+        if title in pdf_titles:
+            # This title was already produced by a streamed PDF above
+            print(f"Skipping group '{title}': already generated from {title}.pdf")
+            continue
+        with usage.scope(job=job_id, document=title):
+            process_group(title, images, source_dir, mode, mem, intel, preflight)
 
-    # 5. Final Report
+    # 4. Final Report
     print("\n" + "="*30)
     print("Processing Complete.")
+    summary = preflight.summary()
+    if summary["api_calls_saved"]:
+        print(f"Pre-flight skipped {summary['blank']} blank and {summary['duplicate']} duplicate pages ({summary['api_calls_saved']} API calls saved).")
+    parse_stats = llm_utils.parse_stats()
+    if parse_stats["responses"]:
+        print(f"JSON responses: {parse_stats['clean']} clean, {parse_stats['repaired']} repaired locally ({parse_stats['repair_rate']:.0%}), {parse_stats['retried']} model retries ({parse_stats['retry_rate']:.0%}).")
+    if hedging.HEDGE_REQUESTS:
+        hedge_stats = hedging.get_hedger().summary()
+        print(f"Hedged {hedge_stats['hedged']} of {hedge_stats['calls']} requests ({hedge_stats['hedge_rate']:.0%}); the duplicate won {hedge_stats['win_rate']:.0%} of the time.")
+    cache = result_cache.get_cache()
+    if cache and cache.stats["hits"]:
+        cache_stats = cache.summary()
+        print(f"Result cache: {cache_stats['hits']} pages reused ({cache_stats['hit_rate']:.0%} of lookups), {cache_stats['stored']} new results stored.")
+    cascade_stats = intel.cascade_stats.summary()
+    if cascade_stats["pages"]:
+        for tier, stats in cascade_stats["tiers"].items():
+            print(f"Model {tier}: served {stats['pages_served']} pages in {stats['calls']} calls, {stats['seconds']:.0f}s, {stats['prompt_tokens']} prompt + {stats['output_tokens']} output tokens.")
+        if cascade_stats["escalations"]:
+            print("Escalations: " + ", ".join(f"{reason} x{count}" for reason, count in cascade_stats["escalations"].items()))
+    usage_stats = usage.get_tracker().summary(job_id)
+    if usage_stats["totals"]["calls"]:
+        totals = usage_stats["totals"]
+        print(f"Gemini usage: {totals['calls']:.0f} calls ({totals['retries']:.0f} retries, {totals['errors']:.0f} errors), {totals['prompt_tokens']:.0f} prompt ({totals['cached_tokens']:.0f} cached) + {totals['output_tokens'] + totals['thinking_tokens']:.0f} output tokens, {totals['seconds']:.0f}s, ~${totals['cost_usd']:.2f}.")
+        for document, stats in usage_stats["documents"].items():
+            print(f"  {document}: {stats['totals']['calls']:.0f} calls, {stats['totals']['seconds']:.0f}s, ~${stats['totals']['cost_usd']:.2f}")
+    usage.get_tracker().flush()
     if mode in ["latex", "both"]:
         print("Add the following packages to your main LaTeX document:")
         print(latex.get_packages_block())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Dict
 
 class AnnotationMetadata(BaseModel):
     category: str = Field(description="Classification: handwritten_note, highlight, margin_clue, or user_proof")
@@ -13,3 +13,30 @@ class BaseLatexMd(BaseModel):
 class DocumentPayload(BaseModel):
     base_latex_md: BaseLatexMd
     annotations_metadata: List[AnnotationMetadata]
+
+class PackedPage(DocumentPayload):
+    page_index: int = Field(description="0-based position of this page among the images sent in the request")
+
+class PackedDocumentPayload(BaseModel):
+    """Response schema for packed requests carrying several consecutive pages."""
+    pages: List[PackedPage]
+
+class PageSignature(BaseModel):
+    """Cheap fingerprint of a page used to skip blank pages and reuse near-duplicate transcriptions."""
+    phash: str = Field(description="64-bit DCT perceptual hash, hex encoded")
+    ink_density: float = Field(description="Fraction of the page covered by ink")
+    thumbnail: str = Field(description="Base64 PNG of a small grayscale thumbnail, used to confirm duplicates")
+
+class ImagePayload(BaseModel):
+    """An encoded page image held in memory, sent to Gemini inline or via an in-memory upload."""
+    data: bytes = Field(description="Encoded image bytes (e.g. from cv2.imencode)")
+    mime_type: str = Field(default="image/png", description="MIME type of `data`")
+    source_path: Optional[str] = Field(default=None, description="Path of the original page image, if any")
+    encoding: str = Field(default="png", description="Encoding chosen by the payload optimizer (e.g. png-1bit, webp-lossless)")
+    original_bytes: Optional[int] = Field(default=None, description="Size of the plain 8-bit PNG encoding, for reporting savings")
+    enhancement: str = Field(default="full", description="Enhancement level applied: full, light, none, or original (pipeline skipped)")
+    quality: Optional[Dict[str, float]] = Field(default=None, description="Page quality estimate that drove the enhancement decision")
+    signature: Optional[PageSignature] = Field(default=None, description="Perceptual hash and ink density of the source page")
+    original_size: Optional[List[int]] = Field(default=None, description="[width, height] of the source page in pixels")
+    crop_box: Optional[List[int]] = Field(default=None, description="[x, y, width, height] of the sent region in source page coordinates")
+    scale: float = Field(default=1.0, description="Downscale factor applied after cropping (encoded pixels per source pixel)")
@@ -1,17 +1,29 @@
 import os
 import json
-import time
+import base64
 from pathlib import Path
-from typing import List, Dict, Any
-from google import genai
+from types import SimpleNamespace
+from typing import List, Dict, Any, Iterable, Union, Optional
 from google.genai import types
 from dotenv import load_dotenv
 
-from src.models.data_models import DocumentPayload
-from src.services.intelligence import ContextMerger
+from src.models.data_models import DocumentPayload, ImagePayload
+from src.services.intelligence import ContextMerger, image_label, is_error_payload
+from src.services.preflight import Preflight
+from src.services import text_layer
+from src.services import cascade
+from src.utils import rate_limiter
+from src.utils import llm_utils
+from src.utils import client_pool
+from src.utils import upload_registry
+from src.utils import result_cache
+from src.utils import usage
 
 load_dotenv()
 
+# Pages up to this size are embedded in the batch JSONL as data URLs instead of being uploaded.
+BATCH_INLINE_IMAGE_MAX_BYTES = int(os.getenv("BATCH_INLINE_IMAGE_MAX_BYTES", str(512 * 1024)))
+
 class BatchProcessor:
     """
     Manages the creation and submission of Gemini Batch API jobs for massive document directories.
@@ -20,41 +32,127 @@ class BatchProcessor:
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY not found.")
-        self.client = genai.Client(api_key=self.api_key)
-        self.model_name = 'gemini-3.1-pro-preview'
+        # Borrowed from the process-wide pool so calls reuse warm keep-alive connections
+        self.client = client_pool.get_client(self.api_key)
+        # Batch jobs cannot escalate a page within a run, so they default to the strongest cascade tier
+        self.model_name = os.getenv("BATCH_MODEL") or (cascade.MODEL_CASCADE or ['gemini-3.1-pro-preview'])[-1]
+
+    def _stage_image(self, image: Union[str, ImagePayload]) -> str:
+        """
+        Returns the URL a batch request should reference for this page: a data URL for
+        small in-memory payloads, otherwise the Gemini file URI. Uploads go through the
+        upload registry, so pages already on Gemini from an earlier run are not sent again.
+        """
+        if isinstance(image, ImagePayload):
+            if len(image.data) <= BATCH_INLINE_IMAGE_MAX_BYTES:
+                return f"data:{image.mime_type};base64,{base64.b64encode(image.data).decode('ascii')}"
+            entry = upload_registry.get_registry().upload(self.client, self.api_key, image.data, image.mime_type, image_label(image))
+        else:
+            entry = upload_registry.get_registry().upload(self.client, self.api_key, image, display_name=image_label(image))
+        return entry["uri"]
 
-    def process_directory_batch(self, image_paths: List[str], mode: str) -> Dict[str, Any]:
+    def process_directory_batch(self, image_paths: Iterable[Union[str, ImagePayload]], mode: str, text_pages: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
-        Takes a list of images, uploads them to Gemini Files, creates a JSONL buffer,
+        Takes a list (or a lazy iterator, e.g. `vision.iter_pdf_pages`) of image paths
+        or in-memory `ImagePayload`s,
+        uploads them to Gemini Files, creates a JSONL buffer,
         and submits the batch job. Returns the Batch Job Metadata.
+        Pages are staged as soon as the iterator yields them. Blank and near-duplicate
+        payloads are left out of the job and listed under `skipped_pages`, which
+        `download_and_extract_results` uses to fill them back in.
+        `text_pages` ({"label", "text"} entries from the text-layer pre-pass) become
+        text-only requests, or are structured locally when TEXT_LAYER_MODE is "local".
+        Pages found in the result cache are not sent either; they are listed under
+        `skipped_pages["cached"]`, and the cache keys of the submitted pages under
+        `skipped_pages["result_cache_keys"]` so their results are cached on extraction.
         """
-        if not image_paths:
+        text_pages = text_pages or []
+        if isinstance(image_paths, (list, tuple)) and not image_paths and not text_pages:
             return {"status": "error", "message": "No images provided for batching."}
 
         master_prompt = ContextMerger.get_master_prompt(mode)
         jsonl_lines = []
         
-        print(f"Preparing batch job for {len(image_paths)} files...")
+        print("Preparing batch job...")
         
         # 1. Upload files securely for the batch
         uploaded_files = []
+        seen_any = False
+        # "before" is the plain PNG size, only known when every payload measured it (PAYLOAD_REPORT_SAVINGS)
+        payload_bytes = {"before": 0, "after": 0}
+        preflight = Preflight()
+        skipped_pages = {"blank": [], "duplicates": {}, "text": {}, "cached": {}, "result_cache_keys": {}}
+        if text_layer.TEXT_LAYER_MODE == "local":
+            for page in text_pages:
+                skipped_pages["text"][page["label"]] = text_layer.text_page_content(page["text"])
+            text_pages = []
+        cache = result_cache.get_cache()
+        # Results from the batch model or any interactive cascade tier are good enough to reuse
+        cache_models = list(dict.fromkeys([self.model_name] + cascade.MODEL_CASCADE[::-1]))
+
+        def _cached(label: str, source, prompt: str) -> bool:
+            """Records the page's cache key and returns True when its result is already cached."""
+            if cache is None:
+                return False
+            content_hash = cache.content_hash(source)
+            cached = cache.lookup(content_hash, mode, cache_models, prompt)
+            if cached is not None:
+                skipped_pages["cached"][label] = cached
+                print(f"Reusing cached result for {label}.")
+                return True
+            skipped_pages["result_cache_keys"][label] = cache.make_key(content_hash, mode, self.model_name, prompt)
+            return False
+
+        if text_pages:
+            text_prompt = ContextMerger.get_text_prompt(mode)
+            text_pages = [page for page in text_pages if not _cached(page["label"], page["text"].encode("utf-8"), text_prompt)]
         for path in image_paths:
+            seen_any = True
+            if isinstance(path, ImagePayload):
+                decision, original = preflight.check(path, image_label(path))
+                if decision == "blank":
+                    skipped_pages["blank"].append(image_label(path))
+                    print(f"Skipping blank page {image_label(path)}.")
+                    continue
+                if decision == "duplicate":
+                    skipped_pages["duplicates"][image_label(path)] = original
+                    print(f"Skipping {image_label(path)}: duplicate of {original}.")
+                    continue
+            if _cached(image_label(path), path.data if isinstance(path, ImagePayload) else path, master_prompt):
+                continue
             try:
-                # In production, check if file exists on Gemini first, but for now upload
-                f_ref = self.client.files.upload(file=path)
-                uploaded_files.append((path, f_ref))
-                print(f"Uploaded {os.path.basename(path)} to staging.")
-                time.sleep(1) # Be nice to the API rate limits during staging
+                uploaded_files.append((image_label(path), self._stage_image(path)))
+                if isinstance(path, ImagePayload):
+                    payload_bytes["after"] += len(path.data)
+                    if path.original_bytes is None or payload_bytes["before"] is None:
+                        payload_bytes["before"] = None
+                    else:
+                        payload_bytes["before"] += path.original_bytes
+                print(f"Staged {image_label(path)}.")
             except Exception as e:
-                print(f"Failed to stage {path}: {e}")
+                print(f"Failed to stage {image_label(path)}: {e}")
+
+        if not seen_any and not skipped_pages["text"] and not skipped_pages["cached"] and not text_pages:
+            return {"status": "error", "message": "No images provided for batching."}
 
-        if not uploaded_files:
+        if not uploaded_files and not text_pages:
+            if skipped_pages["text"]:
+                return {"status": "error", "message": "Every page was structured locally from its text layer; nothing to transcribe.", "skipped_pages": skipped_pages}
+            if skipped_pages["cached"]:
+                return {"status": "error", "message": "Every page was already in the result cache; nothing to transcribe.", "skipped_pages": skipped_pages}
+            if preflight.calls_saved:
+                return {"status": "error", "message": "Every page was blank or a duplicate; nothing to transcribe.", "skipped_pages": skipped_pages}
             return {"status": "error", "message": "Failed to upload any files to staging."}
 
+        if payload_bytes["before"]:
+            print(f"Staged {payload_bytes['after'] / 1e6:.1f}MB of page payloads (plain PNG would have been {payload_bytes['before'] / 1e6:.1f}MB).")
+        elif payload_bytes["after"]:
+            print(f"Staged {payload_bytes['after'] / 1e6:.1f}MB of page payloads.")
+
         # 2. Construct JSONL payload
-        for local_path, file_ref in uploaded_files:
+        for page_name, image_url in uploaded_files:
             # The custom ID allows us to map the async result back to the specific image
-            request_id = os.path.basename(local_path)
+            request_id = page_name
             
             # The structure dictated by the Gemini Batch API
             request = {
@@ -70,7 +168,7 @@ class BatchProcessor:
                                 {"type": "text", "text": master_prompt},
                                 {
                                     "type": "image_url", 
-                                    "image_url": {"url": file_ref.uri} # Note: Check if Gemini supports file_ref.uri in OpenAI compat mode, if not fallback to generic Google url. Or standard Gemini batch format may just map this strictly.
+                                    "image_url": {"url": image_url} # Note: Check if Gemini supports file URIs in OpenAI compat mode, if not fallback to generic Google url. Or standard Gemini batch format may just map this strictly.
                                 }
                             ]
                         }
@@ -80,6 +178,22 @@ class BatchProcessor:
             }
             jsonl_lines.append(json.dumps(request))
 
+        # Born-digital pages: the embedded text replaces the image entirely
+        for page in text_pages:
+            request = {
+                "custom_id": page["label"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model_name,
+                    "messages": [
+                        {"role": "user", "content": [{"type": "text", "text": text_prompt + page["text"]}]}
+                    ],
+                    "response_format": {"type": "json_object"}
+                }
+            }
+            jsonl_lines.append(json.dumps(request))
+
         # 3. Create the JSONL file locally temporarily
         batch_input_path = "temp_batch_input.jsonl"
         with open(batch_input_path, "w") as f:
@@ -87,14 +201,16 @@ class BatchProcessor:
 
         # 4. Upload the JSONL definition to Gemini
         try:
-            batch_input_file = self.client.files.upload(
+            batch_input_file = rate_limiter.get_limiter().call(
+                self.client.files.upload,
                 file=batch_input_path,
                 config={"mime_type": "application/jsonl"}
             )
             print(f"Uploaded JSONL definition. Triggering Job...")
             
             # 5. Execute Job
-            batch_job = self.client.batches.create(
+            batch_job = rate_limiter.get_limiter().call(
+                self.client.batches.create,
                 model=self.model_name,
                 src=batch_input_file.name
             )
@@ -107,7 +223,10 @@ class BatchProcessor:
                 "status": "processing_background",
                 "job_id": batch_job.name,
                 "job_state": batch_job.state,
-                "message": f"Successfully queued {len(uploaded_files)} pages. Job ID: {batch_job.name}. Please inform user and check status later."
+                "payload_bytes": payload_bytes,
+                "preflight": preflight.summary(),
+                "skipped_pages": skipped_pages,
+                "message": f"Successfully queued {len(uploaded_files) + len(text_pages)} pages. Job ID: {batch_job.name}. Please inform user and check status later."
             }
             
         except Exception as e:
@@ -118,7 +237,7 @@ class BatchProcessor:
     def check_job_status(self, job_name: str) -> Dict[str, Any]:
         """Polls the API for the batch status."""
         try:
-            job = self.client.batches.get(name=job_name)
+            job = rate_limiter.get_limiter().call(self.client.batches.get, name=job_name)
             
             if job.state == "SUCCEEDED":
                 # We can download the output file
@@ -142,23 +261,65 @@ class BatchProcessor:
         except Exception as e:
              return {"status": "error", "message": str(e)}
 
-    def download_and_extract_results(self, job_name: str, output_format: str, output_dir: str) -> str:
-        """Downloads the batch results and extracts latex or markdown in sorted order."""
+    @staticmethod
+    def _page_number(custom_id: str, fallback: int) -> int:
+        # Parse page number using basic regex
+        # Matches XImage123.png, page-123.jpg, file_123.png
+        import re
+        match = re.search(r'(?:Image|page|file)[_-]?(\d+)', custom_id, re.IGNORECASE)
+        return int(match.group(1)) if match else fallback
+
+    def _record_usage(self, job_name: str, custom_id: str, data: Dict[str, Any]):
+        """Accounts one batch result's token usage to the job (at the batch price, see `usage`)."""
+        body = data.get('response', {}).get('body', {})
+        counts = body.get('usage') or {}
+        usage_metadata = SimpleNamespace(
+            prompt_token_count=counts.get('prompt_tokens', 0),
+            cached_content_token_count=(counts.get('prompt_tokens_details') or {}).get('cached_tokens', 0),
+            candidates_token_count=counts.get('completion_tokens', 0)
+        )
+        with usage.scope(job=job_name, document=job_name, page=custom_id):
+            usage.get_tracker().record(
+                (body.get('model') or self.model_name).split('/')[-1], usage_metadata,
+                error=None if body.get('choices') else "batch", batch=True
+            )
+
+    @staticmethod
+    def _cache_result(cache, key: str, content_str: str):
+        """Caches a batch result only if it validates as a DocumentPayload and is not an error, like the sync path."""
         try:
-            job = self.client.batches.get(name=job_name)
+            payload = llm_utils.validate_with_repair(DocumentPayload, content_str).model_dump()
+        except Exception as e:
+            print(f"Not caching invalid batch result: {e}")
+            return
+        if not is_error_payload(payload):
+            cache.put(key, payload)
+
+    def download_and_extract_results(self, job_name: str, output_format: str, output_dir: str, skipped_pages: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Downloads the batch results and extracts latex or markdown in sorted order.
+        `skipped_pages` (from `process_directory_batch`) restores pages the pre-flight
+        stage left out: blank pages stay empty, duplicates copy their original's text,
+        and text-layer pages structured locally or found in the result cache are taken as
+        they are. Results of submitted pages are written to the result cache.
+        """
+        skipped_pages = skipped_pages or {}
+        cache = result_cache.get_cache()
+        cache_keys = skipped_pages.get("result_cache_keys", {}) if cache else {}
+        try:
+            job = rate_limiter.get_limiter().call(self.client.batches.get, name=job_name)
             if str(job.state) != "JobState.JOB_STATE_SUCCEEDED":
                 return f"Job is not completed yet. Current state: {job.state}"
             
             file_name = job.dest.file_name
             print(f"Downloading {file_name}...")
-            content = self.client.files.download(file=file_name)
+            content = rate_limiter.get_limiter().call(self.client.files.download, file=file_name)
             
             raw_path = os.path.join(output_dir, "raw_batch_results.jsonl")
             with open(raw_path, "wb") as f:
                 f.write(content)
                 
             import json
-            import re
             final_files = []
             formats_to_extract = ["latex", "markdown"] if output_format == "both" else [output_format]
             
@@ -167,6 +328,7 @@ class BatchProcessor:
                 out_path = os.path.join(output_dir, f"extracted_document{ext}")
                 
                 pages_data = {}
+                page_of_id = {}
                 
                 with open(raw_path, 'r', encoding='utf-8') as f_in:
                     for line_num, line in enumerate(f_in, 1):
@@ -176,24 +338,19 @@ class BatchProcessor:
                             data = json.loads(line)
                             custom_id = data.get('custom_id', '')
                             
-                            # Parse page number using basic regex
-                            # Matches XImage123.png, page-123.jpg, file_123.png
-                            match = re.search(r'(?:Image|page|file)[_-]?(\d+)', custom_id, re.IGNORECASE)
-                            if match:
-                                page_num = int(match.group(1))
-                            else:
-                                page_num = line_num
+                            page_num = self._page_number(custom_id, line_num)
+                            page_of_id[custom_id] = page_num
+                            if fmt == formats_to_extract[0]:
+                                self._record_usage(job_name, custom_id, data)
                                 
                             content_str = data.get('response', {}).get('body', {}).get('choices', [{}])[0].get('message', {}).get('content', '')
                             if not content_str: continue
                             
-                            content_str = content_str.strip()
-                            if content_str.startswith('```json'): content_str = content_str[7:]
-                            if content_str.startswith('```'): content_str = content_str[3:]
-                            if content_str.endswith('```'): content_str = content_str[:-3]
-                            
-                            content_json = json.loads(content_str)
+                            # Strips code fences and repairs LaTeX escapes / truncation locally
+                            content_json = llm_utils.loads_with_repair(content_str)
                             base = content_json.get('base_latex_md')
+                            if fmt == formats_to_extract[0] and custom_id in cache_keys:
+                                self._cache_result(cache, cache_keys[custom_id], content_str)
                             
                             extracted_text = ""
                             if isinstance(base, dict):
@@ -207,6 +364,18 @@ class BatchProcessor:
                         except Exception as e:
                             pass
                             
+                restored = {**skipped_pages.get("text", {}), **skipped_pages.get("cached", {})}
+                for text_id, text_content in restored.items():
+                    base = text_content.get("base_latex_md", {})
+                    page_of_id[text_id] = self._page_number(text_id, 0)
+                    pages_data[page_of_id[text_id]] = base.get(fmt, "")
+                for blank_id in skipped_pages.get("blank", []):
+                    pages_data.setdefault(self._page_number(blank_id, 0), "")
+                for duplicate_id, original_id in skipped_pages.get("duplicates", {}).items():
+                    original_page = page_of_id.get(original_id)
+                    if original_page in pages_data:
+                        pages_data[self._page_number(duplicate_id, 0)] = pages_data[original_page]
+
                 if pages_data:
                     min_page = min(pages_data.keys())
                     max_page = max(pages_data.keys())
@@ -0,0 +1,102 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from src.models.data_models import ImagePayload
+
+# Models tried in order for each page; a page only moves to the next tier when the result fails a check.
+MODEL_CASCADE = [m.strip() for m in os.getenv("MODEL_CASCADE", "gemini-3-flash-preview,gemini-3.1-pro-preview").split(",") if m.strip()]
+
+PLACEHOLDER = "[COMPLEX/OMITTED CONTENT]"
+# Pages with at least this much ink should not come back (nearly) empty.
+MIN_INK_FOR_TEXT = 0.02
+MIN_CHARS_FOR_INKED_PAGE = 120
+# A line repeated this often (share of all lines) means the model got stuck in a loop.
+REPETITION_SHARE = 0.3
+
+def _unbalanced_latex(latex: str) -> bool:
+    unescaped = re.sub(r"\\[{}$]", "", latex)
+    if unescaped.count("{") != unescaped.count("}"):
+        return True
+    if len(re.findall(r"\\begin\{", latex)) != len(re.findall(r"\\end\{", latex)):
+        return True
+    # Inline math delimiters come in pairs ($$ counts as two)
+    return unescaped.count("$") % 2 == 1
+
+def quality_issues(content: Any, payload: Optional[ImagePayload] = None, failed: bool = False) -> List[str]:
+    """
+    Cheap local checks on a transcription. Returns the reasons to escalate it to the next
+    model tier, or [] if it can be accepted:
+    - "failed": no valid DocumentPayload (schema validation or API failure)
+    - "placeholder": the model gave up on part of the page ([COMPLEX/OMITTED CONTENT])
+    - "empty" / "sparse": (almost) no text for a page with plenty of ink
+    - "unbalanced_latex": braces, environments or $ delimiters do not match
+    - "repetition": one line repeated over and over
+    """
+    if failed or not isinstance(content, dict):
+        return ["failed"]
+
+    base = content.get("base_latex_md") or {}
+    latex = base.get("latex") or ""
+    markdown = base.get("markdown") or ""
+    text = f"{latex}\n{markdown}"
+    reasons = []
+
+    if PLACEHOLDER in text:
+        reasons.append("placeholder")
+
+    ink = payload.signature.ink_density if payload is not None and payload.signature else None
+    chars = max(len(latex.strip()), len(markdown.strip()))
+    if chars == 0:
+        if ink is None or ink >= MIN_INK_FOR_TEXT:
+            reasons.append("empty")
+    elif ink is not None and ink >= MIN_INK_FOR_TEXT and chars < MIN_CHARS_FOR_INKED_PAGE:
+        reasons.append("sparse")
+
+    if latex and _unbalanced_latex(latex):
+        reasons.append("unbalanced_latex")
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) >= 8:
+        _, repeats = Counter(lines).most_common(1)[0]
+        if repeats / len(lines) > REPETITION_SHARE:
+            reasons.append("repetition")
+    return reasons
+
+class CascadeStats:
+    """
+    Per-tier accounting for the model cascade: calls, pages served, seconds and tokens per
+    model, why pages were escalated, and which tier served each page.
+    """
+    def __init__(self, tiers: List[str]):
+        self.tiers = {tier: {"calls": 0, "pages_served": 0, "seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0} for tier in tiers}
+        self.escalations: Counter = Counter()
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, tier: str, seconds: float, usages: list):
+        with self._lock:
+            stats = self.tiers.setdefault(tier, {"calls": 0, "pages_served": 0, "seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0})
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            for usage in usages:
+                stats["prompt_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+                stats["output_tokens"] += getattr(usage, "candidates_token_count", None) or 0
+
+    def record_page(self, label: str, tier: str, reasons: List[str]):
+        with self._lock:
+            self.tiers.setdefault(tier, {"calls": 0, "pages_served": 0, "seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0})
+            self.tiers[tier]["pages_served"] += 1
+            self.escalations.update(reasons)
+            self.pages[label] = {"tier": tier, "escalations": list(reasons)}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {}
+            for tier, stats in self.tiers.items():
+                tiers[tier] = dict(stats, seconds=round(stats["seconds"], 2))
+                if stats["calls"]:
+                    tiers[tier]["seconds_per_call"] = round(stats["seconds"] / stats["calls"], 2)
+            return {"tiers": tiers, "escalations": dict(self.escalations), "pages": len(self.pages)}
@@ -1,13 +1,78 @@
 import os
-from google import genai
+import time
+import asyncio
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from google.genai import types
 from dotenv import load_dotenv
 
-from src.models.data_models import DocumentPayload
+from src.models.data_models import DocumentPayload, ImagePayload, PackedDocumentPayload
+from src.services import cascade
 from src.utils import llm_utils
+from src.utils import async_runner
+from src.utils import rate_limiter
+from src.utils import client_pool
+from src.utils import upload_registry
+from src.utils import context_cache
+from src.utils import streaming
+from src.utils import hedging
+from src.utils import result_cache
+from src.utils import usage
 
 # Load environment variables
 load_dotenv()
 
+# Pages up to this size are sent inline as a `Part`; larger ones are uploaded (once, see
+# `upload_registry`). Gemini caps the whole request at 20MB after base64 (+33%), so a packed
+# request only inlines pages up to INLINE_REQUEST_MAX_BYTES in total and uploads the rest.
+INLINE_IMAGE_MAX_BYTES = int(os.getenv("INLINE_IMAGE_MAX_BYTES", str(4 * 1024 * 1024)))
+INLINE_REQUEST_MAX_BYTES = int(os.getenv("INLINE_REQUEST_MAX_BYTES", str(12 * 1024 * 1024)))
+
+# Pages `transcribe_many` keeps in flight at once.
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+# Consecutive pages sent per request by `transcribe_many` (1 = one page per request).
+PACK_PAGES = int(os.getenv("PACK_PAGES", "1"))
+
+ImageInput = Union[str, ImagePayload]
+
+def image_label(image: ImageInput) -> str:
+    """Human-readable name for an image path or in-memory payload, used in logs and error payloads."""
+    if isinstance(image, ImagePayload):
+        return os.path.basename(image.source_path) if image.source_path else "<in-memory image>"
+    return os.path.basename(image)
+
+def error_payload(label: str, details: str) -> dict:
+    """DocumentPayload-shaped placeholder for a page that could not be transcribed."""
+    error_msg = f"% Error processing image: {label}\n% Error details: {details}"
+    return {
+        "base_latex_md": {"latex": error_msg, "markdown": error_msg},
+        "annotations_metadata": []
+    }
+
+def split_packed_response(packed: dict, page_count: int) -> Dict[int, dict]:
+    """
+    Validates a packed response: returns {page index: DocumentPayload dict} for the pages it
+    actually contains. Out-of-range and repeated indices are dropped, so a missing page simply
+    has no key and can be re-requested on its own.
+    """
+    pages = {}
+    for page in (packed or {}).get("pages", []):
+        index = page.get("page_index")
+        if isinstance(index, int) and 0 <= index < page_count and index not in pages:
+            pages[index] = {key: value for key, value in page.items() if key != "page_index"}
+    return pages
+
+def is_error_payload(content) -> bool:
+    """True for the placeholder returned by `error_payload`."""
+    if not isinstance(content, dict):
+        return False
+    # Either field may be null (markdown-only or latex-only pages)
+    base = content.get("base_latex_md") or {}
+    if not isinstance(base, dict):
+        return False
+    return any((base.get(field) or "").startswith("% Error processing image") for field in ("latex", "markdown"))
+
 class BaseContentExtractor:
     """Extracts only the printed/base content from the image, ignoring human annotations."""
     
@@ -109,55 +174,445 @@ class ContextMerger:
         """
         return master_prompt
 
+    @staticmethod
+    def get_packed_prompt(mode: str, page_count: int) -> str:
+        """Master prompt for a packed request: `page_count` consecutive page images, each preceded by a "Page i:" label."""
+        return ContextMerger.get_master_prompt(mode) + f"""
+        === MULTI-PAGE INSTRUCTIONS ===
+        You are given {page_count} consecutive pages of the same document, in reading order.
+        Each image is preceded by its label "Page 0:" to "Page {page_count - 1}:".
+        - Apply all the rules above to EVERY page independently, and return exactly one entry per page.
+        - Set `page_index` to the number in the page's label.
+        - Use the neighbouring pages as context (e.g. an equation, proof or table that continues onto the next page),
+          but transcribe each page's own content under its own `page_index`. Do not move text between pages.
+
+        === OUTPUT FORMAT ===
+        Return a strict JSON object {{"pages": [...]}} whose entries each hold `page_index`, `base_latex_md`
+        and `annotations_metadata` as described above.
+        """
+
+    @staticmethod
+    def get_text_prompt(mode: str) -> str:
+        """Prompt for pages whose exact text comes from the PDF's embedded text layer (no image)."""
+        base_prompt = BaseContentExtractor.get_prompt(mode)
+        return f"""
+        You are an advanced Semantic Document Parser. Instead of an image, you are given the exact
+        embedded text layer of one page of a born-digital PDF, extracted line by line.
+
+        === BASE CONTENT EXTRACTION INSTRUCTIONS ===
+        {base_prompt}
+
+        === TEXT LAYER RULES ===
+        - The text is authoritative: keep its wording exactly, only restore structure (headings, lists, paragraphs).
+        - Line breaks come from the PDF layout; join lines that belong to the same paragraph.
+        - A born-digital page carries no human annotations, so `annotations_metadata` must be an empty array.
+
+        === OUTPUT FORMAT ===
+        Return a strict JSON object adhering to the schema provided.
+        The `base_latex_md` object must contain the raw LaTeX and/or Markdown of the page text.
+
+        === PAGE TEXT ===
+        """
+
 class Intelligence:
     def __init__(self, api_key: str = None):
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY not found. Please set it in environment variables or .env file.")
         
-        self.client = genai.Client(api_key=self.api_key)
-        self.model_name = 'gemini-3.1-pro-preview'
+        # Borrowed from the process-wide pool so calls reuse warm keep-alive connections
+        self.client = client_pool.get_client(self.api_key)
+        # Models tried in order for each page (see `cascade`); the last tier is the strongest
+        self.cascade = cascade.MODEL_CASCADE or ['gemini-3.1-pro-preview']
+        self.model_name = self.cascade[-1]
+        self.cascade_stats = cascade.CascadeStats(self.cascade)
+        # Stream responses so slow or hung requests are cut off by deadlines (see `streaming`)
+        self.stream = streaming.STREAM_RESPONSES
+
+    @staticmethod
+    def _image_source(image: ImageInput):
+        """Returns (bytes or path, mime type, size in bytes) for a page."""
+        if isinstance(image, ImagePayload):
+            return image.data, image.mime_type, len(image.data)
+        mime_type = mimetypes.guess_type(image)[0] or "image/png"
+        return image, mime_type, os.path.getsize(image)
 
-    def transcribe_image(self, image_path: str, mode: str = "both") -> dict:
+    @staticmethod
+    def _inline_part(source, mime_type: str):
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        return types.Part.from_bytes(data=source, mime_type=mime_type)
+
+    def prepare_image(self, image: ImageInput, inline: Optional[bool] = None):
         """
-        Sends the image to Gemini API and returns a structured dictionary representing the DocumentPayload.
+        Turns an image path or in-memory payload into something `generate_content` accepts.
+        Small pages go inline as bytes (no upload round-trip); larger ones are uploaded once
+        and then reused across runs through the upload registry. `inline` overrides the
+        per-page size check (see `inline_plan`).
         """
-        from src.utils import llm_utils
+        source, mime_type, size = self._image_source(image)
+        if size <= INLINE_IMAGE_MAX_BYTES if inline is None else inline:
+            return self._inline_part(source, mime_type)
+        entry = upload_registry.get_registry().upload(self.client, self.api_key, source, mime_type, image_label(image))
+        return types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mime_type"])
+
+    async def aprepare_image(self, image: ImageInput, inline: Optional[bool] = None):
+        """Async variant of `prepare_image`; uploads go through `client.aio`."""
+        source, mime_type, size = self._image_source(image)
+        if size <= INLINE_IMAGE_MAX_BYTES if inline is None else inline:
+            return self._inline_part(source, mime_type)
+        entry = await upload_registry.get_registry().aupload(self.client, self.api_key, source, mime_type, image_label(image))
+        return types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mime_type"])
 
+    def inline_plan(self, images: List[ImageInput]) -> List[bool]:
+        """
+        Which pages of one request go inline: each at most INLINE_IMAGE_MAX_BYTES, and
+        INLINE_REQUEST_MAX_BYTES for all of them together. The others go through the Files API.
+        """
+        plan = []
+        total = 0
+        for image in images:
+            size = self._image_source(image)[2]
+            inline = size <= INLINE_IMAGE_MAX_BYTES and total + size <= INLINE_REQUEST_MAX_BYTES
+            total += size if inline else 0
+            plan.append(inline)
+        return plan
+
+    def cached_result(self, image: ImageInput, mode: str) -> Optional[dict]:
+        """
+        Returns a stored transcription of these exact page bytes in `mode` from any cascade
+        tier (strongest first), or None. See `result_cache`.
+        """
+        cache = result_cache.get_cache()
+        if cache is None:
+            return None
+        source, _, _ = self._image_source(image)
+        return cache.lookup(cache.content_hash(source), mode, reversed(self.cascade), ContextMerger.get_master_prompt(mode))
+
+    def _store_result(self, image: ImageInput, mode: str, tier: str, result: dict):
+        cache = result_cache.get_cache()
+        if cache is None or is_error_payload(result):
+            return
+        source, _, _ = self._image_source(image)
+        cache.store(cache.content_hash(source), mode, tier, ContextMerger.get_master_prompt(mode), result)
+
+    def _accept_tier(self, image: ImageInput, tier: str, result: dict, escalations: List[str], last: bool) -> bool:
+        """
+        Runs the local quality checks on a tier's result. Returns False (and records why) when
+        the page should go to the next tier; otherwise records which tier served the page.
+        """
+        payload = image if isinstance(image, ImagePayload) else None
+        reasons = cascade.quality_issues(result, payload, failed=is_error_payload(result))
+        if reasons and not last:
+            print(f"Escalating {image_label(image)} from {tier}: {', '.join(reasons)}")
+            escalations.extend(reasons)
+            return False
+        self.cascade_stats.record_page(image_label(image), tier, escalations)
+        return True
+
+    def transcribe_image(self, image: ImageInput, mode: str = "both", on_partial: Optional[Callable[[Dict[str, str]], None]] = None) -> dict:
+        """
+        Sends the image (a path or an in-memory `ImagePayload`) to Gemini API and
+        returns a structured dictionary representing the DocumentPayload.
+        The page goes through the model cascade: each tier's result is checked locally and
+        only escalated to the next model when it fails validation or a quality check.
+        Pages already in the result cache are returned without an API call.
+        When streaming, `on_partial` receives the `base_latex_md` text as it arrives.
+        """
+        cached = self.cached_result(image, mode)
+        if cached is not None:
+            return cached
+        return self._run_cascade(image, mode, on_partial, self.cascade, [])
+
+    def _run_cascade(self, image: ImageInput, mode: str, on_partial, tiers: List[str], escalations: List[str]) -> dict:
+        for i, tier in enumerate(tiers):
+            started = time.monotonic()
+            with llm_utils.collect_usage() as usages, usage.scope(page=image_label(image)):
+                result = self._transcribe_with_model(image, mode, tier, on_partial)
+            self.cascade_stats.record_call(tier, time.monotonic() - started, usages)
+            if self._accept_tier(image, tier, result, escalations, last=i == len(tiers) - 1):
+                self._store_result(image, mode, tier, result)
+                return result
+        return result
+
+    async def atranscribe_image(self, image: ImageInput, mode: str = "both", on_partial: Optional[Callable[[Dict[str, str]], None]] = None) -> dict:
+        """Async variant of `transcribe_image` on the genai async client, with the same cache, cascade, validation and retries."""
+        cached = self.cached_result(image, mode)
+        if cached is not None:
+            return cached
+        return await self._arun_cascade(image, mode, on_partial, self.cascade, [])
+
+    async def _arun_cascade(self, image: ImageInput, mode: str, on_partial, tiers: List[str], escalations: List[str]) -> dict:
+        for i, tier in enumerate(tiers):
+            started = time.monotonic()
+            with llm_utils.collect_usage() as usages, usage.scope(page=image_label(image)):
+                result = await self._atranscribe_with_model(image, mode, tier, on_partial)
+            self.cascade_stats.record_call(tier, time.monotonic() - started, usages)
+            if self._accept_tier(image, tier, result, escalations, last=i == len(tiers) - 1):
+                self._store_result(image, mode, tier, result)
+                return result
+        return result
+
+    def _transcribe_with_model(self, image: ImageInput, mode: str, model_name: str, on_partial=None) -> dict:
+        """One transcription of `image` on `model_name`, with validation and retries."""
         try:
-            # Upload the file using the new SDK's file API or pass directly.
-            file_ref = self.client.files.upload(file=image_path)
+            image_part = self.prepare_image(image)
             master_prompt = ContextMerger.get_master_prompt(mode)
             
-            contents = [file_ref, master_prompt]
+            contents = [image_part, master_prompt]
             
             # Delegate parsing and retry logic to llm_utils
             result_dict = llm_utils.generate_pydantic_with_retry(
                 client=self.client,
-                model_name=self.model_name,
+                model_name=model_name,
                 contents=contents,
                 base_prompt=master_prompt,
                 response_schema=DocumentPayload,
-                max_retries=3
+                max_retries=3,
+                stream=self.stream,
+                on_partial=on_partial
             )
             
             # Fallback handling if parsing completely failed
             if not result_dict:
-                error_msg = f"% Error processing image: {os.path.basename(image_path)}\n% Error details: Failed to parse valid DocumentPayload JSON."
-                return {
-                    "base_latex_md": {"latex": error_msg, "markdown": error_msg},
-                    "annotations_metadata": []
-                }
+                return error_payload(image_label(image), "Failed to parse valid DocumentPayload JSON.")
                 
             return result_dict
 
         except Exception as e:
-            print(f"API Error processing {image_path}: {e}")
-            error_msg = f"% Error processing image: {os.path.basename(image_path)}\n% Error details: {str(e)}"
-            return {
-                "base_latex_md": {"latex": error_msg, "markdown": error_msg},
-                "annotations_metadata": []
-            }
+            print(f"API Error processing {image_label(image)}: {e}")
+            return error_payload(image_label(image), str(e))
+
+    async def _atranscribe_with_model(self, image: ImageInput, mode: str, model_name: str, on_partial=None) -> dict:
+        """Async variant of `_transcribe_with_model`."""
+        try:
+            image_part = await self.aprepare_image(image)
+            master_prompt = ContextMerger.get_master_prompt(mode)
+
+            result_dict = await llm_utils.agenerate_pydantic_with_retry(
+                client=self.client,
+                model_name=model_name,
+                contents=[image_part, master_prompt],
+                base_prompt=master_prompt,
+                response_schema=DocumentPayload,
+                max_retries=3,
+                stream=self.stream,
+                on_partial=on_partial
+            )
+            if not result_dict:
+                return error_payload(image_label(image), "Failed to parse valid DocumentPayload JSON.")
+            return result_dict
+
+        except Exception as e:
+            print(f"API Error processing {image_label(image)}: {e}")
+            return error_payload(image_label(image), str(e))
+
+    def packed_contents(self, parts: list, mode: str):
+        """Returns (contents, prompt) for a packed request over already prepared image parts."""
+        prompt = ContextMerger.get_packed_prompt(mode, len(parts))
+        contents = []
+        for i, part in enumerate(parts):
+            # Labels are Parts (not plain strings) so they survive the self-correction retry
+            contents.append(types.Part.from_text(text=f"Page {i}:"))
+            contents.append(part)
+        contents.append(prompt)
+        return contents, prompt
+
+    async def atranscribe_pages(self, images: List[ImageInput], mode: str = "both") -> List[dict]:
+        """
+        Transcribes several consecutive pages in one request (one master prompt for all of them,
+        with cross-page context) on the first cascade tier. Pages missing from the packed response
+        are re-requested one by one; pages that fail the quality checks continue up the cascade alone.
+        Pages already in the result cache are left out of the request.
+        """
+        if len(images) == 1:
+            return [await self.atranscribe_image(images[0], mode)]
+
+        pages = {}
+        for i, image in enumerate(images):
+            cached = self.cached_result(image, mode)
+            if cached is not None:
+                pages[i] = cached
+        pending = [i for i in range(len(images)) if i not in pages]
+        if len(pending) == 1:
+            pages[pending[0]] = await self._arun_cascade(images[pending[0]], mode, None, self.cascade, [])
+        elif pending:
+            pages.update(zip(pending, await self._atranscribe_packed([images[i] for i in pending], mode)))
+        return [pages[i] for i in range(len(images))]
+
+    async def _atranscribe_packed(self, images: List[ImageInput], mode: str) -> List[dict]:
+        labels = ", ".join(image_label(image) for image in images)
+        tier = self.cascade[0]
+        started = time.monotonic()
+        with llm_utils.collect_usage() as usages, usage.scope(pages=[image_label(image) for image in images]):
+            try:
+                parts = [await self.aprepare_image(image, inline) for image, inline in zip(images, self.inline_plan(images))]
+                contents, prompt = self.packed_contents(parts, mode)
+                packed = await llm_utils.agenerate_pydantic_with_retry(
+                    client=self.client,
+                    model_name=tier,
+                    contents=contents,
+                    base_prompt=prompt,
+                    response_schema=PackedDocumentPayload,
+                    max_retries=3,
+                    stream=self.stream
+                )
+            except Exception as e:
+                print(f"API Error processing packed pages {labels}: {e}")
+                packed = {}
+        self.cascade_stats.record_call(tier, time.monotonic() - started, usages)
+
+        pages = split_packed_response(packed, len(images))
+        escalate = {}
+        for i, page in pages.items():
+            escalations = []
+            if not self._accept_tier(images[i], tier, page, escalations, last=len(self.cascade) == 1):
+                escalate[i] = escalations
+            else:
+                self._store_result(images[i], mode, tier, page)
+        if escalate:
+            retried = await asyncio.gather(*(
+                self._arun_cascade(images[i], mode, None, self.cascade[1:], escalations) for i, escalations in escalate.items()
+            ))
+            pages.update(zip(escalate, retried))
+
+        missing = [i for i in range(len(images)) if i not in pages]
+        if missing:
+            print(f"Packed response for {labels} is missing {len(missing)} page(s); re-requesting them individually.")
+            retried = await asyncio.gather(*(self._arun_cascade(images[i], mode, None, self.cascade, []) for i in missing))
+            pages.update(zip(missing, retried))
+        return [pages[i] for i in range(len(images))]
+
+    def transcribe_many(
+            self,
+            images: Iterable[ImageInput],
+            mode: str = "both",
+            max_concurrency: int = TRANSCRIBE_CONCURRENCY,
+            on_result: Optional[Callable[[int, ImageInput, dict], None]] = None,
+            hedge: Optional[bool] = None,
+            pack_size: int = PACK_PAGES
+        ) -> List[dict]:
+        """
+        Transcribes many pages concurrently with at most `max_concurrency` requests in flight
+        and returns the results in input order.
+        `images` may be a lazy iterator (e.g. `vision.enhance_images`): a page is only pulled
+        once a slot is free, so rendering, enhancement and transcription overlap without
+        holding the whole document in memory. `on_result(index, image, result)` is called as
+        each page finishes (in completion order), e.g. to persist progress; it runs on a worker
+        thread, one call at a time, so slow disk or database writes don't stall the requests in
+        flight. A page whose request (or callback) raises gets an `error_payload` instead of
+        failing the whole batch. If `images` itself raises, the pages already started still
+        finish (and reach `on_result`) before the error propagates.
+        With `hedge` (default: HEDGE_REQUESTS), a request still running at the p90 latency of
+        recent requests gets a duplicate and the first successful response wins.
+        With `pack_size` > 1 (default: PACK_PAGES), consecutive pages are grouped into packed
+        requests (see `atranscribe_pages`); `max_concurrency` then counts requests, not pages.
+        """
+        hedge = hedging.HEDGE_REQUESTS if hedge is None else hedge
+        return async_runner.run_coroutine(self._atranscribe_many(images, mode, max_concurrency, on_result, hedge, pack_size))
+
+    async def _atranscribe_many(self, images, mode, max_concurrency, on_result, hedge=False, pack_size=1) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        iterator = iter(images)
+        done = object()
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        results: Dict[int, dict] = {}
+        tasks = []
+        callbacks = ThreadPoolExecutor(max_workers=1, thread_name_prefix="on-result")
+
+        async def _transcribe(start: int, group: List[ImageInput]):
+            try:
+                try:
+                    # Hedging applies to each generate call, so only the winning copy is accounted and cached
+                    with llm_utils.hedge_requests(hedge):
+                        if len(group) > 1:
+                            pages = await self.atranscribe_pages(group, mode)
+                        else:
+                            pages = [await self.atranscribe_image(group[0], mode)]
+                except Exception as e:
+                    # One failing request must not take the other pages of the batch down with it
+                    print(f"Error transcribing {', '.join(image_label(image) for image in group)}: {e}")
+                    pages = [error_payload(image_label(image), str(e)) for image in group]
+                for offset, result in enumerate(pages):
+                    results[start + offset] = result
+                    if on_result:
+                        try:
+                            await loop.run_in_executor(callbacks, on_result, start + offset, group[offset], result)
+                        except Exception as e:
+                            print(f"Warning: result callback failed for {image_label(group[offset])}: {e}")
+            finally:
+                semaphore.release()
+
+        index = 0
+        exhausted = False
+        try:
+            while not exhausted:
+                await semaphore.acquire()
+                group = []
+                try:
+                    while len(group) < max(1, pack_size):
+                        # The iterator may block (rendering, enhancement), so pull from it off the loop
+                        image = await loop.run_in_executor(None, next, iterator, done)
+                        if image is done:
+                            exhausted = True
+                            break
+                        group.append(image)
+                finally:
+                    if group:
+                        tasks.append(asyncio.ensure_future(_transcribe(index, group)))
+                        index += len(group)
+                    else:
+                        semaphore.release()
+        finally:
+            # Pages already pulled finish even if the iterator raised, so their results are not lost
+            await asyncio.gather(*tasks, return_exceptions=True)
+            callbacks.shutdown(wait=False)
+        return [results.get(i) or error_payload(f"page {i + 1}", "Transcription did not complete.") for i in range(index)]
+
+    def transcribe_text(self, text: str, mode: str = "both", label: str = "<text page>") -> dict:
+        """
+        Structures a page from its embedded PDF text layer. Text-only requests skip
+        rasterization and image tokens entirely, so they are much cheaper than `transcribe_image`.
+        They start on the first cascade tier as well and only move up when no valid payload comes back.
+        Results are cached by the SHA-256 of the text, like page images.
+        """
+        text_prompt = ContextMerger.get_text_prompt(mode)
+        prompt = text_prompt + text
+        cache = result_cache.get_cache()
+        text_hash = cache.content_hash(text.encode("utf-8")) if cache else None
+        if cache:
+            cached = cache.lookup(text_hash, mode, reversed(self.cascade), text_prompt)
+            if cached is not None:
+                return cached
+        escalations = []
+        for i, tier in enumerate(self.cascade):
+            started = time.monotonic()
+            with llm_utils.collect_usage() as usages, usage.scope(page=label):
+                try:
+                    result_dict = llm_utils.generate_pydantic_with_retry(
+                        client=self.client,
+                        model_name=tier,
+                        contents=[prompt],
+                        base_prompt=prompt,
+                        response_schema=DocumentPayload,
+                        max_retries=3,
+                        stream=self.stream
+                    )
+                    error_details = "Failed to parse valid DocumentPayload JSON."
+                except Exception as e:
+                    print(f"API Error processing {label}: {e}")
+                    result_dict, error_details = None, str(e)
+            self.cascade_stats.record_call(tier, time.monotonic() - started, usages)
+            if result_dict or i == len(self.cascade) - 1:
+                self.cascade_stats.record_page(label, tier, escalations)
+                if not result_dict:
+                    return error_payload(label, error_details)
+                if cache:
+                    cache.store(text_hash, mode, tier, text_prompt, result_dict)
+                return result_dict
+            print(f"Escalating {label} from {tier}: failed")
+            escalations.append("failed")
 
 class CachedIntelligence(Intelligence):
     """
@@ -167,61 +622,52 @@ class CachedIntelligence(Intelligence):
     """
     def __init__(self, api_key: str = None, display_name: str = "docs-to-code-cache"):
         super().__init__(api_key)
+        # Name of the shared context cache holding the master prompt, once initialized
         self.cached_content = None
+        self.cached_model = None
         self.display_name = display_name
         
     def initialize_cache(self, mode: str):
-        """Creates a cached content object for the System/Master Prompt."""
-        from google.genai import types
+        """
+        Borrows the shared context cache for this mode's master prompt from the registry.
+        A live cache is reused (and its TTL extended) across documents and processes;
+        one is only created when none exists. It is kept alive until `cleanup`.
+        """
         master_prompt = ContextMerger.get_master_prompt(mode)
-        
-        # TTL is set to 60 minutes for a typical processing session
-        try:
-            self.cached_content = self.client.caches.create(
-                model=self.model_name,
-                config=types.CreateCachedContentConfig(
-                    contents=[master_prompt],
-                    display_name=self.display_name,
-                    ttl="3600s",
-                )
-            )
-            print(f"Context Cache created successfully: {self.cached_content.name}")
-        except Exception as e:
-            print(f"Context Cache creation failed, falling back to non-cached. Details: {e}")
-            self.cached_content = None
+        # Hand back a cache borrowed for another mode before taking this one
+        self.cleanup()
+        # Cached for the first cascade tier, which serves most pages
+        self.cached_model = self.cascade[0]
+        self.cached_content = context_cache.get_registry().acquire(
+            self.client, self.api_key, self.cached_model, mode, master_prompt, display_name=self.display_name
+        )
 
-    def transcribe_image(self, image_path: str, mode: str = "both") -> dict:
-        """Overrides transcribe to use the cached content logic if initialized."""
-        if not self.cached_content:
-            # Fallback to normal if cache wasn't initialized
-            return super().transcribe_image(image_path, mode)
-            
-        from src.utils import llm_utils
-        from google.genai import types
+    def _transcribe_with_model(self, image: ImageInput, mode: str, model_name: str, on_partial=None) -> dict:
+        """Overrides transcribe to use the cached content logic if initialized for this model."""
+        if not self.cached_content or model_name != self.cached_model:
+            # Fallback to normal if cache wasn't initialized (or holds another tier's prompt)
+            return super()._transcribe_with_model(image, mode, model_name, on_partial)
 
         try:
-            file_ref = self.client.files.upload(file=image_path)
             # Only send the image, the prompt is in the cache
-            contents = [file_ref]
+            contents = [self.prepare_image(image)]
             
             result_dict = {}
             for attempt in range(3):
                 try:
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=contents,
-                        config=types.GenerateContentConfig(
-                            cached_content=self.cached_content.name,
-                            response_mime_type="application/json",
-                            response_schema=DocumentPayload
-                        )
+                    response = llm_utils.generate_content(
+                        self.client, model_name, contents,
+                        llm_utils.json_config(DocumentPayload, cached_content=self.cached_content),
+                        stream=self.stream, on_partial=on_partial, attempt=attempt
                     )
-                    sanitized_text = llm_utils.sanitize_json_string(response.text)
-                    parsed_data = DocumentPayload.model_validate_json(sanitized_text)
+                    parsed_data = llm_utils.validate_with_repair(DocumentPayload, response.text)
                     result_dict = parsed_data.model_dump()
                     break
                 except Exception as e:
                     print(f"[Warning] Cached parsing try {attempt+1}/3 failed: {e}")
+                    if rate_limiter.classify_error(e) != "validation":
+                        raise
+                    llm_utils.record_parse_outcome("retried" if attempt < 2 else "failed")
                     contents.append(f"Previous attempt error: {str(e)}. Strictly output JSON schema.")
             
             if not result_dict:
@@ -230,18 +676,48 @@ class CachedIntelligence(Intelligence):
             return result_dict
 
         except Exception as e:
-            print(f"API Error processing {image_path}: {e}")
-            error_msg = f"% Error processing image: {os.path.basename(image_path)}\n% Error details: {str(e)}"
-            return {
-                "base_latex_md": {"latex": error_msg, "markdown": error_msg},
-                "annotations_metadata": []
-            }
+            print(f"API Error processing {image_label(image)}: {e}")
+            return error_payload(image_label(image), str(e))
+
+    async def _atranscribe_with_model(self, image: ImageInput, mode: str, model_name: str, on_partial=None) -> dict:
+        """Async variant of the cached `_transcribe_with_model`, used by `transcribe_many`."""
+        if not self.cached_content or model_name != self.cached_model:
+            return await super()._atranscribe_with_model(image, mode, model_name, on_partial)
+
+        try:
+            contents = [await self.aprepare_image(image)]
+
+            result_dict = {}
+            for attempt in range(3):
+                try:
+                    response = await llm_utils.agenerate_content(
+                        self.client, model_name, contents,
+                        llm_utils.json_config(DocumentPayload, cached_content=self.cached_content),
+                        stream=self.stream, on_partial=on_partial, attempt=attempt
+                    )
+                    result_dict = llm_utils.validate_with_repair(DocumentPayload, response.text).model_dump()
+                    break
+                except Exception as e:
+                    print(f"[Warning] Cached parsing try {attempt+1}/3 failed: {e}")
+                    if rate_limiter.classify_error(e) != "validation":
+                        raise
+                    llm_utils.record_parse_outcome("retried" if attempt < 2 else "failed")
+                    contents.append(f"Previous attempt error: {str(e)}. Strictly output JSON schema.")
+
+            if not result_dict:
+                raise ValueError("Failed to parse valid JSON payload after 3 retries using Cache.")
+
+            return result_dict
+
+        except Exception as e:
+            print(f"API Error processing {image_label(image)}: {e}")
+            return error_payload(image_label(image), str(e))
             
     def cleanup(self):
-        """Deletes the cache to avoid unnecessary billing."""
+        """
+        Releases the context cache. It stays alive for the next document and is only
+        deleted once it has been idle for `CONTEXT_CACHE_IDLE_SECONDS`.
+        """
         if self.cached_content:
-            try:
-                self.client.caches.delete(name=self.cached_content.name)
-                print(f"Cleaned up Context Cache: {self.cached_content.name}")
-            except Exception as e:
-                print(f"Failed to cleanup cache: {e}")
+            context_cache.get_registry().release(self.client, self.api_key, self.cached_content)
+            self.cached_content = None
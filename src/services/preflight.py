@@ -0,0 +1,88 @@
+import os
+import base64
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from src.models.data_models import ImagePayload, PageSignature
+
+# Pages with less ink than this (fraction of the page) are treated as blank separators.
+BLANK_INK_DENSITY = float(os.getenv("BLANK_INK_DENSITY", "0.0005"))
+# pHash Hamming distance under which two pages are duplicate candidates.
+DUPLICATE_HASH_DISTANCE = int(os.getenv("DUPLICATE_HASH_DISTANCE", "12"))
+# Thumbnail correlation needed to confirm a duplicate. Distinct pages with the same
+# layout score around 0.75; re-scans of the same page score above 0.9.
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.9"))
+
+def blank_page_content() -> dict:
+    """DocumentPayload-shaped result used for pages skipped as blank."""
+    return {
+        "base_latex_md": {"latex": "", "markdown": ""},
+        "annotations_metadata": []
+    }
+
+def _decode_thumbnail(signature: PageSignature) -> np.ndarray:
+    raw = np.frombuffer(base64.b64decode(signature.thumbnail), dtype=np.uint8)
+    return cv2.imdecode(raw, cv2.IMREAD_GRAYSCALE).astype(np.float32)
+
+def thumbnail_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Pearson correlation of two thumbnails after aligning them with phase correlation."""
+    if a.shape != b.shape:
+        return 0.0
+    (dx, dy), _ = cv2.phaseCorrelate(a, b)
+    shift = np.float32([[1, 0, -dx], [0, 1, -dy]])
+    b = cv2.warpAffine(b, shift, (a.shape[1], a.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+    a = a - a.mean()
+    b = b - b.mean()
+    denominator = float(np.sqrt((a * a).sum() * (b * b).sum()))
+    return float((a * b).sum()) / denominator if denominator else 0.0
+
+class Preflight:
+    """
+    Pre-flight stage run on enhanced pages before any API call.
+    Blank pages (ink density below `BLANK_INK_DENSITY`) are skipped, and pages whose
+    perceptual hash and thumbnail match an earlier page of the run reuse that page's
+    transcription. Keeps counters so callers can report how many calls were saved.
+    """
+    def __init__(self, blank_ink_density: float = BLANK_INK_DENSITY,
+                 hash_distance: int = DUPLICATE_HASH_DISTANCE,
+                 similarity: float = DUPLICATE_SIMILARITY):
+        self.blank_ink_density = blank_ink_density
+        self.hash_distance = hash_distance
+        self.similarity = similarity
+        self._unique: List[Tuple[int, np.ndarray, str]] = []
+        self.stats = {"pages": 0, "blank": 0, "duplicate": 0}
+
+    def check(self, payload: ImagePayload, key: str) -> Tuple[str, Optional[str]]:
+        """
+        Classifies a page as ("blank", None), ("duplicate", <key of the original page>)
+        or ("unique", None). Unique pages are remembered under `key`.
+        Pages without a signature (enhancement failed) are always unique.
+        """
+        self.stats["pages"] += 1
+        signature = payload.signature
+        if signature is None:
+            return "unique", None
+
+        if signature.ink_density < self.blank_ink_density:
+            self.stats["blank"] += 1
+            return "blank", None
+
+        phash = int(signature.phash, 16)
+        thumbnail = _decode_thumbnail(signature)
+        for other_hash, other_thumbnail, other_key in self._unique:
+            if bin(phash ^ other_hash).count("1") > self.hash_distance:
+                continue
+            if thumbnail_similarity(other_thumbnail, thumbnail) >= self.similarity:
+                self.stats["duplicate"] += 1
+                return "duplicate", other_key
+
+        self._unique.append((phash, thumbnail, key))
+        return "unique", None
+
+    @property
+    def calls_saved(self) -> int:
+        return self.stats["blank"] + self.stats["duplicate"]
+
+    def summary(self) -> Dict[str, int]:
+        return {**self.stats, "api_calls_saved": self.calls_saved}
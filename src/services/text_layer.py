@@ -0,0 +1,170 @@
+import os
+import re
+import subprocess
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+# Text-layer pre-pass for born-digital PDFs, using the poppler tools pdf2image already needs.
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER", "1").lower() in ("1", "true", "yes")
+# "llm": send the extracted text (no image) to Gemini for structuring; "local": no API call at all.
+TEXT_LAYER_MODE = os.getenv("TEXT_LAYER_MODE", "llm").lower()
+
+# Fewer extractable characters than this means the page is a scan (or pure drawing).
+MIN_TEXT_CHARS = 80
+# Embedded images smaller than this (in pixels) are logos/bullets, not figures or scans.
+MIN_FIGURE_PIXELS = 150 * 150
+# Share of math symbols above which the text layer can't be trusted to carry the equations.
+MATH_SYMBOL_RATIO = 0.02
+# Vector figures (plots, diagrams) leave no embedded image and no text, only a blank band in the
+# text layout: a vertical gap between two text lines taller than this share of the page, or text
+# covering less than TEXT_LAYER_MIN_COVERAGE of the page, sends the page to vision.
+FIGURE_GAP_RATIO = float(os.getenv("TEXT_LAYER_FIGURE_GAP", "0.12"))
+MIN_TEXT_COVERAGE = float(os.getenv("TEXT_LAYER_MIN_COVERAGE", "0.05"))
+# Share of the page height taken by a normal top or bottom margin (with running header/footer),
+# allowed on top of FIGURE_GAP_RATIO before the space above the first line or below the last counts as a figure.
+PAGE_MARGIN_RATIO = 0.1
+
+MATH_FONT_PATTERN = re.compile(r"CMMI|CMSY|CMEX|CMBSY|MSAM|MSBM|EUFM|EUSM|RSFS|STIX|Math|Symbol|esint|txsy|pxsy|MnSymbol", re.IGNORECASE)
+MATH_CHAR_PATTERN = re.compile("[\u0370-\u03ff\u2190-\u21ff\u2200-\u22ff\u27c0-\u27ef\u2980-\u2aff\U0001d400-\U0001d7ff]")
+
+def _run_poppler(args: List[str]) -> str:
+    result = subprocess.run(args, capture_output=True, check=True, timeout=300)
+    return result.stdout.decode("utf-8", errors="replace")
+
+def extract_text_layer(pdf_path: Union[str, Path]) -> Dict[int, Dict]:
+    """
+    Runs `pdftohtml -xml` once over the whole PDF and returns, per 1-based page number,
+    {"text": str, "fonts": set of font family names, "size": (width, height), "boxes": [(left, top, width, height)]}.
+    """
+    xml = _run_poppler(["pdftohtml", "-xml", "-i", "-stdout", "-q", "-enc", "UTF-8", str(pdf_path)])
+    root = ET.fromstring(xml)
+
+    fonts = {}
+    pages = {}
+    for page in root.iter("page"):
+        number = int(page.get("number"))
+        lines = []
+        families = set()
+        boxes = []
+        for element in page:
+            if element.tag == "fontspec":
+                fonts[element.get("id")] = element.get("family", "")
+            elif element.tag == "text":
+                lines.append("".join(element.itertext()))
+                families.add(fonts.get(element.get("font"), ""))
+                boxes.append(tuple(float(element.get(key, 0)) for key in ("left", "top", "width", "height")))
+        size = (float(page.get("width", 0)), float(page.get("height", 0)))
+        pages[number] = {"text": "\n".join(lines), "fonts": families, "size": size, "boxes": boxes}
+    return pages
+
+def count_page_figures(pdf_path: Union[str, Path]) -> Dict[int, int]:
+    """Counts embedded raster images larger than `MIN_FIGURE_PIXELS` per page via `pdfimages -list`."""
+    listing = _run_poppler(["pdfimages", "-list", str(pdf_path)])
+    counts: Dict[int, int] = {}
+    for line in listing.splitlines()[2:]:
+        columns = line.split()
+        if len(columns) < 5 or not columns[0].isdigit():
+            continue
+        page, width, height = int(columns[0]), int(columns[3]), int(columns[4])
+        if width * height >= MIN_FIGURE_PIXELS:
+            counts[page] = counts.get(page, 0) + 1
+    return counts
+
+def has_vector_figure(size: Tuple[float, float], boxes: List[Tuple[float, float, float, float]]) -> bool:
+    """
+    Layout heuristic for drawings the text layer cannot see: True when the page has a vertical
+    gap between two text lines taller than `FIGURE_GAP_RATIO` of the page, the same gap plus a
+    margin (`PAGE_MARGIN_RATIO`) above the first line or below the last, or its text covers
+    less than `MIN_TEXT_COVERAGE` of it. The last page of a section, ending halfway down, is
+    sent to vision as well. Figures placed beside a text column are not detected; lower the
+    thresholds (or set TEXT_LAYER=0) for such PDFs.
+    """
+    width, height = size
+    if not boxes or width <= 0 or height <= 0:
+        return False
+    if sum(w * h for _, _, w, h in boxes) < MIN_TEXT_COVERAGE * width * height:
+        return True
+    edge_gap = (FIGURE_GAP_RATIO + PAGE_MARGIN_RATIO) * height
+    boxes = sorted(boxes, key=lambda box: box[1])
+    if boxes[0][1] > edge_gap:
+        return True
+    bottom = None
+    for _, top, _, box_height in boxes:
+        if bottom is not None and top - bottom > FIGURE_GAP_RATIO * height:
+            return True
+        bottom = top + box_height if bottom is None else max(bottom, top + box_height)
+    return height - bottom > edge_gap
+
+def classify_pages(pdf_path: Union[str, Path]) -> List[Dict]:
+    """
+    Classifies every page of the PDF as:
+    - "text": exact embedded text, no figures, no math fonts -> no rasterization needed
+    - "math": text layer present but the page has figures (raster, or vector ones found by
+      `has_vector_figure`) or math typesetting -> vision
+    - "scanned": little or no extractable text -> vision
+    Returns [{"page", "kind", "chars", "figures", "vector_figure", "text"}] in page order, or []
+    when the poppler tools fail (every page then goes through vision as before).
+    """
+    try:
+        layer = extract_text_layer(pdf_path)
+        figures = count_page_figures(pdf_path)
+    except Exception as e:
+        print(f"Text-layer pre-pass unavailable for {pdf_path}: {e}")
+        return []
+
+    classified = []
+    for number in sorted(layer):
+        text = layer[number]["text"]
+        chars = len(re.sub(r"\s", "", text))
+        math_chars = len(MATH_CHAR_PATTERN.findall(text))
+        math_fonts = any(MATH_FONT_PATTERN.search(f) for f in layer[number]["fonts"])
+        vector_figure = has_vector_figure(layer[number]["size"], layer[number]["boxes"])
+
+        if chars < MIN_TEXT_CHARS:
+            kind = "scanned"
+        elif figures.get(number) or vector_figure or math_fonts or math_chars / chars >= MATH_SYMBOL_RATIO:
+            kind = "math"
+        else:
+            kind = "text"
+        classified.append({"page": number, "kind": kind, "chars": chars, "figures": figures.get(number, 0), "vector_figure": vector_figure, "text": text})
+    return classified
+
+_LATEX_SPECIALS = {
+    "\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#",
+    "_": r"\_", "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}",
+}
+
+def text_page_content(text: str) -> dict:
+    """DocumentPayload-shaped result built locally from a page's text layer (no API call)."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    markdown = "\n\n".join(paragraphs)
+    latex = "".join(_LATEX_SPECIALS.get(ch, ch) for ch in markdown)
+    return {
+        "base_latex_md": {"latex": latex, "markdown": markdown},
+        "annotations_metadata": []
+    }
+
+def split_pdf_pages(pdf_path: Union[str, Path]) -> Tuple[List[Dict], Optional[List[int]]]:
+    """
+    Runs the pre-pass (when TEXT_LAYER is enabled) and returns (text_pages, vision_pages):
+    the classified "text" entries, and the page numbers that still need rasterization.
+    `vision_pages` is None when every page must be rendered (pre-pass disabled or failed).
+    """
+    if not TEXT_LAYER_ENABLED:
+        return [], None
+    classified = classify_pages(pdf_path)
+    if not classified:
+        return [], None
+
+    text_pages = [page for page in classified if page["kind"] == "text"]
+    vision_pages = [page["page"] for page in classified if page["kind"] != "text"]
+    kinds = {kind: sum(1 for page in classified if page["kind"] == kind) for kind in ("text", "math", "scanned")}
+    print(f"Text-layer pre-pass for {Path(pdf_path).name}: {kinds['text']} text, {kinds['math']} math/figure, {kinds['scanned']} scanned pages.")
+    return text_pages, vision_pages
+
+def transcribe_text_page(intel, page: Dict, mode: str, label: str) -> dict:
+    """Structures a "text" page locally or with a text-only request, depending on TEXT_LAYER_MODE."""
+    if TEXT_LAYER_MODE == "local":
+        return text_page_content(page["text"])
+    return intel.transcribe_text(page["text"], mode=mode, label=label)
@@ -1,133 +1,547 @@
 import os
-import re
+import time
+import base64
+import tempfile
+import mimetypes
+import threading
+import multiprocessing
 import cv2
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from pdf2image import convert_from_path
-from typing import List, Dict, Tuple, Union
+from pdf2image import convert_from_path, pdfinfo_from_path
+from typing import List, Dict, Tuple, Union, Iterator, Iterable, Optional
 
-def process_pdf(pdf_path: Union[str, Path], output_dir: Union[str, Path]) -> List[str]:
+from src.models.data_models import ImagePayload, PageSignature
+from src.utils.enhancement_cache import EnhancementCache
+from src.utils.image_index import ImageIndex
+
+# Number of pages rendered per pdftoppm call. Peak memory is bounded by
+# the number of windows in flight, since pages are written straight to disk.
+PDF_WINDOW_SIZE = int(os.getenv("PDF_WINDOW_SIZE", "8"))
+PDF_DPI = int(os.getenv("PDF_DPI", "200"))
+PDF_RASTER_FORMAT = os.getenv("PDF_RASTER_FORMAT", "png").lower()
+PDF_GRAYSCALE = os.getenv("PDF_GRAYSCALE", "0").lower() in ("1", "true", "yes")
+PDF_RASTER_WORKERS = int(os.getenv("PDF_RASTER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Worker processes used by `enhance_images`; 1 runs the pipeline in-process.
+ENHANCE_WORKERS = int(os.getenv("ENHANCE_WORKERS", str(os.cpu_count() or 1)))
+# Enhanced pages whose long edge exceeds this are downscaled before encoding (0 disables).
+PAYLOAD_MAX_LONG_EDGE = int(os.getenv("PAYLOAD_MAX_LONG_EDGE", "3072"))
+# Also encode the full page as plain PNG to report the bytes saved (costs a full-resolution encode per page).
+PAYLOAD_REPORT_SAVINGS = os.getenv("PAYLOAD_REPORT_SAVINGS", "0").lower() in ("1", "true", "yes")
+# Reuse enhanced payloads across runs (see `EnhancementCache`).
+ENHANCE_CACHE_ENABLED = os.getenv("ENHANCE_CACHE", "1").lower() in ("1", "true", "yes")
+# Pick full/light/no enhancement per page from a cheap quality estimate (see `choose_enhancement`).
+ADAPTIVE_ENHANCE = os.getenv("ADAPTIVE_ENHANCE", "1").lower() in ("1", "true", "yes")
+# Bump whenever the enhancement pipeline changes so stale cache entries are ignored.
+ENHANCE_PIPELINE_VERSION = 4
+
+# Quality estimator thresholds (noise sigma in gray levels, contrast as p99 - p1).
+QUALITY_SAMPLE_EDGE = 1024
+CLEAN_NOISE_SIGMA = 1.0
+CLEAN_BINARY_FRACTION = 0.95
+LIGHT_NOISE_SIGMA = 4.0
+LIGHT_MIN_CONTRAST = 80.0
+
+# Page signatures: ink is measured on an area-downsampled copy, duplicates are confirmed on a thumbnail.
+SIGNATURE_INK_EDGE = 512
+SIGNATURE_THUMBNAIL_WIDTH = 256
+
+# Trim empty margins, desk background and scanner edges to the ink region plus padding.
+AUTO_CROP = os.getenv("AUTO_CROP", "1").lower() in ("1", "true", "yes")
+CROP_PADDING = int(os.getenv("CROP_PADDING", "32"))
+CROP_ANALYSIS_EDGE = 1024
+# Don't bother re-encoding for a crop that keeps nearly the whole page
+CROP_MIN_SAVING = 0.05
+
+# Output format -> file extension. poppler writes PNG/JPEG natively; WebP goes through PIL.
+_RASTER_EXTENSIONS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "webp": "webp"}
+
+def get_pdf_page_count(pdf_path: Union[str, Path]) -> int:
+    """Returns the number of pages in the PDF according to poppler's pdfinfo."""
+    info = pdfinfo_from_path(str(pdf_path))
+    return int(info.get("Pages", 0))
+
+def _render_window(pdf_path: Path, output_dir: Path, first: int, last: int, dpi: int, fmt: str, grayscale: bool) -> List[str]:
+    """Renders pages [first, last] of the PDF and saves them as TitleXImageY.<ext>."""
+    ext = _RASTER_EXTENSIONS[fmt]
+    base_name = pdf_path.stem
+    saved_paths = []
+
+    if fmt == "webp":
+        images = convert_from_path(str(pdf_path), dpi=dpi, first_page=first, last_page=last, grayscale=grayscale)
+        for offset, image in enumerate(images):
+            image_path = output_dir / f"{base_name}XImage{first + offset}.{ext}"
+            image.save(str(image_path), "WEBP", lossless=True)
+            image.close()
+            saved_paths.append(str(image_path))
+        return saved_paths
+
+    # Let pdftoppm write the files itself so pages never round-trip through PIL.
+    with tempfile.TemporaryDirectory(dir=str(output_dir), prefix=".render-") as tmp_dir:
+        rendered = convert_from_path(
+            str(pdf_path), dpi=dpi, first_page=first, last_page=last, grayscale=grayscale,
+            fmt="jpeg" if fmt == "jpg" else fmt, output_folder=tmp_dir, paths_only=True
+        )
+        for offset, rendered_path in enumerate(rendered):
+            # Save as TitleXImageY.<ext> format to match grouping logic
+            # Using the PDF filename as the "Title"
+            image_path = output_dir / f"{base_name}XImage{first + offset}.{ext}"
+            os.replace(rendered_path, image_path)
+            saved_paths.append(str(image_path))
+    return saved_paths
+
+def _page_windows(pages: Iterable[int], total_pages: int, window_size: int) -> List[Tuple[int, int]]:
+    """Groups sorted page numbers into contiguous (first, last) windows of at most `window_size` pages."""
+    windows = []
+    for page in pages:
+        if page < 1 or page > total_pages:
+            continue
+        if windows and page == windows[-1][1] + 1 and page - windows[-1][0] < window_size:
+            windows[-1] = (windows[-1][0], page)
+        else:
+            windows.append((page, page))
+    return windows
+
+def iter_pdf_pages(
+        pdf_path: Union[str, Path],
+        output_dir: Union[str, Path],
+        window_size: int = PDF_WINDOW_SIZE,
+        dpi: int = PDF_DPI,
+        fmt: str = PDF_RASTER_FORMAT,
+        grayscale: bool = PDF_GRAYSCALE,
+        workers: int = PDF_RASTER_WORKERS,
+        stats: Optional[Dict[str, float]] = None,
+        pages: Optional[Iterable[int]] = None
+    ) -> Iterator[str]:
     """
-    Splits a PDF into images and saves them to the output directory.
-    Returns a list of paths to the saved images.
+    Streaming, parallel variant of `process_pdf`.
+    Splits the page range into first_page/last_page windows and renders up to `workers`
+    windows at once (each one is a separate pdftoppm process, so this scales across cores).
+    Page paths are yielded in order as soon as their window is on disk, so callers can
+    start enhancing and uploading page 1 while later pages are still rendering.
+    If `stats` is given it is filled with pages, seconds, pages_per_sec and failed_pages.
+    A window that fails to render is logged and skipped; the remaining windows still render.
+    `pages` restricts rendering to the given 1-based page numbers (e.g. the pages the
+    text-layer pre-pass could not handle); windows never span a skipped page.
     """
     pdf_path = Path(pdf_path)
     output_dir = Path(output_dir)
-    
-    if not output_dir.exists():
-        output_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    window_size = max(1, window_size)
+    workers = max(1, workers)
+    fmt = fmt.lower()
+    if fmt not in _RASTER_EXTENSIONS:
+        raise ValueError(f"Unsupported raster format '{fmt}'. Use one of: png, jpeg, webp.")
 
     try:
-        images = convert_from_path(str(pdf_path))
-        saved_paths = []
-        base_name = pdf_path.stem
-
-        for i, image in enumerate(images):
-            # Save as TitleXImageY.png format to match grouping logic
-            # Using the PDF filename as the "Title"
-            image_name = f"{base_name}XImage{i+1}.png"
-            image_path = output_dir / image_name
-            image.save(str(image_path), "PNG")
-            saved_paths.append(str(image_path))
-            print(f"Saved PDF page to: {image_path}")
-        
-        return saved_paths
+        total_pages = get_pdf_page_count(pdf_path)
     except Exception as e:
         print(f"Error processing PDF {pdf_path}: {e}")
-        return []
+        return
+
+    windows = _page_windows(sorted(set(pages)) if pages is not None else range(1, total_pages + 1), total_pages, window_size)
+    start_time = time.perf_counter()
+    pages_done = 0
+    failed_pages = []
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-raster")
+    try:
+        pending = []
+        next_window = 0
+        while next_window < len(windows) or pending:
+            # Keep one window queued beyond the busy workers so poppler never idles.
+            while next_window < len(windows) and len(pending) <= workers:
+                first, last = windows[next_window]
+                pending.append((first, last, executor.submit(_render_window, pdf_path, output_dir, first, last, dpi, fmt, grayscale)))
+                next_window += 1
+
+            first, last, future = pending.pop(0)
+            try:
+                window_paths = future.result()
+            except Exception as e:
+                # Later windows are unaffected; the failed pages are simply not yielded (and so
+                # never marked processed), and a later run renders them again
+                print(f"Error rendering pages {first}-{last} of {pdf_path}, skipping them: {e}")
+                failed_pages.extend(range(first, last + 1))
+                continue
+
+            for image_path in window_paths:
+                pages_done += 1
+                print(f"Saved PDF page to: {image_path}")
+                yield image_path
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        elapsed = time.perf_counter() - start_time
+        rate = pages_done / elapsed if elapsed > 0 else 0.0
+        if stats is not None:
+            stats.update({"pages": pages_done, "seconds": elapsed, "pages_per_sec": rate, "failed_pages": failed_pages})
+        if pages_done:
+            print(f"Rasterized {pages_done} pages of {pdf_path.name} in {elapsed:.1f}s ({rate:.2f} pages/sec at {dpi} DPI, {fmt}, {workers} workers)")
+        if failed_pages:
+            print(f"Warning: {len(failed_pages)} pages of {pdf_path.name} could not be rendered: {failed_pages}")
+
+def process_pdf(pdf_path: Union[str, Path], output_dir: Union[str, Path], **raster_options) -> List[str]:
+    """
+    Splits a PDF into images and saves them to the output directory.
+    Returns a list of paths to the saved images.
+    Accepts the same rasterization options as `iter_pdf_pages` (dpi, fmt, grayscale, workers).
+    Use `iter_pdf_pages` to consume pages while the rest of the document renders.
+    """
+    return list(iter_pdf_pages(pdf_path, output_dir, **raster_options))
+
+def encode_image(img: np.ndarray, ext: str = ".png", params: Optional[List[int]] = None) -> bytes:
+    """Encodes an ndarray in memory with `cv2.imencode` and returns the raw bytes."""
+    ok, buffer = cv2.imencode(ext, img, params or [])
+    if not ok:
+        raise ValueError(f"cv2.imencode failed for format {ext}")
+    return buffer.tobytes()
+
+def optimize_payload(
+        img: np.ndarray,
+        max_long_edge: int = PAYLOAD_MAX_LONG_EDGE,
+        source_path: Optional[str] = None,
+        report_savings: bool = PAYLOAD_REPORT_SAVINGS
+    ) -> ImagePayload:
+    """
+    Picks the smallest lossless encoding for an enhanced page.
+    Candidates are tuned PNG, 1-bit PNG (only when the page is strictly two-tone) and
+    lossless WebP, after an optional downscale to `max_long_edge`. With `report_savings`,
+    the plain 8-bit PNG size is recorded in `original_bytes` so callers can report the savings.
+    """
+    original_bytes = len(encode_image(img, ".png")) if report_savings else None
+    two_tone = img.ndim == 2 and not np.any((img != 0) & (img != 255))
+
+    height, width = img.shape[:2]
+    long_edge = max(height, width)
+    if max_long_edge and long_edge > max_long_edge:
+        scale = max_long_edge / long_edge
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        if two_tone:
+            # Keep binarized pages two-tone after resampling
+            _, img = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)
+
+    candidates = [
+        ("png", encode_image(img, ".png", [cv2.IMWRITE_PNG_COMPRESSION, 9]), "image/png"),
+        ("webp-lossless", encode_image(img, ".webp", [cv2.IMWRITE_WEBP_QUALITY, 101]), "image/webp"),
+    ]
+    if two_tone:
+        candidates.append(("png-1bit", encode_image(img, ".png", [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9]), "image/png"))
+
+    encoding, data, mime_type = min(candidates, key=lambda c: len(c[1]))
+    scale = img.shape[1] / width
+    return ImagePayload(data=data, mime_type=mime_type, source_path=source_path, encoding=encoding, original_bytes=original_bytes, scale=scale)
+
+def find_content_box(page: np.ndarray, padding: int = CROP_PADDING) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Returns the (x, y, width, height) box around the ink of a binarized (or clean
+    grayscale) page, plus `padding`, or None if cropping would not save anything.
+    Works on a downsampled ink mask: strokes are dilated into blobs, specks are
+    ignored, and large or strip-shaped blobs touching the image border are treated
+    as desk background or scanner edges rather than content.
+    """
+    height, width = page.shape[:2]
+    factor = min(1.0, CROP_ANALYSIS_EDGE / max(height, width))
+    ink = (page < 128).astype(np.uint8) * 255
+    # Opening drops the isolated specks adaptive thresholding leaves in flat noisy areas
+    ink = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    small = cv2.resize(ink, (max(1, round(width * factor)), max(1, round(height * factor))), interpolation=cv2.INTER_AREA)
+    mask = cv2.dilate((small >= 64).astype(np.uint8), np.ones((5, 5), np.uint8))
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    small_h, small_w = mask.shape
+    boxes = []
+    for i in range(1, count):
+        x, y, w, h, area = stats[i]
+        if area < 60:
+            continue
+        touches_border = x == 0 or y == 0 or x + w >= small_w or y + h >= small_h
+        if touches_border:
+            # Desk background (huge) or a scanner bed edge (thin strip along a side).
+            # Anything else touching the border is kept so text near the edge is never cut.
+            huge = area > 0.25 * small_w * small_h
+            strip = (w < 0.05 * small_w and h > 0.3 * small_h) or (h < 0.05 * small_h and w > 0.3 * small_w)
+            # Thresholding artifacts cling to the border too; only word-sized blobs count there
+            if huge or strip or area < 200:
+                continue
+        boxes.append((x, y, x + w, y + h))
+    if not boxes:
+        return None
+
+    x0 = min(b[0] for b in boxes) / factor - padding
+    y0 = min(b[1] for b in boxes) / factor - padding
+    x1 = max(b[2] for b in boxes) / factor + padding
+    y1 = max(b[3] for b in boxes) / factor + padding
+    x0, y0 = max(0, int(x0)), max(0, int(y0))
+    x1, y1 = min(width, int(np.ceil(x1))), min(height, int(np.ceil(y1)))
+
+    if (x1 - x0) * (y1 - y0) > (1 - CROP_MIN_SAVING) * width * height:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
 
-def enhance_image(image_path: Union[str, Path]) -> str:
+def to_source_coordinates(payload: ImagePayload, x: float, y: float) -> Tuple[float, float]:
+    """Maps a pixel position in the sent (cropped, possibly downscaled) image back to the source page."""
+    offset_x, offset_y = (payload.crop_box or [0, 0])[:2]
+    return offset_x + x / payload.scale, offset_y + y / payload.scale
+
+def _mime_type_for(path: Union[str, Path]) -> str:
+    return mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+
+def _passthrough_payload(image: Union[str, Path, np.ndarray]) -> ImagePayload:
+    """Wraps the unmodified source image when the enhancement pipeline cannot run."""
+    if isinstance(image, np.ndarray):
+        data = encode_image(image)
+        return ImagePayload(data=data, mime_type="image/png", original_bytes=len(data), enhancement="original")
+    try:
+        with open(image, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        # Let the transcription step report the failure for this page instead of crashing the run
+        print(f"Failed to read image {image}: {e}")
+        data = b""
+    return ImagePayload(data=data, mime_type=_mime_type_for(image), source_path=str(image), encoding="original", original_bytes=len(data), enhancement="original")
+
+def estimate_page_quality(gray: np.ndarray) -> Dict[str, float]:
+    """
+    Cheap page quality estimate on a decimated copy of the grayscale page.
+    Decimation (rather than area resampling) keeps the per-pixel noise intact.
+    - noise_sigma: robust (median-based) estimate of Gaussian noise from a Laplacian-like
+      filter response; text edges are a minority of pixels and don't move the median.
+    - contrast: spread between the 1st and 99th intensity percentiles.
+    - binary_fraction: share of pixels that are already near pure black or white.
+    """
+    step = max(1, int(np.ceil(max(gray.shape[:2]) / QUALITY_SAMPLE_EDGE)))
+    sample = gray[::step, ::step]
+
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = cv2.filter2D(sample.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    # The kernel's response to unit-variance white noise has std 6 (sqrt of 36)
+    noise_sigma = 1.4826 * float(np.median(np.abs(response))) / 6.0
+
+    p1, p99 = np.percentile(sample, [1, 99])
+    binary_fraction = float(np.mean((sample <= 30) | (sample >= 225)))
+    return {
+        "noise_sigma": round(noise_sigma, 3),
+        "contrast": float(p99 - p1),
+        "binary_fraction": round(binary_fraction, 4),
+    }
+
+def compute_page_signature(gray: np.ndarray) -> PageSignature:
+    """
+    Fingerprints a grayscale page:
+    - phash: sign of the 8x8 low-frequency DCT block of a 32x32 copy versus its median
+    - ink_density: share of pixels clearly darker than the page background
+    - thumbnail: 256px-wide copy, compared pixel-wise to confirm pHash matches
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:8, :8].flatten()
+    bits = low_freq > np.median(low_freq[1:])
+    phash = int("".join("1" if b else "0" for b in bits), 2)
+
+    height, width = gray.shape[:2]
+    scale = min(1.0, SIGNATURE_INK_EDGE / max(height, width))
+    reduced = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    background = float(np.median(reduced))
+    ink_density = float(np.mean(reduced < background - 64))
+
+    thumb_height = max(1, round(height * SIGNATURE_THUMBNAIL_WIDTH / width))
+    thumbnail = cv2.resize(gray, (SIGNATURE_THUMBNAIL_WIDTH, thumb_height), interpolation=cv2.INTER_AREA)
+    return PageSignature(
+        phash=f"{phash:016x}",
+        ink_density=round(ink_density, 5),
+        thumbnail=base64.b64encode(encode_image(thumbnail, ".png")).decode("ascii")
+    )
+
+def choose_enhancement(quality: Dict[str, float]) -> str:
+    """
+    Maps a quality estimate to an enhancement level:
+    - none: already clean and essentially two-tone (born-digital renders, clean scans)
+    - light: low noise and good contrast; skip NL-means denoising, just threshold
+    - full: everything else (noisy phone photos, faint scans)
+    """
+    if quality["noise_sigma"] < CLEAN_NOISE_SIGMA and quality["binary_fraction"] >= CLEAN_BINARY_FRACTION:
+        return "none"
+    if quality["noise_sigma"] < LIGHT_NOISE_SIGMA and quality["contrast"] >= LIGHT_MIN_CONTRAST:
+        return "light"
+    return "full"
+
+def enhancement_params() -> Dict[str, object]:
+    """Everything besides the source bytes that determines the enhanced output (used as cache key)."""
+    return {
+        "version": ENHANCE_PIPELINE_VERSION,
+        "denoise": [10, 7, 21],
+        "threshold": [11, 2],
+        "max_long_edge": PAYLOAD_MAX_LONG_EDGE,
+        "adaptive": ADAPTIVE_ENHANCE,
+        "crop": [AUTO_CROP, CROP_PADDING],
+    }
+
+_enhancement_cache: Optional[EnhancementCache] = None
+
+def _get_enhancement_cache() -> Optional[EnhancementCache]:
+    """Per-process cache instance (each pool worker opens its own)."""
+    global _enhancement_cache
+    if _enhancement_cache is None and ENHANCE_CACHE_ENABLED:
+        try:
+            _enhancement_cache = EnhancementCache()
+        except OSError as e:
+            print(f"Warning: enhancement cache disabled: {e}")
+    return _enhancement_cache
+
+def enhance_image(image: Union[str, Path, np.ndarray], use_cache: bool = True) -> ImagePayload:
     """
     Applies an OpenCV pipeline to enhance the image for OCR:
-    Grayscale -> Denoise -> Adaptive Threshold -> Deskew
-    Returns the path to the enhanced image (overwriting the original or saving as temporary).
-    For this implementation, we will overwrite/update in place or return the path if successful.
+    Grayscale -> Quality estimate -> Denoise -> Adaptive Threshold -> Margin crop
+    Clean pages skip denoising (light) or the whole pipeline (none); the level chosen
+    is recorded in `ImagePayload.enhancement`.
+    Accepts an image path or an ndarray and returns the enhanced page as in-memory
+    bytes (`ImagePayload`, encoded by `optimize_payload`), ready to be sent to Gemini
+    without touching the disk.
+    Results for image paths are cached on disk by content hash (`EnhancementCache`),
+    so unchanged pages skip OpenCV entirely on later runs.
+    Falls back to the original image bytes if enhancement fails.
     """
-    image_path_str = str(image_path)
+    source_path = None if isinstance(image, np.ndarray) else str(image)
+    label = source_path or "<ndarray>"
+    cache = _get_enhancement_cache() if use_cache and source_path else None
+    cache_key = None
     try:
-        img = cv2.imread(image_path_str)
+        if source_path:
+            with open(source_path, "rb") as f:
+                source_bytes = f.read()
+            if cache:
+                cache_key = EnhancementCache.make_key(source_bytes, enhancement_params())
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    cached.source_path = source_path
+                    return cached
+            img = cv2.imdecode(np.frombuffer(source_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        else:
+            img = image
+
         if img is None:
-            print(f"Failed to load image: {image_path_str}")
-            return image_path_str
+            print(f"Failed to load image: {label}")
+            return _passthrough_payload(image)
 
         # 1. Grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
 
-        # 2. Denoise
-        denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+        # 2. Decide how much cleaning this page actually needs
+        quality = estimate_page_quality(gray)
+        level = choose_enhancement(quality) if ADAPTIVE_ENHANCE else "full"
+        signature = compute_page_signature(gray)
 
-        # 3. Binarization (Adaptive Threshold)
-        # using gaussian adaptive thresholding for better results on varying lighting
-        binary = cv2.adaptiveThreshold(
-            denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-        )
+        if level == "none":
+            # Clean page: thresholding would only lose anti-aliasing
+            enhanced = gray
+        else:
+            # 3. Denoise (the expensive step, only for noisy pages)
+            if level == "full":
+                denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+            else:
+                denoised = cv2.medianBlur(gray, 3)
+
+            # 4. Binarization (Adaptive Threshold)
+            # using gaussian adaptive thresholding for better results on varying lighting
+            enhanced = cv2.adaptiveThreshold(
+                denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
+            )
 
-        # 4. De-skewing
-        # Find all contours
-        contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # If we have contours, we can try to find the orientation
-        # This is a simple deskewing implementation
-        # For complex handwritten notes, sometimes deskewing can damage layout if not careful.
-        # We will use a minAreaRect approach but limit the rotation angle to avoid flipping.
-        
-        # (Optional: Only deskew if creating a new file, but here we just return the cleaned binary for API)
-        # For API submission, high contrast binary is often good.
-        
-        # Overwrite the file with the enhanced version ?? 
-        # API usually works better with original RGB for semantic understanding (figures, colors), 
-        # BUT for strict handwriting OCR, binarization helps. 
-        # The user requested: "OpenCV pipeline to perform de-skewing, denoising, and binarization before API transmission"
-        # So we will save the enhanced image temporarily or overwrite.
-        # Let's save as a temp file to avoid destroying original data if needed, or just overwrite if that's the flow.
-        # To be safe, let's write to a temporary path or suffix.
-        
-        enhanced_path = image_path_str.replace(".png", "_enhanced.png").replace(".jpg", "_enhanced.jpg")
-        cv2.imwrite(enhanced_path, binary)
-        
-        return enhanced_path
+        # 5. Crop to the ink region (from the binarized page we already have)
+        height, width = enhanced.shape[:2]
+        crop_box = find_content_box(enhanced) if AUTO_CROP else None
+        uncropped = enhanced
+        if crop_box:
+            x, y, w, h = crop_box
+            enhanced = enhanced[y:y + h, x:x + w]
+
+        # API usually works better with original RGB for semantic understanding (figures, colors),
+        # BUT for strict handwriting OCR, binarization helps, so the cleaned binary is what we send.
+        # It is encoded in memory: no `_enhanced` temp files are written next to the source.
+        # With a crop, savings are reported against the full page below instead
+        payload = optimize_payload(enhanced, source_path=source_path, report_savings=PAYLOAD_REPORT_SAVINGS and not crop_box)
+        payload.enhancement = level
+        payload.quality = quality
+        payload.signature = signature
+        payload.original_size = [width, height]
+        payload.crop_box = list(crop_box) if crop_box else [0, 0, width, height]
+        if crop_box and PAYLOAD_REPORT_SAVINGS:
+            # Report savings against the full, uncropped page
+            payload.original_bytes = len(encode_image(uncropped, ".png"))
+        if cache_key:
+            cache.put(cache_key, payload)
+        return payload
 
     except Exception as e:
-        print(f"Error enhancing image {image_path_str}: {e}")
-        return image_path_str
+        print(f"Error enhancing image {label}: {e}")
+        return _passthrough_payload(image)
+
+_enhance_pools: Dict[int, ProcessPoolExecutor] = {}
+_enhance_pools_lock = threading.Lock()
+
+def _init_enhance_worker():
+    # One OpenCV thread per process: parallelism comes from the pool itself.
+    cv2.setNumThreads(1)
+
+def _get_enhance_pool(workers: int) -> ProcessPoolExecutor:
+    """Returns a process pool shared by all `enhance_images` calls with the same worker count."""
+    with _enhance_pools_lock:
+        pool = _enhance_pools.get(workers)
+        if pool is None:
+            # spawn: callers may have live threads (e.g. the PDF renderer), which fork doesn't tolerate.
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_enhance_worker
+            )
+            _enhance_pools[workers] = pool
+        return pool
+
+def enhance_images(pages: Iterable[Union[str, Path, np.ndarray]], workers: int = ENHANCE_WORKERS) -> Iterator[ImagePayload]:
+    """
+    Batch version of `enhance_image` backed by a ProcessPoolExecutor.
+    Consumes `pages` lazily (it may be a generator such as `iter_pdf_pages`), keeps
+    about two pages per worker in flight, and yields the enhanced payloads in input
+    order, so denoising runs on every core while the caller is busy on the network.
+    """
+    workers = max(1, workers)
+    if workers == 1:
+        for page in pages:
+            yield enhance_image(page)
+        return
+
+    pool = _get_enhance_pool(workers)
+    in_flight = deque()
+    page_iter = iter(pages)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(in_flight) < workers * 2:
+                try:
+                    page = next(page_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.append(pool.submit(enhance_image, page))
+            if not in_flight:
+                return
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
 
 def get_image_grouping(folder_path: Union[str, Path]) -> Dict[str, List[str]]:
     """
     Scans the folder for images matching 'TitleXImageY.format'.
     Returns a dictionary mapping 'Title' to a list of sorted image paths.
+    Backed by a persistent `ImageIndex`, so only files added, removed or modified
+    since the previous scan are re-parsed.
     """
     folder_path = Path(folder_path)
-    groups = {}
-    
-    # Pattern explanation:
-    # ^(.+?)                : Capture the Title (non-greedy) at the start
-    # (?:[\sX_-]+|XImage)   : Separator (Spaces, 'X', '_', '-', or 'XImage' literal)
-    # (\d+)                 : The Image/Page Number
-    # \.(...)$              : Extension
-    pattern = re.compile(r"^(.+?)(?:[\sX_-]+|XImage)(\d+)\.(png|jpg|jpeg|pdf|webp)$", re.IGNORECASE)
-
     if not folder_path.exists():
-        return groups
-        
-    for p in folder_path.iterdir():
-        if not p.is_file():
-            continue
-        
-        # Skip hidden files
-        if p.name.startswith('.'):
-            continue
-            
-        match = pattern.match(p.name)
-        if match:
-            title = match.group(1).strip()
-            # image_num = int(match.group(2))
-            if title not in groups:
-                groups[title] = []
-            groups[title].append(str(p))
-            
-    # Sort images in each group by the number Y
-    for title in groups:
-        groups[title].sort(key=lambda x: int(pattern.search(Path(x).name).group(2)))
-        
-    return groups
+        return {}
 
+    index = ImageIndex(str(folder_path))
+    index.refresh()
+    return index.groups(folder_path)
@@ -2,6 +2,7 @@ import json
 import os
 from pydantic import BaseModel, Field
 from src.services.batch_processor import BatchProcessor
+from src.utils import usage
 
 class CheckBatchStatusInput(BaseModel):
     job_id: str = Field(..., description="The Batch Job ID returned by the process_document tool.")
@@ -11,6 +12,7 @@ class CheckBatchStatusInput(BaseModel):
 def check_batch_job(input_data: CheckBatchStatusInput) -> str:
     try:
         job_id = input_data.job_id
+        skipped_pages = None
         
         if job_id.startswith("local-"):
             state_file = f"/Users/apple/Research/docs-to-code/{job_id}.json"
@@ -32,6 +34,7 @@ def check_batch_job(input_data: CheckBatchStatusInput) -> str:
                 return json.dumps({"status": "processing_background", "message": "Waiting for Gemini Batch API Job ID..."}, indent=2)
                 
             job_id = real_job_id
+            skipped_pages = state.get("skipped_pages")
             
         processor = BatchProcessor()
         result_meta = processor.check_job_status(job_id)
@@ -42,11 +45,14 @@ def check_batch_job(input_data: CheckBatchStatusInput) -> str:
             extraction_result = processor.download_and_extract_results(
                 job_id, 
                 input_data.output_format, 
-                input_data.output_dir
+                input_data.output_dir,
+                skipped_pages=skipped_pages
             )
+            usage.get_tracker().flush()
             return json.dumps({
                 "status": "success",
-                "message": extraction_result
+                "message": extraction_result,
+                "usage": usage.get_tracker().summary(job_id)
             }, indent=2)
             
         elif status == "processing":
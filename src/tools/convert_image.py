@@ -1,8 +1,10 @@
 import os
 import json
+import uuid
 from src.services import vision
 from src.services.intelligence import Intelligence
 from src.models.tool_schemas import ConvertImageInput
+from src.utils import usage
 
 def convert_image_to_latex_markdown(input_data: ConvertImageInput) -> str:
     """
@@ -21,8 +23,8 @@ def convert_image_to_latex_markdown(input_data: ConvertImageInput) -> str:
                 "details": f"The file at path '{image_path}' does not exist or is not readable."
             })
             
-        # Enhance image for better OCR
-        enhanced_path = vision.enhance_image(image_path)
+        # Enhance image for better OCR (kept in memory)
+        enhanced = vision.enhance_image(image_path)
         
         # Determine transcribing instance
         try:
@@ -34,19 +36,15 @@ def convert_image_to_latex_markdown(input_data: ConvertImageInput) -> str:
              })
 
         # Transcribe using Gemini API
-        content = intel.transcribe_image(enhanced_path, mode=mode)
-
-        # Cleanup enhanced temp file
-        if enhanced_path != image_path and "_enhanced" in enhanced_path:
-            try:
-                os.remove(enhanced_path)
-            except Exception:
-                pass
+        job_id = f"convert-{uuid.uuid4().hex[:8]}"
+        with usage.scope(job=job_id, document=os.path.basename(image_path)):
+            content = intel.transcribe_image(enhanced, mode=mode)
+        usage.get_tracker().flush()
 
         # Format output
         if isinstance(content, dict):
-            # Includes base_latex_md and annotations_metadata
-            return json.dumps(content, indent=2)
+            # Includes base_latex_md and annotations_metadata, plus what the call cost
+            return json.dumps(dict(content, usage=usage.get_tracker().summary(job_id)["totals"]), indent=2)
         else:
             # Fallback if content was just a string
             return json.dumps({"raw_content": str(content)})
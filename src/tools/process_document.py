@@ -8,6 +8,12 @@ from typing import Literal, Optional
 from src.services import vision
 from src.services.intelligence import CachedIntelligence
 from src.services.batch_processor import BatchProcessor
+from src.services.preflight import Preflight, blank_page_content
+from src.services import text_layer
+from src.utils import llm_utils
+from src.utils import hedging
+from src.utils import result_cache
+from src.utils import usage
 
 class ProcessDocumentInput(BaseModel):
     document_path: str = Field(..., description="The absolute file path to the PDF document or a folder of images.")
@@ -20,8 +26,14 @@ def background_task(doc_path, work_dir, mode, is_pdf, local_job_id):
         with open(state_file, "w") as f:
             json.dump({"status": "extracting_images"}, f)
             
+        text_pages = []
         if is_pdf:
-            image_paths = vision.process_pdf(doc_path, work_dir)
+            # Born-digital pages go as text; only the rest is rendered and staged
+            # while later windows are still rendering.
+            base_name = os.path.splitext(os.path.basename(doc_path))[0]
+            layer_pages, vision_pages = text_layer.split_pdf_pages(doc_path)
+            text_pages = [{"label": f"{base_name}XImage{page['page']}.txt", "text": page["text"]} for page in layer_pages]
+            image_paths = vision.iter_pdf_pages(doc_path, work_dir, pages=vision_pages)
         else:
             image_paths = [os.path.join(doc_path, f) for f in os.listdir(doc_path) if f.lower().endswith((".png", ".jpg", ".jpeg"))]
             
@@ -29,7 +41,8 @@ def background_task(doc_path, work_dir, mode, is_pdf, local_job_id):
             json.dump({"status": "uploading_images"}, f)
             
         processor = BatchProcessor()
-        result = processor.process_directory_batch(image_paths, mode)
+        # Stage enhanced, size-optimized payloads rather than the raw page scans
+        result = processor.process_directory_batch(vision.enhance_images(image_paths), mode, text_pages=text_pages)
         
         with open(state_file, "w") as f:
             json.dump(result, f)
@@ -81,26 +94,79 @@ def smart_process_document(input_data: ProcessDocumentInput) -> str:
 
         else:
             intel = CachedIntelligence()
-            try:
-                if is_pdf:
-                    image_paths = vision.process_pdf(doc_path, work_dir)
-                else:
-                    image_paths = [os.path.join(doc_path, f) for f in os.listdir(doc_path) if f.lower().endswith((".png", ".jpg", ".jpeg"))]
+            job_id = f"sync-{uuid.uuid4().hex[:8]}"
+            # Every Gemini call below is accounted to this job and document (see `usage`)
+            with usage.scope(job=job_id, document=base_name):
+                try:
+                    text_pages = []
+                    if is_pdf:
+                        text_pages, vision_pages = text_layer.split_pdf_pages(doc_path)
+                        image_paths = vision.iter_pdf_pages(doc_path, work_dir, pages=vision_pages)
+                    else:
+                        image_paths = [os.path.join(doc_path, f) for f in os.listdir(doc_path) if f.lower().endswith((".png", ".jpg", ".jpeg"))]
+
+                    intel.initialize_cache(mode)
+                    results_log = []
+                    # Text-layer pages never touch the rasterizer or the vision model
+                    for page in text_pages:
+                        file_name = f"{base_name}XImage{page['page']}.txt"
+                        results_log.append({
+                            "file": file_name,
+                            "enhancement": "text_layer",
+                            "preflight": "text",
+                            "content": text_layer.transcribe_text_page(intel, page, mode, file_name)
+                        })
+                    preflight = Preflight()
+                    transcribed = {}
+                    entries = []
+
+                    def _api_pages():
+                        # Pages are denoised on the process pool while earlier ones are being transcribed
+                        for enhanced in vision.enhance_images(image_paths):
+                            file_name = os.path.basename(enhanced.source_path)
+                            decision, original = preflight.check(enhanced, file_name)
+                            entry = {"file": file_name, "enhancement": enhanced.enhancement, "preflight": decision}
+                            if original:
+                                entry["duplicate_of"] = original
+                            entries.append(entry)
+                            if decision == "unique":
+                                yield enhanced
+
+                    def _store(index, enhanced, content):
+                        transcribed[os.path.basename(enhanced.source_path)] = content
+
+                    intel.transcribe_many(_api_pages(), mode=mode, on_result=_store)
 
-                intel.initialize_cache(mode)
-                results_log = []
-                for p in image_paths:
-                    enhanced = vision.enhance_image(p)
-                    content = intel.transcribe_image(enhanced, mode)
-                    if enhanced != p:
-                        try: os.remove(enhanced)
-                        except: pass
-                    results_log.append({"file": os.path.basename(p), "content": content})
-                intel.cleanup()
-                return json.dumps({"status": "success", "results": results_log}, indent=2)
-            except Exception as e:
-                intel.cleanup()
-                raise e
+                    for entry in entries:
+                        if entry["preflight"] == "blank":
+                            entry["content"] = blank_page_content()
+                        elif entry["preflight"] == "duplicate":
+                            entry["content"] = transcribed[entry["duplicate_of"]]
+                        else:
+                            entry["content"] = transcribed[entry["file"]]
+                        results_log.append(entry)
+                    intel.cleanup()
+                    for entry in results_log:
+                        # Which cascade tier served the page, and why cheaper tiers were passed over
+                        entry.update(intel.cascade_stats.pages.get(entry["file"], {}))
+                        entry["usage"] = usage.get_tracker().page_totals(job_id, base_name, entry["file"])
+                    if text_pages:
+                        results_log.sort(key=lambda entry: BatchProcessor._page_number(entry["file"], 0))
+                    usage.get_tracker().flush()
+                    return json.dumps({
+                        "status": "success",
+                        "preflight": preflight.summary(),
+                        "text_layer_pages": len(text_pages),
+                        "json_repair": llm_utils.parse_stats(),
+                        "hedging": hedging.get_hedger().summary() if hedging.HEDGE_REQUESTS else None,
+                        "cascade": intel.cascade_stats.summary(),
+                        "result_cache": result_cache.get_cache().summary() if result_cache.get_cache() else None,
+                        "usage": usage.get_tracker().summary(job_id),
+                        "results": results_log
+                    }, indent=2)
+                except Exception as e:
+                    intel.cleanup()
+                    raise e
 
     except Exception as e:
         return json.dumps({"error": "TrafficControllerException", "details": str(e)})
@@ -0,0 +1,36 @@
+import asyncio
+import contextvars
+import threading
+from typing import Any, Coroutine, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the shared event loop that runs on a daemon thread.
+    The genai async client keeps its connection pool bound to the loop it first ran on,
+    so every async call from sync code goes through this one loop instead of `asyncio.run`.
+    """
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="docs-to-code-async", daemon=True)
+            thread.start()
+    return _loop
+
+async def _in_context(coro: Coroutine, values) -> Any:
+    for var, value in values:
+        var.set(value)
+    return await coro
+
+def run_coroutine(coro: Coroutine) -> Any:
+    """
+    Runs `coro` to completion from synchronous code and returns its result.
+    Safe to call while another event loop is running in this thread (e.g. a FastMCP
+    tool handler), since the coroutine executes on the background loop.
+    The caller's context variables (e.g. `usage.scope` labels) are visible to `coro`.
+    """
+    values = list(contextvars.copy_context().items())
+    return asyncio.run_coroutine_threadsafe(_in_context(coro, values), get_loop()).result()
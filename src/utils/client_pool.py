@@ -0,0 +1,48 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from google import genai
+from google.genai import types
+
+# Idle keep-alive connections held per client, and how long they stay open between MCP calls.
+GEMINI_POOL_CONNECTIONS = int(os.getenv("GEMINI_POOL_CONNECTIONS", "20"))
+GEMINI_KEEPALIVE_SECONDS = float(os.getenv("GEMINI_KEEPALIVE_SECONDS", "300"))
+
+_clients: Dict[Tuple, genai.Client] = {}
+_lock = threading.Lock()
+
+def _http_options(options: Dict[str, Any]) -> Optional[types.HttpOptions]:
+    """
+    HttpOptions with a long-lived keep-alive pool for both the sync client and `client.aio`
+    (which carries most traffic), plus any caller options (timeout, api_version, ...).
+    """
+    limits = httpx.Limits(
+        max_connections=None,
+        max_keepalive_connections=GEMINI_POOL_CONNECTIONS,
+        keepalive_expiry=GEMINI_KEEPALIVE_SECONDS
+    )
+    try:
+        return types.HttpOptions(client_args={"limits": limits}, async_client_args={"limits": limits}, **options)
+    except Exception:
+        # Older SDKs have no client_args; their default pool still gets reused through this cache
+        return types.HttpOptions(**options) if options else None
+
+def get_client(api_key: Optional[str] = None, **options) -> genai.Client:
+    """
+    Returns the process-wide `genai.Client` for this API key and option set, creating it
+    on first use. Services borrow clients from here instead of building their own, so
+    repeated MCP tool calls reuse warm HTTP connections instead of paying TCP/TLS setup again.
+    """
+    api_key = api_key or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found. Please set it in environment variables or .env file.")
+
+    key = (api_key, tuple(sorted((name, repr(value)) for name, value in options.items())))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = genai.Client(api_key=api_key, http_options=_http_options(options))
+            _clients[key] = client
+    return client
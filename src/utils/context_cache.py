@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: the registry is only guarded within the process
+    fcntl = None
+
+from google.genai import types
+
+from src.utils import rate_limiter
+
+CONTEXT_CACHE_REGISTRY_PATH = os.getenv("CONTEXT_CACHE_REGISTRY_PATH", os.path.expanduser("~/.cache/docs-to-code/context_caches.json"))
+# TTL given to a cache on creation and on every extension.
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# A cache in use is extended once its remaining lifetime drops below this.
+CONTEXT_CACHE_EXTEND_BELOW = int(os.getenv("CONTEXT_CACHE_EXTEND_BELOW", "900"))
+# Caches unused for this long are deleted instead of being left to bill storage until they expire.
+CONTEXT_CACHE_IDLE_SECONDS = int(os.getenv("CONTEXT_CACHE_IDLE_SECONDS", "1800"))
+# After a failed creation (e.g. prompt below the model's caching minimum), wait this long before trying again.
+CREATE_FAILURE_BACKOFF = 600
+# Another process creating the same cache is waited for at most this long before taking over.
+CREATE_TIMEOUT = 120
+# While a process holds a cache, it refreshes `last_used` (and the TTL) this often; a holder that
+# has not done so for three intervals is assumed to have died.
+CONTEXT_CACHE_HEARTBEAT_SECONDS = int(os.getenv("CONTEXT_CACHE_HEARTBEAT_SECONDS", "300"))
+
+class ContextCacheRegistry:
+    """
+    Shares Gemini context caches across documents, threads and processes.
+    Caches are keyed by (API key project, model, mode, SHA-256 of the prompt) and recorded
+    in a JSON registry as {"name", "expires_at", "last_used", "holders"}. `acquire` reuses a
+    live cache (extending its TTL when it is close to expiring) and only creates one when none
+    exists, so a server pays creation once per mode. Until `release`, a heartbeat thread keeps
+    every cache this process holds fresh; caches without a live holder are deleted once nobody
+    has used them for `CONTEXT_CACHE_IDLE_SECONDS`.
+    Every read-modify-write of the registry holds an exclusive `flock` on `<registry>.lock`,
+    so concurrent CLI, MCP and batch processes neither overwrite each other's entries nor
+    create duplicate caches. The lock is never held across a Gemini API call: a creation in
+    progress is marked in the registry and other processes wait for it.
+    """
+    def __init__(self, registry_path: str = None):
+        self.registry_path = registry_path or CONTEXT_CACHE_REGISTRY_PATH
+        self.stats = {"created": 0, "reused": 0, "extended": 0, "deleted": 0}
+        self._failures: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Caches held by this process: name -> [client, registry key, hold count]
+        self._held: Dict[str, list] = {}
+        self._held_lock = threading.Lock()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @contextmanager
+    def _locked(self):
+        """Holds the registry for this thread and, through a sidecar lock file, for other processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.registry_path)), exist_ok=True)
+            with open(self.registry_path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.registry_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self, state: Dict[str, Dict[str, Any]]):
+        try:
+            os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.registry_path), prefix=".tmp-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.registry_path)
+        except OSError as e:
+            print(f"Warning: could not write context cache registry: {e}")
+
+    @staticmethod
+    def _project(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+    @staticmethod
+    def _holder() -> str:
+        return str(os.getpid())
+
+    @classmethod
+    def make_key(cls, api_key: str, model_name: str, mode: str, prompt: str) -> str:
+        project = cls._project(api_key)
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+        return f"{project}:{model_name}:{mode}:{prompt_hash}"
+
+    def acquire(self, client, api_key: str, model_name: str, mode: str, prompt: str, display_name: str = "docs-to-code-cache") -> Optional[str]:
+        """
+        Returns the name of a live cache holding `prompt`, creating one only if none exists
+        (None on failure). The caller holds the cache until `release`.
+        """
+        key = self.make_key(api_key, model_name, mode, prompt)
+        while True:
+            with self._locked():
+                now = time.time()
+                if self._failures.get(key, 0) > now:
+                    return None
+                state = self._load_state()
+                idle = self._reap(state, now, self._project(api_key), keep=key)
+                entry = state.get(key)
+                if entry and not entry.get("name") and entry.get("creating_until", 0) > now:
+                    action = "wait"
+                elif entry and entry.get("name") and entry["expires_at"] > now + 60:
+                    entry["last_used"] = now
+                    entry.setdefault("holders", {})[self._holder()] = now
+                    action = "extend" if entry["expires_at"] - now < CONTEXT_CACHE_EXTEND_BELOW else "reuse"
+                else:
+                    state[key] = {"creating_until": now + CREATE_TIMEOUT}
+                    action = "create"
+                self._save_state(state)
+            self._delete(client, idle)
+
+            if action == "wait":
+                time.sleep(1)
+                continue
+            if action == "create":
+                return self._create(client, key, model_name, prompt, display_name)
+            if action == "extend" and not self._extend(client, key, entry["name"]):
+                # Gone on the server side (deleted or expired early): create a fresh one
+                with self._locked():
+                    state = self._load_state()
+                    if state.get(key, {}).get("name") == entry["name"]:
+                        del state[key]
+                        self._save_state(state)
+                continue
+            self.stats["reused"] += 1
+            print(f"Reusing Context Cache: {entry['name']}")
+            self._hold(client, key, entry["name"])
+            return entry["name"]
+
+    def _create(self, client, key: str, model_name: str, prompt: str, display_name: str) -> Optional[str]:
+        try:
+            cached = rate_limiter.get_limiter().call(
+                client.caches.create,
+                model=model_name,
+                config=types.CreateCachedContentConfig(
+                    contents=[prompt],
+                    display_name=display_name,
+                    ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                )
+            )
+        except Exception as e:
+            print(f"Context Cache creation failed, falling back to non-cached. Details: {e}")
+            with self._locked():
+                self._failures[key] = time.time() + CREATE_FAILURE_BACKOFF
+                state = self._load_state()
+                if key in state and not state[key].get("name"):
+                    del state[key]
+                    self._save_state(state)
+            return None
+
+        with self._locked():
+            now = time.time()
+            state = self._load_state()
+            state[key] = {"name": cached.name, "expires_at": now + CONTEXT_CACHE_TTL_SECONDS, "last_used": now, "holders": {self._holder(): now}}
+            self._save_state(state)
+        self.stats["created"] += 1
+        print(f"Context Cache created successfully: {cached.name}")
+        self._hold(client, key, cached.name)
+        return cached.name
+
+    def _extend(self, client, key: str, name: str) -> bool:
+        try:
+            rate_limiter.get_limiter().call(
+                client.caches.update,
+                name=name,
+                config=types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s")
+            )
+        except Exception as e:
+            print(f"Context Cache {name} could not be extended. Details: {e}")
+            return False
+        with self._locked():
+            state = self._load_state()
+            if state.get(key, {}).get("name") == name:
+                state[key]["expires_at"] = time.time() + CONTEXT_CACHE_TTL_SECONDS
+                self._save_state(state)
+        self.stats["extended"] += 1
+        return True
+
+    def _hold(self, client, key: str, name: str):
+        with self._held_lock:
+            held = self._held.setdefault(name, [client, key, 0])
+            held[2] += 1
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(CONTEXT_CACHE_HEARTBEAT_SECONDS)
+            with self._held_lock:
+                if not self._held:
+                    self._heartbeat = None
+                    return
+            self.heartbeat()
+
+    def heartbeat(self):
+        """Marks every cache this process holds as in use, extending the TTL of those close to expiring."""
+        with self._held_lock:
+            held = [(name, client, key) for name, (client, key, _) in self._held.items()]
+        for name, client, key in held:
+            with self._locked():
+                now = time.time()
+                state = self._load_state()
+                entry = state.get(key)
+                if not entry or entry.get("name") != name:
+                    continue
+                entry["last_used"] = now
+                entry.setdefault("holders", {})[self._holder()] = now
+                self._save_state(state)
+            if entry["expires_at"] - now < CONTEXT_CACHE_EXTEND_BELOW:
+                self._extend(client, key, name)
+
+    def release(self, client, api_key: str, name: str):
+        """Drops this holder's claim on the cache, marks it as just used and deletes any other caches that have gone idle."""
+        with self._held_lock:
+            held = self._held.get(name)
+            if held:
+                held[2] -= 1
+                if held[2] <= 0:
+                    del self._held[name]
+            still_held = name in self._held
+        with self._locked():
+            now = time.time()
+            state = self._load_state()
+            for entry in state.values():
+                if entry.get("name") == name:
+                    entry["last_used"] = now
+                    if not still_held:
+                        entry.get("holders", {}).pop(self._holder(), None)
+            idle = self._reap(state, now, self._project(api_key))
+            self._save_state(state)
+        self._delete(client, idle)
+
+    def _reap(self, state: Dict[str, Dict[str, Any]], now: float, project: str, keep: str = None) -> List[str]:
+        """Drops expired, abandoned and idle entries from `state`; returns the names of the caches to delete."""
+        idle = []
+        for key in list(state):
+            entry = state[key]
+            if not entry.get("name"):
+                if entry.get("creating_until", 0) <= now:
+                    del state[key]
+            elif entry["expires_at"] <= now:
+                del state[key]
+            elif key != keep and key.startswith(project + ":") and now - entry.get("last_used", 0) > CONTEXT_CACHE_IDLE_SECONDS:
+                holders = entry.get("holders", {})
+                if any(now - seen < 3 * CONTEXT_CACHE_HEARTBEAT_SECONDS for seen in holders.values()):
+                    continue
+                idle.append(entry["name"])
+                del state[key]
+        return idle
+
+    def _delete(self, client, names: List[str]):
+        for name in names:
+            try:
+                rate_limiter.get_limiter().call(client.caches.delete, name=name)
+                self.stats["deleted"] += 1
+                print(f"Cleaned up idle Context Cache: {name}")
+            except Exception as e:
+                print(f"Failed to cleanup cache: {e}")
+
+_registry: Optional[ContextCacheRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> ContextCacheRegistry:
+    """Returns the process-wide context cache registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ContextCacheRegistry()
+    return _registry
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import Optional, Dict, Any
+
+from src.models.data_models import ImagePayload
+
+ENHANCE_CACHE_DIR = os.getenv("ENHANCE_CACHE_DIR", os.path.expanduser("~/.cache/docs-to-code/enhanced"))
+ENHANCE_CACHE_MAX_BYTES = int(os.getenv("ENHANCE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+class EnhancementCache:
+    """
+    On-disk cache of enhanced page payloads.
+    Entries are keyed by the SHA-256 of the source image bytes plus the enhancement
+    parameters, so re-runs over an already processed corpus skip OpenCV entirely.
+    Each entry is a `<key>.bin` payload and a `<key>.json` metadata file; the mtime of the
+    metadata file is the last access time, and the least recently used entries are
+    evicted once the cache grows beyond `max_bytes`.
+    """
+    def __init__(self, cache_dir: str = None, max_bytes: int = ENHANCE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir or ENHANCE_CACHE_DIR
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(source_bytes: bytes, params: Dict[str, Any]) -> str:
+        """Content hash of the source image combined with the pipeline parameters."""
+        digest = hashlib.sha256(source_bytes)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _paths(self, key: str):
+        shard = os.path.join(self.cache_dir, key[:2])
+        return shard, os.path.join(shard, f"{key}.bin"), os.path.join(shard, f"{key}.json")
+
+    def get(self, key: str) -> Optional[ImagePayload]:
+        """Returns the cached payload for `key`, or None on a miss."""
+        _, data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                data = f.read()
+        except (OSError, json.JSONDecodeError):
+            return None
+        try:
+            # Touch the entry so eviction is least-recently-used rather than oldest-written
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return ImagePayload(data=data, **meta)
+
+    def put(self, key: str, payload: ImagePayload):
+        """Stores the payload atomically and evicts old entries if the cache is over budget."""
+        shard, data_path, meta_path = self._paths(key)
+        os.makedirs(shard, exist_ok=True)
+        meta = payload.model_dump(exclude={"data"})
+        try:
+            self._write_atomic(data_path, payload.data)
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError as e:
+            print(f"Warning: could not write enhancement cache entry: {e}")
+            return
+
+        if self._total_bytes is None:
+            self._total_bytes = self._scan()[1]
+        else:
+            self._total_bytes += len(payload.data)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    @staticmethod
+    def _write_atomic(path: str, content: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _scan(self):
+        """Returns ([(last_access, size, key), ...], total_bytes) for every complete entry."""
+        entries = []
+        total = 0
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                key = entry.name[:-5]
+                try:
+                    size = os.path.getsize(os.path.join(shard.path, f"{key}.bin"))
+                    entries.append((entry.stat().st_mtime, size, key))
+                    total += size
+                except OSError:
+                    continue
+        return entries, total
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is back under 90% of its budget."""
+        entries, total = self._scan()
+        target = int(self.max_bytes * 0.9)
+        for _, size, key in sorted(entries):
+            if total <= target:
+                break
+            _, data_path, meta_path = self._paths(key)
+            for path in (meta_path, data_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+        self._total_bytes = total
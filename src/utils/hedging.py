@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Fire a duplicate request for pages still running at this latency percentile of recent calls.
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "0").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+# Extra (hedge) requests may not exceed this fraction of all calls.
+HEDGE_MAX_FRACTION = float(os.getenv("HEDGE_MAX_FRACTION", "0.1"))
+# Completed calls needed before the percentile is trusted, and how many recent calls it covers.
+HEDGE_MIN_SAMPLES = 10
+HEDGE_WINDOW = 200
+
+class LatencyTracker:
+    """Sliding window of recent call latencies (seconds)."""
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Hedger:
+    """
+    Cuts tail latency by racing a duplicate request against a slow one.
+    `run` starts the call; if it is still pending at the tracked `percentile` latency and
+    the hedge budget allows, a second identical call is started, the first successful
+    result wins, and the other is cancelled (and awaited) before `run` returns.
+    Only single generate calls are hedged (see `llm_utils.hedge_requests`), so the losing
+    copy never reaches usage accounting, the cascade or the result cache.
+    """
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, max_fraction: float = HEDGE_MAX_FRACTION):
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.tracker = LatencyTracker()
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+
+    def _take_hedge_slot(self) -> bool:
+        with self._lock:
+            if self.stats["hedged"] + 1 > self.max_fraction * self.stats["calls"]:
+                return False
+            self.stats["hedged"] += 1
+            return True
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["hedge_rate"] = round(stats["hedged"] / stats["calls"], 4) if stats["calls"] else 0.0
+        stats["win_rate"] = round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+        threshold = self.tracker.percentile(self.percentile)
+        stats["threshold_seconds"] = round(threshold, 2) if threshold is not None else None
+        return stats
+
+    async def run(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Awaits `factory()`, hedging it with a second `factory()` call when it runs long."""
+        with self._lock:
+            self.stats["calls"] += 1
+        started = time.monotonic()
+        primary = asyncio.ensure_future(factory())
+        threshold = self.tracker.percentile(self.percentile)
+
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done or not self._take_hedge_slot():
+            result = await primary
+            self.tracker.record(time.monotonic() - started)
+            return result
+
+        hedge = asyncio.ensure_future(factory())
+        pending = {primary, hedge}
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if winner is None:
+            # Both calls raised; surface the primary's error
+            return primary.result()
+        if winner is hedge:
+            with self._lock:
+                self.stats["hedge_wins"] += 1
+        self.tracker.record(time.monotonic() - started)
+        return winner.result()
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+def get_hedger() -> Hedger:
+    """Returns the process-wide hedger (latencies are shared by all transcriptions)."""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger()
+    return _hedger
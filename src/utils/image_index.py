@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+INDEX_DIR = os.path.expanduser("~/.cache/docs-to-code/index")
+
+# Pattern explanation:
+# ^(.+?)                : Capture the Title (non-greedy) at the start
+# (?:[\sX_-]+|XImage)   : Separator (Spaces, 'X', '_', '-', or 'XImage' literal)
+# (\d+)                 : The Image/Page Number
+# \.(...)$              : Extension
+IMAGE_NAME_PATTERN = re.compile(r"^(.+?)(?:[\sX_-]+|XImage)(\d+)\.(png|jpg|jpeg|pdf|webp)$", re.IGNORECASE)
+
+def parse_image_name(name: str) -> Tuple[Optional[str], Optional[int]]:
+    """Returns (title, page number) for a 'TitleXImageY.format' name, or (None, None)."""
+    match = IMAGE_NAME_PATTERN.match(name)
+    if not match:
+        return None, None
+    return match.group(1).strip(), int(match.group(2))
+
+class ImageIndex:
+    """
+    Persistent index of the page images in one folder, maintained with `os.scandir`.
+    Stores (size, mtime, title, page number) per file plus the sorted groups, so a
+    refresh only parses entries that are new or changed and only touches the groups
+    they belong to. Every refresh still stats each file: a page edited in place does
+    not change the folder's mtime, so that alone can't tell the index is current.
+    The index lives under ~/.cache/docs-to-code/index so writing it never changes
+    the folder being indexed.
+    """
+    def __init__(self, folder_path: str, index_path: str = None):
+        self.folder_path = os.path.abspath(str(folder_path))
+        if not index_path:
+            folder_hash = hashlib.sha1(self.folder_path.encode("utf-8")).hexdigest()
+            index_path = os.path.join(INDEX_DIR, f"{folder_hash}.json")
+        self.index_path = index_path
+        self.state = self._load_state()
+
+    def _empty_state(self) -> Dict:
+        return {"folder": self.folder_path, "entries": {}, "groups": {}}
+
+    def _load_state(self) -> Dict:
+        """Loads the index from disk, starting fresh if it is missing or unreadable."""
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    state = json.load(f)
+                if state.get("folder") == self.folder_path:
+                    return state
+            except (OSError, json.JSONDecodeError):
+                print("Warning: corrupted image index. Rebuilding.")
+        return self._empty_state()
+
+    def save_state(self):
+        """Persists the index atomically."""
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path), prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _remove(self, name: str):
+        size, mtime_ns, title, page = self.state["entries"].pop(name)
+        if title is None:
+            return
+        group = self.state["groups"].get(title, [])
+        try:
+            group.remove([page, name])
+        except ValueError:
+            pass
+        if not group:
+            self.state["groups"].pop(title, None)
+
+    def _add(self, name: str, size: int, mtime_ns: int):
+        title, page = parse_image_name(name)
+        self.state["entries"][name] = [size, mtime_ns, title, page]
+        if title is not None:
+            bisect.insort(self.state["groups"].setdefault(title, []), [page, name])
+
+    def refresh(self) -> int:
+        """
+        Brings the index up to date with the folder and returns the number of changed entries.
+        """
+        entries = self.state["entries"]
+        seen = set()
+        changed = 0
+        try:
+            it = os.scandir(self.folder_path)
+        except FileNotFoundError:
+            if entries:
+                self.state = self._empty_state()
+                self.save_state()
+            return 0
+        with it:
+            for entry in it:
+                # Skip hidden files
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                known = entries.get(entry.name)
+                if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                    continue
+                if known is not None:
+                    self._remove(entry.name)
+                self._add(entry.name, stat.st_size, stat.st_mtime_ns)
+                changed += 1
+
+        for name in [n for n in entries if n not in seen]:
+            self._remove(name)
+            changed += 1
+
+        if changed or not os.path.exists(self.index_path):
+            self.save_state()
+        return changed
+
+    def groups(self, folder: Union[str, Path] = None) -> Dict[str, List[str]]:
+        """
+        Returns {title: [image paths sorted by page number]} from the index. Paths are
+        joined onto `folder` as given (default: the absolute folder path).
+        """
+        folder = Path(folder) if folder is not None else Path(self.folder_path)
+        return {
+            title: [str(folder / name) for _, name in pages]
+            for title, pages in self.state["groups"].items()
+        }
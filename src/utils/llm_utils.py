@@ -1,8 +1,18 @@
 import json
 import re
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
 from google.genai import types
 from pydantic import BaseModel
-from typing import Optional, Type, Dict, Any
+from typing import Optional, Type, Dict, Any, Callable
+
+from src.utils import rate_limiter
+from src.utils import streaming
+from src.utils import async_runner
+from src.utils import hedging
+from src.utils import usage
 
 def sanitize_json_string(raw_str: str) -> str:
     """
@@ -25,69 +35,410 @@ def sanitize_json_string(raw_str: str) -> str:
     
     return raw_str.strip()
 
+# LaTeX commands whose first letter is also a JSON escape (\b, \f, \n, \t, \r): "\nabla" in model
+# output means the command, not a newline followed by "abla". Short commands that read just as
+# well as an escape plus text ("\ne", "\nu", "\ni", "\to", "\tan") are left out on purpose.
+LATEX_ESCAPE_COMMANDS = {
+    "beta", "bar", "bf", "begin", "big", "bigg", "Big", "Bigg", "bigl", "bigr", "binom", "bmod", "boldsymbol", "bot",
+    "bullet", "bigcup", "bigcap", "bigoplus", "bigotimes", "boxed", "breve", "because", "backslash",
+    "frac", "forall", "flat", "frown", "fbox", "footnote", "footnotesize", "frak",
+    "nabla", "neq", "newline", "newpage", "noindent", "nonumber", "not", "notin", "nolimits", "neg", "nearrow",
+    "theta", "tau", "text", "textbf", "textit", "textrm", "texttt", "textsf", "textsc", "times", "top", "tilde", "tfrac",
+    "tanh", "triangle", "therefore", "tiny", "tag", "textstyle",
+    "right", "rho", "rangle", "rightarrow", "Rightarrow", "rm", "rceil", "rfloor", "rbrace", "ref", "renewcommand", "rVert", "rvert",
+}
+_DECODED_ESCAPES = {"\b": "b", "\f": "f", "\n": "n", "\t": "t", "\r": "r"}
+
+_stats_lock = threading.Lock()
+PARSE_STATS = {"responses": 0, "clean": 0, "repaired": 0, "retried": 0, "failed": 0}
+
+def record_parse_outcome(outcome: str):
+    with _stats_lock:
+        PARSE_STATS[outcome] += 1
+
+def parse_stats() -> Dict[str, Any]:
+    """Counts of model responses that parsed as-is, after local repair, or needed a model retry, plus rates."""
+    with _stats_lock:
+        stats = dict(PARSE_STATS)
+    total = stats["responses"] or 1
+    stats["repair_rate"] = round(stats["repaired"] / total, 4)
+    stats["retry_rate"] = round(stats["retried"] / total, 4)
+    return stats
+
+def _is_latex_backslash(text: str, i: int) -> bool:
+    """True if the backslash at `text[i]` (inside a JSON string) is a LaTeX command rather than a JSON escape."""
+    nxt = text[i + 1]
+    if nxt not in '"\\/bfnrtu':
+        return True
+    if nxt == "u":
+        return not re.match(r"[0-9a-fA-F]{4}", text[i + 2:i + 6])
+    run = re.match(r"[A-Za-z]+", text[i + 1:]).group(0) if nxt.isalpha() else ""
+    return run in LATEX_ESCAPE_COMMANDS
+
+def _misread_latex(value: Any) -> bool:
+    """True if a parsed JSON value holds a LaTeX command decoded as an escape ("\\frac" read as form feed + "rac")."""
+    if isinstance(value, str):
+        return any(_DECODED_ESCAPES[m.group(1)] + m.group(2) in LATEX_ESCAPE_COMMANDS
+                   for m in re.finditer(r"([\b\f\n\t\r])([A-Za-z]+)", value))
+    if isinstance(value, dict):
+        return any(_misread_latex(v) for v in value.values())
+    if isinstance(value, list):
+        return any(_misread_latex(v) for v in value)
+    return False
+
+def _drop_trailing_comma(out: list):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j]
+
+def repair_json_string(raw_str: str) -> str:
+    """
+    Deterministic fixes for the ways model JSON usually breaks, applied in one string-aware pass:
+    - LaTeX backslashes that are invalid (or misleading) JSON escapes are doubled (`\frac` -> `\\frac`)
+    - raw newlines/tabs inside strings are escaped
+    - trailing commas before `}` / `]` are dropped
+    - truncated output is closed: an open string is terminated and open braces/brackets balanced
+    Returns the repaired text; it may still fail validation (e.g. missing required fields).
+    """
+    raw_str = re.sub(r'^```(?:json)?\s*', '', raw_str, flags=re.MULTILINE)
+    raw_str = re.sub(r'%\s*---\s*Page\s*\d+\s*---\s*', '', raw_str, flags=re.IGNORECASE)
+    start_idx = raw_str.find('{')
+    if start_idx == -1:
+        return raw_str.strip()
+    text = raw_str[start_idx:]
+
+    out = []
+    stack = []
+    in_string = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if ch == "\\":
+                if i + 1 >= len(text) or _is_latex_backslash(text, i):
+                    out.append("\\\\")
+                    i += 1
+                    continue
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == '"':
+                in_string = False
+            elif ch == "\n":
+                ch = "\\n"
+            elif ch == "\t":
+                ch = "\\t"
+            out.append(ch)
+        else:
+            if ch == '"':
+                in_string = True
+            elif ch in "{[":
+                stack.append(ch)
+            elif ch in "}]":
+                _drop_trailing_comma(out)
+                if stack:
+                    stack.pop()
+                out.append(ch)
+                if not stack:
+                    # The root object is complete; anything after it is chatter
+                    break
+                i += 1
+                continue
+            out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    repaired = "".join(out).rstrip()
+    if stack:
+        # Truncated mid-object: drop a dangling separator and close what is still open
+        repaired = repaired.rstrip(",").rstrip()
+        if repaired.endswith(":"):
+            repaired += " null"
+        for opener in reversed(stack):
+            repaired = repaired.rstrip().rstrip(",") + ("}" if opener == "{" else "]")
+    return repaired
+
+def loads_with_repair(raw_text: str) -> Any:
+    """
+    `json.loads` of the sanitized model output, falling back to `repair_json_string` when it
+    does not parse, or parses with a LaTeX command read as an escape (`\\frac`, `\\beta` and
+    `\\textbf` with a single backslash are legal JSON). Raises if neither parses.
+    """
+    try:
+        data = json.loads(sanitize_json_string(raw_text))
+    except json.JSONDecodeError:
+        return json.loads(repair_json_string(raw_text))
+    if _misread_latex(data):
+        try:
+            return json.loads(repair_json_string(raw_text))
+        except json.JSONDecodeError:
+            pass
+    return data
+
+def validate_with_repair(response_schema: Type[BaseModel], raw_text: str) -> BaseModel:
+    """
+    Validates model output against `response_schema`, repairing it locally (see
+    `loads_with_repair`) only when the sanitized text does not parse as-is. Raises if the
+    repaired text fails too, which is the only case where the model has to be asked again.
+    """
+    record_parse_outcome("responses")
+    try:
+        data = json.loads(sanitize_json_string(raw_text))
+    except json.JSONDecodeError:
+        data = None
+    if data is not None and not _misread_latex(data):
+        parsed = response_schema.model_validate(data)
+        record_parse_outcome("clean")
+        return parsed
+    try:
+        parsed = response_schema.model_validate_json(repair_json_string(raw_text))
+    except Exception:
+        if data is None:
+            raise
+        parsed = response_schema.model_validate(data)
+        record_parse_outcome("clean")
+        return parsed
+    record_parse_outcome("repaired")
+    return parsed
+
+def _retry_contents(contents: list, base_prompt: str, raw_text: Optional[str], error: Exception) -> list:
+    """Builds the self-correction request: the original non-text parts plus the prompt and the error report."""
+    error_feedback = f"""
+Context: You are tasked with converting the provided image into strict JSON according to the schema. However, a previous attempt to process this exact image resulted in a critical application failure.
+
+Historical Error Report:
+
+Previous Failed Output:
+{raw_text if raw_text is not None else 'No output generated'}
+
+System Error Caused:
+Error: {str(error)}
+
+Task:
+1. Analyze the 'Historical Error Report' to understand exactly why the system crashed last time.
+2. Re-evaluate the attached image.
+3. Generate a new, fully corrected output that strictly adheres to the requested JSON Schema and avoids previous formatting mistakes.
+
+Strict Constraints: You must output ONLY valid, raw JSON. Do not include apologies, explanations of your fix, or markdown formatting.
+"""
+    current_contents = [c for c in contents if not isinstance(c, str)]
+    current_contents.append(base_prompt + "\n\n" + error_feedback)
+    return current_contents
+
+def json_config(response_schema: Type[BaseModel], cached_content: Optional[str] = None) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        cached_content=cached_content,
+        response_mime_type="application/json",
+        response_schema=response_schema
+    )
+
+_usage_sink: contextvars.ContextVar = contextvars.ContextVar("usage_sink", default=None)
+
+@contextmanager
+def collect_usage():
+    """Collects the `usage_metadata` of every generate call made in this context (thread or task) into a list."""
+    sink = []
+    token = _usage_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _usage_sink.reset(token)
+
+_hedge: contextvars.ContextVar = contextvars.ContextVar("hedge_requests", default=False)
+
+@contextmanager
+def hedge_requests(enabled: bool = True):
+    """Hedges every async generate call made in this context (task) with `hedging.get_hedger()`."""
+    token = _hedge.set(enabled)
+    try:
+        yield
+    finally:
+        _hedge.reset(token)
+
+def _record_call(model_name: str, response, started: float, attempts: int, attempt: int, error: Exception = None):
+    """Reports one generate call to the usage tracker and to any `collect_usage` sink."""
+    usage.get_tracker().record(
+        model_name,
+        getattr(response, "usage_metadata", None),
+        seconds=time.monotonic() - started,
+        api_retries=max(0, attempts - 1),
+        attempt=attempt,
+        error=rate_limiter.classify_error(error) if error else None
+    )
+    sink = _usage_sink.get()
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if sink is not None and usage_metadata is not None:
+        sink.append(usage_metadata)
+
+def generate_content(client, model_name: str, contents: list, config, stream: bool = False, on_partial: Optional[Callable] = None, attempt: int = 0):
+    """
+    One generate call through the shared rate limiter. With `stream`, the response is
+    streamed under first-token/stall/total deadlines (see `streaming.stream_generate`).
+    Tokens, limiter retries and latency are recorded in `usage`; `attempt` is the
+    self-correction attempt this call belongs to (0 for the first ask).
+    """
+    if stream:
+        return async_runner.run_coroutine(agenerate_content(client, model_name, contents, config, stream=True, on_partial=on_partial, attempt=attempt))
+
+    attempts = 0
+    def _generate(**kwargs):
+        nonlocal attempts
+        attempts += 1
+        return client.models.generate_content(**kwargs)
+
+    started = time.monotonic()
+    try:
+        response = rate_limiter.get_limiter().call(
+            _generate,
+            model=model_name,
+            contents=contents,
+            config=config,
+            estimated_tokens=rate_limiter.ESTIMATED_REQUEST_TOKENS
+        )
+    except Exception as e:
+        _record_call(model_name, None, started, attempts, attempt, error=e)
+        raise
+    _record_call(model_name, response, started, attempts, attempt)
+    return response
+
+async def agenerate_content(client, model_name: str, contents: list, config, stream: bool = False, on_partial: Optional[Callable] = None, attempt: int = 0):
+    """
+    Async variant of `generate_content` on `client.aio`. Inside `hedge_requests`, a slow
+    call is raced against a duplicate; only the winning copy is recorded.
+    """
+    copies = []
+    async def _call():
+        attempts = [0]
+        copies.append(attempts)
+        async def _generate(*args, **kwargs):
+            attempts[0] += 1
+            if stream:
+                return await streaming.stream_generate(*args, **kwargs)
+            return await client.aio.models.generate_content(*args, **kwargs)
+
+        if stream:
+            # A stream that misses its deadline raises StreamTimeoutError, which the limiter retries as transient
+            response = await rate_limiter.get_limiter().acall(
+                _generate, client, model_name, contents, config,
+                on_partial=on_partial,
+                estimated_tokens=rate_limiter.ESTIMATED_REQUEST_TOKENS
+            )
+        else:
+            response = await rate_limiter.get_limiter().acall(
+                _generate,
+                model=model_name,
+                contents=contents,
+                config=config,
+                estimated_tokens=rate_limiter.ESTIMATED_REQUEST_TOKENS
+            )
+        return response, attempts[0]
+
+    started = time.monotonic()
+    try:
+        response, attempts = await (hedging.get_hedger().run(_call) if _hedge.get() else _call())
+    except Exception as e:
+        _record_call(model_name, None, started, max((copy[0] for copy in copies), default=0), attempt, error=e)
+        raise
+    _record_call(model_name, response, started, attempts, attempt)
+    return response
+
 def generate_pydantic_with_retry(
         client, 
         model_name: str, 
         contents: list, 
         base_prompt: str, 
         response_schema: Type[BaseModel],
-        max_retries: int = 3
+        max_retries: int = 3,
+        stream: bool = False,
+        on_partial: Optional[Callable] = None
     ) -> Dict[str, Any]:
     """
     Wraps the Gemini generation call, enforcing a Pydantic response schema.
     Attempts to parse the JSON output into the defined Pydantic model. 
     If a JSONDecodeError occurs, it passes the error and the failed output 
     back to the model for self-correction up to `max_retries` times.
+    The API call itself goes through the shared `rate_limiter`, which handles quota
+    and server errors; only validation failures are fed back to the model.
+    `stream` / `on_partial` switch to streamed generation (see `generate_content`).
     """
-    import logging
-    
     current_contents = contents.copy()
     
     for attempt in range(max_retries):
+        raw_text = None
         try:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=current_contents,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=response_schema
-                )
+            # Quota and transient errors are retried with backoff inside the shared limiter
+            response = generate_content(
+                client, model_name, current_contents, json_config(response_schema),
+                stream=stream, on_partial=on_partial, attempt=attempt
             )
             
             raw_text = response.text
-            sanitized_text = sanitize_json_string(raw_text)
             
-            # Attempt to parse into the required model automatically validates it
-            parsed_data = response_schema.model_validate_json(sanitized_text)
+            # Parsing into the required model validates it; broken JSON is repaired locally first
+            parsed_data = validate_with_repair(response_schema, raw_text)
             return parsed_data.model_dump()
             
         except Exception as e:
             print(f"[Warning] Parsing/Validation Error on attempt {attempt + 1}/{max_retries}: {e}")
+            if rate_limiter.classify_error(e) != "validation":
+                # The limiter already backed off and retried; asking again would only hammer the API
+                print(f"[Error] Giving up after API error: {e}")
+                return {}
             if attempt < max_retries - 1:
+                record_parse_outcome("retried")
                 # Construct the feedback loop prompt
-                error_feedback = f"""
-Context: You are tasked with converting the provided image into strict JSON according to the schema. However, a previous attempt to process this exact image resulted in a critical application failure.
-
-Historical Error Report:
+                current_contents = _retry_contents(contents, base_prompt, raw_text, e)
+            else:
+                print(f"[Error] Max retries ({max_retries}) reached. Returning error payload.")
+                record_parse_outcome("failed")
+                # Fallback to a synthetic empty dict structure if nothing works
+                return {}
+            
+    return {}
 
-Previous Failed Output:
-{locals().get('raw_text', 'No output generated')}
+async def agenerate_pydantic_with_retry(
+        client,
+        model_name: str,
+        contents: list,
+        base_prompt: str,
+        response_schema: Type[BaseModel],
+        max_retries: int = 3,
+        stream: bool = False,
+        on_partial: Optional[Callable] = None
+    ) -> Dict[str, Any]:
+    """
+    Async twin of `generate_pydantic_with_retry` on `client.aio`, with the same
+    validation and self-correction loop. Used by the concurrent transcription engine.
+    """
+    current_contents = contents.copy()
 
-System Error Caused:
-Error: {str(e)}
+    for attempt in range(max_retries):
+        raw_text = None
+        try:
+            response = await agenerate_content(
+                client, model_name, current_contents, json_config(response_schema),
+                stream=stream, on_partial=on_partial, attempt=attempt
+            )
 
-Task:
-1. Analyze the 'Historical Error Report' to understand exactly why the system crashed last time.
-2. Re-evaluate the attached image.
-3. Generate a new, fully corrected output that strictly adheres to the requested JSON Schema and avoids previous formatting mistakes.
+            raw_text = response.text
+            parsed_data = validate_with_repair(response_schema, raw_text)
+            return parsed_data.model_dump()
 
-Strict Constraints: You must output ONLY valid, raw JSON. Do not include apologies, explanations of your fix, or markdown formatting.
-"""
-                current_contents = [c for c in contents if not isinstance(c, str)]
-                current_contents.append(base_prompt + "\n\n" + error_feedback)
+        except Exception as e:
+            print(f"[Warning] Parsing/Validation Error on attempt {attempt + 1}/{max_retries}: {e}")
+            if rate_limiter.classify_error(e) != "validation":
+                # The limiter already backed off and retried; asking again would only hammer the API
+                print(f"[Error] Giving up after API error: {e}")
+                return {}
+            if attempt < max_retries - 1:
+                record_parse_outcome("retried")
+                current_contents = _retry_contents(contents, base_prompt, raw_text, e)
             else:
                 print(f"[Error] Max retries ({max_retries}) reached. Returning error payload.")
-                # Fallback to a synthetic empty dict structure if nothing works
+                record_parse_outcome("failed")
                 return {}
-            
+
     return {}
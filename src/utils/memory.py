@@ -1,81 +1,217 @@
 import json
 import os
+import time
+import atexit
+import sqlite3
 import hashlib
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Optional
+
+# Pages buffered before `mark_processed` commits them in one transaction, and the longest a
+# page may sit in the buffer. A crash loses at most this much progress (the result cache
+# still holds those transcriptions, so redoing them costs no API calls).
+MEMORY_BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", "32"))
+MEMORY_BATCH_SECONDS = float(os.getenv("MEMORY_BATCH_SECONDS", "2"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    file_id TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT,
+    content TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
 
 class Memory:
-    def __init__(self, log_path: str = None):
+    """
+    State of processed pages for incremental builds, kept in a SQLite database (WAL mode)
+    next to the old JSON log: `processed_log.json` -> `processed_log.sqlite3`.
+    `mark_processed` buffers writes and commits them in batches, and any number of CLI runs
+    or MCP workers can share one database (writers wait for each other instead of
+    overwriting each other's state). Entries of an existing JSON log are imported once.
+    """
+    def __init__(self, log_path: str = None, batch_size: int = MEMORY_BATCH_SIZE, batch_seconds: float = MEMORY_BATCH_SECONDS):
         if not log_path:
             cache_dir = os.path.expanduser("~/.cache/docs-to-code")
             os.makedirs(cache_dir, exist_ok=True)
             self.log_path = os.path.join(cache_dir, "mcp_memory.json")
         else:
             self.log_path = log_path
-        self.state = self._load_state()
+        self.db_path = os.path.splitext(self.log_path)[0] + ".sqlite3"
+        self.batch_size = max(1, batch_size)
+        self.batch_seconds = batch_seconds
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._pending_since: Optional[float] = None
+        self._lock = threading.RLock()
+
+        # The CLI saves pages from the transcription engine's thread, so the connection is shared under the lock
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate_json_log()
+        atexit.register(self.close)
 
-    def _load_state(self) -> Dict[str, Any]:
-        """Loads the processed log from disk."""
-        if os.path.exists(self.log_path):
+    def _migrate_json_log(self):
+        """Imports the entries of the JSON log this database replaces, once."""
+        if not os.path.exists(self.log_path):
+            return
+        marker = f"migrated:{os.path.abspath(self.log_path)}"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
             try:
-                with open(self.log_path, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("Warning: corrupted log file. Starting fresh.")
-                return {}
-        return {}
+                if self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                    self._conn.execute("COMMIT")
+                    return
+                try:
+                    with open(self.log_path, 'r') as f:
+                        state = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    print("Warning: corrupted log file. Starting fresh.")
+                    state = {}
+                now = time.time()
+                # Entries already in the database (e.g. written by a newer run) take precedence
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO entries (file_id, file_path, mtime, sha256, content, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (file_id, entry.get('file_path', file_id), entry.get('mtime', 0), entry.get('sha256'), json.dumps(entry.get('content', "")), now)
+                        for file_id, entry in state.items() if isinstance(entry, dict)
+                    ]
+                )
+                self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(now)))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if state:
+            print(f"Migrated {len(state)} entries from {self.log_path} to {self.db_path}.")
 
-    def save_state(self):
-        """Persists the current state to disk."""
-        with open(self.log_path, 'w') as f:
-            json.dump(self.state, f, indent=2)
+    def _get_entry(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if file_id in self._pending:
+                return self._pending[file_id]
+            row = self._conn.execute(
+                "SELECT file_path, mtime, sha256, content FROM entries WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        file_path, mtime, sha256, content = row
+        entry = {'file_path': file_path, 'mtime': mtime, 'content': json.loads(content)}
+        if sha256:
+            entry['sha256'] = sha256
+        return entry
+
+    def __len__(self) -> int:
+        with self._lock:
+            stored = {row[0] for row in self._conn.execute("SELECT file_id FROM entries")}
+            return len(stored | set(self._pending))
+
+    @staticmethod
+    def _is_error(content) -> bool:
+        if isinstance(content, str):
+            return "% Error processing image" in content
+        if isinstance(content, dict):
+            base = content.get("base_latex_md") if isinstance(content.get("base_latex_md"), dict) else content
+            return "% Error processing image" in (base.get("latex") or "") or "% Error processing image" in (base.get("markdown") or "")
+        return False
 
     def is_processed(self, image_path: str) -> bool:
         """
         Checks if an image has already been processed.
         Uses a hash of the file path (or content hash for robustness) as key.
-        For simplicity and speed, we check if the filename exists in the registry 
+        For simplicity and speed, we check if the filename exists in the registry
         AND if the mtime matches (to detect updates).
         """
-        file_id = self._get_file_id(image_path)
-        if file_id in self.state:
-            # Check for "Poisoned State": existing error message
-            content = self.state[file_id].get('content', "")
-            
-            # Handle both string (old cache) and dict (new cache) formats
-            error_found = False
-            if isinstance(content, str):
-                if "% Error processing image" in content:
-                    error_found = True
-            elif isinstance(content, dict):
-                # Check if "latex" or "markdown" values contain the error
-                if "% Error processing image" in content.get("latex", "") or "% Error processing image" in content.get("markdown", ""):
-                    error_found = True
-                    
-            if error_found:
-                print(f"Retrying failed image: {os.path.basename(image_path)}")
-                return False
-
-            # Check if file has been modified since last process
-            last_mtime = self.state[file_id].get('mtime', 0)
-            current_mtime = os.path.getmtime(image_path)
-            if current_mtime <= last_mtime:
-                return True
-        return False
+        entry = self._get_entry(self._get_file_id(image_path))
+        if entry is None:
+            return False
+
+        # Check for "Poisoned State": existing error message
+        if self._is_error(entry.get('content', "")):
+            print(f"Retrying failed image: {os.path.basename(image_path)}")
+            return False
+
+        # Entries that recorded a content hash are only valid for the same bytes,
+        # so a different page with the same name is never a false hit
+        if 'sha256' in entry:
+            return entry['sha256'] == self._content_hash(image_path)
+
+        # Check if file has been modified since last process
+        last_mtime = entry.get('mtime', 0)
+        current_mtime = os.path.getmtime(image_path)
+        return current_mtime <= last_mtime
 
     def get_cached_content(self, image_path: str) -> str:
         """Retrieves cached content for a processed image."""
-        file_id = self._get_file_id(image_path)
-        return self.state.get(file_id, {}).get('content', "")
+        entry = self._get_entry(self._get_file_id(image_path))
+        return entry.get('content', "") if entry else ""
 
     def mark_processed(self, image_path: str, content: str):
-        """Updates the registry with the processed image data."""
-        file_id = self._get_file_id(image_path)
-        self.state[file_id] = {
+        """Updates the registry with the processed image data (committed in batches, see `flush`)."""
+        entry = {
             'file_path': image_path,
             'mtime': os.path.getmtime(image_path),
+            'sha256': self._content_hash(image_path),
             'content': content
         }
-        self.save_state()
+        with self._lock:
+            self._pending[self._get_file_id(image_path)] = entry
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            due = len(self._pending) >= self.batch_size or time.monotonic() - self._pending_since >= self.batch_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Commits buffered entries in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            now = time.time()
+            rows = [
+                (file_id, entry['file_path'], entry['mtime'], entry.get('sha256'), json.dumps(entry['content']), now)
+                for file_id, entry in self._pending.items()
+            ]
+            # IMMEDIATE takes the write lock up front; other writers wait up to the connection timeout
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (file_id, file_path, mtime, sha256, content, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._pending.clear()
+            self._pending_since = None
+
+    def save_state(self):
+        """Persists the current state to disk."""
+        self.flush()
+
+    def close(self):
+        """Flushes pending entries and closes the database."""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self.flush()
+            finally:
+                self._conn.close()
+                self._conn = None
+        atexit.unregister(self.close)
+
+    @staticmethod
+    def _content_hash(file_path: str) -> str:
+        with open(file_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
 
     def _get_file_id(self, file_path: str) -> str:
         """Generates a unique ID for the file based on its name/path."""
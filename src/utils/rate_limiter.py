@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+from pydantic import ValidationError
+
+# Account quota for the configured model; the limiter starts here and adapts downwards on 429s.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+# Tokens charged up front per generate call (one page image plus the prompt); corrected with usage_metadata.
+ESTIMATED_REQUEST_TOKENS = int(os.getenv("GEMINI_ESTIMATED_REQUEST_TOKENS", "4000"))
+# Attempts per API call for quota and transient errors before giving up.
+RATE_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "5"))
+# Consecutive quota/transient failures that open the circuit, and how long it stays open.
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+# Adaptive rate: multiplicative decrease on 429, additive increase on success.
+MIN_RATE_FACTOR = 0.1
+RATE_DECREASE = 0.5
+RATE_INCREASE = 0.05
+
+# (base seconds, cap seconds) of the exponential backoff per error class.
+BACKOFF = {
+    "quota": (5.0, 60.0),
+    "transient": (1.0, 30.0),
+}
+
+QUOTA_MARKERS = ("RESOURCE_EXHAUSTED", "429", "rate limit", "quota")
+TRANSIENT_MARKERS = ("UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "timed out", "timeout", "Connection", "503", "502", "504", "500")
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+def classify_error(error: Exception) -> str:
+    """
+    Sorts an exception into the class that decides how it is retried:
+    - "quota": 429 / RESOURCE_EXHAUSTED -> slow down and back off for long
+    - "transient": 5xx, timeouts, dropped connections -> short backoff
+    - "validation": the response arrived but is not a valid DocumentPayload -> re-ask at once
+    - "fatal": anything else (bad request, auth, open circuit) -> do not retry
+    """
+    if isinstance(error, CircuitOpenError):
+        return "fatal"
+    if isinstance(error, (ValidationError, json.JSONDecodeError)):
+        return "validation"
+
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return "quota"
+    if isinstance(code, int) and code >= 500:
+        return "transient"
+    if isinstance(code, int) and 400 <= code < 500:
+        return "fatal"
+
+    message = f"{type(error).__name__}: {error}"
+    if any(marker in message for marker in QUOTA_MARKERS):
+        return "quota"
+    if isinstance(error, (TimeoutError, ConnectionError)) or any(marker in message for marker in TRANSIENT_MARKERS):
+        return "transient"
+    if isinstance(error, ValueError):
+        return "validation"
+    return "fatal"
+
+def backoff_delay(error_class: str, attempt: int) -> float:
+    """Exponential backoff with full jitter for retryable classes; 0 otherwise."""
+    if error_class not in BACKOFF:
+        return 0.0
+    base, cap = BACKOFF[error_class]
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class TokenBucket:
+    """Continuously refilling bucket; `reserve` debits now and says how long to wait for the debt."""
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, rate_factor: float) -> float:
+        now = time.monotonic()
+        rate = self.per_minute * rate_factor / 60.0
+        self.level = min(self.per_minute, self.level + (now - self.updated) * rate)
+        self.updated = now
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / rate
+
+    def refund(self, amount: float):
+        self.level = min(self.per_minute, self.level + amount)
+
+class RateLimiter:
+    """
+    Process-wide limiter shared by every Gemini call: request and token buckets whose
+    rate adapts to 429s, per-error-class backoff, and a circuit breaker for outages.
+    Works from threads (`call`) and from the asyncio engine (`acall`) alike.
+    """
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM,
+                 max_attempts: int = RATE_MAX_ATTEMPTS,
+                 breaker_threshold: int = BREAKER_THRESHOLD, breaker_cooldown: float = BREAKER_COOLDOWN):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_attempts = max(1, max_attempts)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.rate_factor = 1.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "quota": 0, "transient": 0, "circuit_opened": 0}
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """Takes a slot and returns the seconds to wait before using it (raises while the circuit is open)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.open_until:
+                raise CircuitOpenError(f"Gemini circuit breaker open for another {self.open_until - now:.0f}s after repeated failures.")
+            self.stats["calls"] += 1
+            return max(self.requests.reserve(1, self.rate_factor), self.tokens.reserve(tokens, self.rate_factor))
+
+    def _record_success(self, estimated_tokens: int, response: Any):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.rate_factor = min(1.0, self.rate_factor + RATE_INCREASE)
+            usage = getattr(response, "usage_metadata", None)
+            actual = getattr(usage, "total_token_count", None) if usage else None
+            if actual is not None:
+                # Settle the up-front estimate against what the call really cost
+                self.tokens.refund(estimated_tokens - actual)
+
+    def _record_failure(self, error_class: str):
+        with self._lock:
+            if error_class == "quota":
+                self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor * RATE_DECREASE)
+            if error_class in ("quota", "transient"):
+                self.stats[error_class] += 1
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.breaker_threshold:
+                    self.open_until = time.monotonic() + self.breaker_cooldown
+                    self.consecutive_failures = 0
+                    self.stats["circuit_opened"] += 1
+                    print(f"[RateLimiter] Circuit opened for {self.breaker_cooldown:.0f}s after repeated API failures.")
+
+    def _should_retry(self, error: Exception, attempt: int) -> float:
+        """Records the failure and returns the backoff before the next attempt, or -1 to give up."""
+        error_class = classify_error(error)
+        self._record_failure(error_class)
+        if error_class not in BACKOFF or attempt >= self.max_attempts - 1 or time.monotonic() < self.open_until:
+            return -1
+        self.stats["retries"] += 1
+        delay = backoff_delay(error_class, attempt)
+        print(f"[RateLimiter] {error_class} error ({error}); retrying in {delay:.1f}s (attempt {attempt + 2}/{self.max_attempts}).")
+        return delay
+
+    def call(self, fn: Callable[..., Any], *args, estimated_tokens: int = 0, **kwargs) -> Any:
+        """Runs `fn(*args, **kwargs)` under the limiter, retrying quota and transient errors."""
+        for attempt in range(self.max_attempts):
+            time.sleep(self._reserve(estimated_tokens))
+            try:
+                response = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._should_retry(e, attempt)
+                if delay < 0:
+                    raise
+                time.sleep(delay)
+                continue
+            self._record_success(estimated_tokens, response)
+            return response
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, estimated_tokens: int = 0, **kwargs) -> Any:
+        """Async variant of `call` for coroutine functions (e.g. `client.aio.models.generate_content`)."""
+        for attempt in range(self.max_attempts):
+            await asyncio.sleep(self._reserve(estimated_tokens))
+            try:
+                response = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._should_retry(e, attempt)
+                if delay < 0:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._record_success(estimated_tokens, response)
+            return response
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+def get_limiter() -> RateLimiter:
+    """Returns the process-wide limiter every Gemini call goes through."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Optional, Union
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1").lower() in ("1", "true", "yes")
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.expanduser("~/.cache/docs-to-code/results"))
+
+def prompt_version(prompt: str) -> str:
+    """Short hash of a prompt, so editing a prompt invalidates the results it produced."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of transcription results.
+    Entries are keyed by the SHA-256 of the bytes the model saw (the page payload, or the
+    text of a text-layer page) plus the output mode, the model that produced the result and
+    the prompt version. Paths and mtimes play no part, so a moved, renamed or re-rendered
+    page still hits, and every entry point (CLI, MCP tools, batch jobs) shares the entries.
+    Each entry is a `<key>.json` file holding the DocumentPayload dict.
+    """
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or RESULT_CACHE_DIR
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(source: Union[bytes, str]) -> str:
+        """SHA-256 of page bytes, or of the file at `source` when it is a path."""
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        return hashlib.sha256(source).hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, mode: str, model_name: str, prompt: str) -> str:
+        key = json.dumps([content_hash, mode, model_name, prompt_version(prompt)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached result for `key`, or None on a miss."""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def lookup(self, content_hash: str, mode: str, models: Iterable[str], prompt: str) -> Optional[Dict[str, Any]]:
+        """Returns the first cached result produced by any of `models` (tried in order)."""
+        for model_name in models:
+            result = self.get(self.make_key(content_hash, mode, model_name, prompt))
+            if result is not None:
+                with self._lock:
+                    self.stats["hits"] += 1
+                return result
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Stores a result atomically; concurrent writers of the same key simply race to identical content."""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Warning: could not write result cache entry: {e}")
+            return
+        with self._lock:
+            self.stats["stored"] += 1
+
+    def store(self, content_hash: str, mode: str, model_name: str, prompt: str, result: Dict[str, Any]):
+        self.put(self.make_key(content_hash, mode, model_name, prompt), result)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[ResultCache]:
+    """Returns the process-wide result cache, or None when RESULT_CACHE is disabled."""
+    global _cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+    return _cache
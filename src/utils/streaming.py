@@ -0,0 +1,154 @@
+import os
+import re
+import asyncio
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Tuple
+
+# Use generate_content_stream for page transcriptions.
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1").lower() in ("1", "true", "yes")
+# Seconds allowed from the request until the first chunk (stream creation included). Thinking
+# models can take 30-60s on dense pages before emitting anything, so this leaves headroom.
+STREAM_FIRST_TOKEN_TIMEOUT = float(os.getenv("STREAM_FIRST_TOKEN_TIMEOUT", "120"))
+# Seconds allowed between two chunks once the response is flowing.
+STREAM_STALL_TIMEOUT = float(os.getenv("STREAM_STALL_TIMEOUT", "30"))
+# Seconds allowed for the whole response.
+STREAM_TOTAL_TIMEOUT = float(os.getenv("STREAM_TOTAL_TIMEOUT", "300"))
+
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+class StreamTimeoutError(TimeoutError):
+    """A streamed response missed its first-token, stall or total deadline (retried as a transient error)."""
+
+def _decode_partial_string(text: str, start: int) -> Tuple[str, bool]:
+    """
+    Decodes the JSON string body starting at `text[start]` up to its closing quote or the end
+    of the text. Returns (value so far, complete). Escapes JSON does not know (LaTeX like `\\alpha`
+    written with a single backslash) are kept verbatim, and a dangling escape at the end is held back.
+    """
+    out = []
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if ch == '"':
+            return "".join(out), True
+        if ch == "\\":
+            if i + 1 >= len(text):
+                break
+            nxt = text[i + 1]
+            if nxt == "u":
+                digits = text[i + 2:i + 6]
+                if len(digits) < 4:
+                    break
+                if re.fullmatch(r"[0-9a-fA-F]{4}", digits):
+                    out.append(chr(int(digits, 16)))
+                    i += 6
+                    continue
+            if nxt in _SIMPLE_ESCAPES:
+                out.append(_SIMPLE_ESCAPES[nxt])
+            else:
+                out.append("\\" + nxt)
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out), False
+
+class IncrementalPayloadParser:
+    """
+    Accumulates streamed JSON text and exposes the `base_latex_md` strings while they are
+    still being generated, e.g. {"latex": "\\section{Intro} Let $f$ be"}.
+    Each field is located once; later chunks only extend its decoded value.
+    """
+    FIELDS = ("latex", "markdown")
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, str] = {}
+        self._starts: Dict[str, int] = {}
+        self._complete = set()
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        self.text += chunk
+        base = self.text.find('"base_latex_md"')
+        if base == -1:
+            return self.fields
+        for field in self.FIELDS:
+            if field in self._complete:
+                continue
+            if field not in self._starts:
+                match = re.compile(rf'"{field}"\s*:\s*"').search(self.text, base)
+                if not match:
+                    continue
+                self._starts[field] = match.end()
+            value, complete = _decode_partial_string(self.text, self._starts[field])
+            self.fields[field] = value
+            if complete:
+                self._complete.add(field)
+        return self.fields
+
+async def stream_generate(
+        client,
+        model: str,
+        contents: list,
+        config,
+        on_partial: Optional[Callable[[Dict[str, str]], None]] = None,
+        first_token_timeout: float = STREAM_FIRST_TOKEN_TIMEOUT,
+        total_timeout: float = STREAM_TOTAL_TIMEOUT,
+        stall_timeout: float = STREAM_STALL_TIMEOUT
+    ):
+    """
+    Runs `generate_content_stream` on `client.aio` and returns an object with `.text` and
+    `.usage_metadata` like a regular response. Raises `StreamTimeoutError` as soon as the
+    first chunk (one deadline covering stream creation and the first chunk), a following
+    chunk, or the whole response misses its deadline, so a hung request is cancelled early
+    instead of holding a worker for minutes.
+    `on_partial` receives the partially decoded `base_latex_md` fields after every chunk.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + total_timeout
+    first_token_deadline = min(deadline, started + first_token_timeout)
+    parser = IncrementalPayloadParser()
+    usage = None
+
+    try:
+        stream = await asyncio.wait_for(
+            client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+            first_token_deadline - started
+        )
+    except asyncio.TimeoutError:
+        raise StreamTimeoutError(f"No first token within {first_token_timeout:g}s")
+
+    iterator = stream.__aiter__()
+    received = False
+    try:
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                raise StreamTimeoutError(f"Response not finished within {total_timeout:g}s")
+            wait = min(deadline - now, stall_timeout) if received else first_token_deadline - now
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), max(0, wait))
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                if not received:
+                    raise StreamTimeoutError(f"No first token within {first_token_timeout:g}s")
+                if loop.time() >= deadline:
+                    raise StreamTimeoutError(f"Response not finished within {total_timeout:g}s")
+                raise StreamTimeoutError(f"Stream stalled for {stall_timeout:g}s")
+            received = True
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.text:
+                fields = parser.feed(chunk.text)
+                if on_partial and fields:
+                    on_partial(fields)
+    finally:
+        close = getattr(iterator, "aclose", None)
+        if close:
+            try:
+                await close()
+            except Exception:
+                pass
+
+    return SimpleNamespace(text=parser.text, usage_metadata=usage)
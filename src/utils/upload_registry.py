@@ -0,0 +1,131 @@
+import os
+import io
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import mimetypes
+from typing import Any, Dict, Optional, Union
+
+from src.utils import rate_limiter
+
+UPLOAD_REGISTRY_PATH = os.getenv("UPLOAD_REGISTRY_PATH", os.path.expanduser("~/.cache/docs-to-code/uploads.json"))
+# Gemini deletes uploaded files after 48h; entries this close to expiry are uploaded again.
+UPLOAD_TTL_SECONDS = 48 * 3600
+UPLOAD_REFRESH_MARGIN = float(os.getenv("UPLOAD_REFRESH_MARGIN", str(6 * 3600)))
+
+def _expiry_timestamp(uploaded_file) -> float:
+    """Expiry reported by the Files API, or upload time + 48h when the SDK leaves it out."""
+    expiration = getattr(uploaded_file, "expiration_time", None)
+    if expiration is not None and hasattr(expiration, "timestamp"):
+        return expiration.timestamp()
+    return time.time() + UPLOAD_TTL_SECONDS
+
+class UploadRegistry:
+    """
+    Persistent map from the SHA-256 of uploaded bytes to the Gemini file that holds them
+    ({"name", "uri", "mime_type", "expires_at"}), so re-processing a corpus reuses files
+    already on Gemini instead of uploading them again. Entries are scoped to the API key's
+    project and are refreshed (re-uploaded) once they come within `UPLOAD_REFRESH_MARGIN`
+    of Gemini's 48h expiry.
+    """
+    def __init__(self, registry_path: str = None):
+        self.registry_path = registry_path or UPLOAD_REGISTRY_PATH
+        self.state = self._load_state()
+        self.stats = {"hits": 0, "uploads": 0}
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.registry_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def save_state(self):
+        """Merges with the on-disk registry (other processes may have uploaded too) and writes atomically."""
+        now = time.time()
+        merged = self._load_state()
+        merged.update(self.state)
+        self.state = {key: entry for key, entry in merged.items() if entry.get("expires_at", 0) > now}
+        os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.registry_path), prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.registry_path)
+
+    @staticmethod
+    def make_key(api_key: str, data: bytes) -> str:
+        project = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        return f"{project}:{hashlib.sha256(data).hexdigest()}"
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the registered file for `key` unless it is missing or about to expire."""
+        with self._lock:
+            entry = self.state.get(key)
+            if entry and entry["expires_at"] - time.time() > UPLOAD_REFRESH_MARGIN:
+                self.stats["hits"] += 1
+                return entry
+        return None
+
+    def register(self, key: str, uploaded_file, mime_type: str) -> Dict[str, Any]:
+        entry = {
+            "name": uploaded_file.name,
+            "uri": uploaded_file.uri,
+            "mime_type": getattr(uploaded_file, "mime_type", None) or mime_type,
+            "expires_at": _expiry_timestamp(uploaded_file)
+        }
+        with self._lock:
+            self.stats["uploads"] += 1
+            self.state[key] = entry
+            try:
+                self.save_state()
+            except OSError as e:
+                print(f"Warning: could not write upload registry: {e}")
+        return entry
+
+    @staticmethod
+    def _read(source: Union[str, bytes], mime_type: Optional[str]):
+        if isinstance(source, bytes):
+            return source, mime_type or "application/octet-stream"
+        with open(source, "rb") as f:
+            data = f.read()
+        return data, mime_type or mimetypes.guess_type(source)[0] or "application/octet-stream"
+
+    def upload(self, client, api_key: str, source: Union[str, bytes], mime_type: str = None, display_name: str = None) -> Dict[str, Any]:
+        """Uploads a file path or raw bytes unless identical content is already on Gemini; returns the registry entry."""
+        data, mime_type = self._read(source, mime_type)
+        key = self.make_key(api_key, data)
+        entry = self.lookup(key)
+        if entry:
+            return entry
+        config = {"mime_type": mime_type}
+        if display_name:
+            config["display_name"] = display_name
+        uploaded = rate_limiter.get_limiter().call(client.files.upload, file=io.BytesIO(data), config=config)
+        return self.register(key, uploaded, mime_type)
+
+    async def aupload(self, client, api_key: str, source: Union[str, bytes], mime_type: str = None, display_name: str = None) -> Dict[str, Any]:
+        """Async variant of `upload` on `client.aio`."""
+        data, mime_type = self._read(source, mime_type)
+        key = self.make_key(api_key, data)
+        entry = self.lookup(key)
+        if entry:
+            return entry
+        config = {"mime_type": mime_type}
+        if display_name:
+            config["display_name"] = display_name
+        uploaded = await rate_limiter.get_limiter().acall(client.aio.files.upload, file=io.BytesIO(data), config=config)
+        return self.register(key, uploaded, mime_type)
+
+_registry: Optional[UploadRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> UploadRegistry:
+    """Returns the process-wide upload registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = UploadRegistry()
+    return _registry
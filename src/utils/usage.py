@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# USD per 1M tokens as (input, cached input, output); thinking tokens are billed as output.
+# Override or extend with GEMINI_PRICES='{"model": [input, cached, output], ...}'.
+MODEL_PRICES = {
+    "gemini-3.1-pro-preview": (2.00, 0.20, 12.00),
+    "gemini-3-flash-preview": (0.50, 0.05, 3.00),
+}
+MODEL_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.getenv("GEMINI_PRICES", "{}")).items()})
+# Batch API jobs are billed at this fraction of the interactive price.
+BATCH_PRICE_FACTOR = 0.5
+
+# Every call is appended here as one JSON line when set.
+USAGE_JSONL_PATH = os.getenv("USAGE_JSONL_PATH")
+# Prometheus text-format file (e.g. for node_exporter's textfile collector), rewritten by `flush`.
+USAGE_PROMETHEUS_PATH = os.getenv("USAGE_PROMETHEUS_PATH")
+# Jobs whose per-document and per-page totals are kept in memory (oldest are dropped first).
+USAGE_MAX_JOBS = int(os.getenv("USAGE_MAX_JOBS", "50"))
+
+FIELDS = ("calls", "errors", "retries", "prompt_tokens", "cached_tokens", "output_tokens", "thinking_tokens", "seconds", "cost_usd")
+
+_scope: contextvars.ContextVar = contextvars.ContextVar("usage_scope", default={})
+
+@contextmanager
+def scope(job: str = None, document: str = None, page: str = None, pages: List[str] = None):
+    """
+    Labels every Gemini call made inside the block (in this thread or task) with the job,
+    document and page(s) it belongs to. Nested scopes only override the labels they set.
+    """
+    labels = dict(_scope.get())
+    if job is not None:
+        labels["job"] = job
+    if document is not None:
+        labels["document"] = document
+    if page is not None or pages is not None:
+        labels["pages"] = [page] if page is not None else list(pages)
+    token = _scope.set(labels)
+    try:
+        yield labels
+    finally:
+        _scope.reset(token)
+
+def estimate_cost(model_name: str, prompt_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """Cost in USD at `MODEL_PRICES` (0 for unknown models)."""
+    price_in, price_cached, price_out = MODEL_PRICES.get(model_name, (0.0, 0.0, 0.0))
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * price_in + cached_tokens * price_cached + output_tokens * price_out) / 1e6
+
+def _empty() -> Dict[str, float]:
+    return {field: 0 for field in FIELDS}
+
+def _add(totals: Dict[str, float], call: Dict[str, Any], share: float = 1):
+    totals["calls"] += share
+    totals["errors"] += share if call["error"] else 0
+    totals["retries"] += share * call["retries"]
+    for field in ("prompt_tokens", "cached_tokens", "output_tokens", "thinking_tokens", "seconds", "cost_usd"):
+        totals[field] += share * call[field]
+
+def _rounded(totals: Dict[str, float]) -> Dict[str, float]:
+    return {field: round(value, 6 if field == "cost_usd" else 2) if isinstance(value, float) else value for field, value in totals.items()}
+
+class UsageTracker:
+    """
+    Records every Gemini call (model, prompt/cached/output/thinking tokens, retries, latency,
+    estimated cost) and aggregates it per model, per job, per document and per page.
+    Labels come from the surrounding `scope`. A call that served several pages (a packed
+    request) is split evenly between them in the per-page totals.
+    """
+    def __init__(self, jsonl_path: str = None, prometheus_path: str = None, max_jobs: int = USAGE_MAX_JOBS):
+        self.jsonl_path = jsonl_path or USAGE_JSONL_PATH
+        self.prometheus_path = prometheus_path or USAGE_PROMETHEUS_PATH
+        self.max_jobs = max_jobs
+        self.models: Dict[str, Dict[str, float]] = {}
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(
+            self,
+            model_name: str,
+            usage_metadata=None,
+            seconds: float = 0.0,
+            api_retries: int = 0,
+            attempt: int = 0,
+            error: Optional[str] = None,
+            batch: bool = False
+        ) -> Dict[str, Any]:
+        """
+        Records one call. `api_retries` are the limiter's quota/transient retries inside the
+        call; `attempt` > 0 marks a self-correction re-ask after an invalid response.
+        """
+        labels = _scope.get()
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", None) or 0
+        thinking_tokens = getattr(usage_metadata, "thoughts_token_count", None) or 0
+        cost = estimate_cost(model_name, prompt_tokens, cached_tokens, output_tokens + thinking_tokens)
+        call = {
+            "time": time.time(),
+            "model": model_name,
+            "job": labels.get("job"),
+            "document": labels.get("document"),
+            "pages": labels.get("pages", []),
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "output_tokens": output_tokens,
+            "thinking_tokens": thinking_tokens,
+            "seconds": round(seconds, 3),
+            "retries": api_retries + (1 if attempt else 0),
+            "attempt": attempt,
+            "error": error,
+            "batch": batch,
+            "cost_usd": cost * BATCH_PRICE_FACTOR if batch else cost,
+        }
+
+        with self._lock:
+            _add(self.models.setdefault(model_name, _empty()), call)
+            job_key = call["job"] or "unscoped"
+            job = self.jobs.get(job_key)
+            if job is None:
+                job = self.jobs[job_key] = {"totals": _empty(), "models": {}, "documents": {}}
+                while len(self.jobs) > self.max_jobs:
+                    self.jobs.popitem(last=False)
+            _add(job["totals"], call)
+            _add(job["models"].setdefault(model_name, _empty()), call)
+            document = job["documents"].setdefault(call["document"] or "unscoped", {"totals": _empty(), "pages": {}})
+            _add(document["totals"], call)
+            for page in call["pages"]:
+                _add(document["pages"].setdefault(page, _empty()), call, share=1.0 / len(call["pages"]))
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(call) + "\n")
+                except OSError as e:
+                    print(f"Warning: could not append usage record: {e}")
+        return call
+
+    def page_totals(self, job: str, document: str, page: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            totals = self.jobs.get(job, {}).get("documents", {}).get(document, {}).get("pages", {}).get(page)
+            return _rounded(totals) if totals else None
+
+    def summary(self, job: str = None, pages: bool = False) -> Dict[str, Any]:
+        """
+        Totals for one job (with per-model and per-document breakdowns, and per-page ones
+        with `pages`), or per-model totals for the whole process when `job` is None.
+        """
+        with self._lock:
+            if job is None:
+                models = {model: _rounded(totals) for model, totals in self.models.items()}
+                overall = _empty()
+                for totals in self.models.values():
+                    for field in FIELDS:
+                        overall[field] += totals[field]
+                return {"totals": _rounded(overall), "models": models}
+            entry = self.jobs.get(job)
+            if entry is None:
+                return {"job": job, "totals": _empty(), "models": {}, "documents": {}}
+            documents = {}
+            for name, document in entry["documents"].items():
+                documents[name] = {"totals": _rounded(document["totals"])}
+                if pages:
+                    documents[name]["pages"] = {page: _rounded(totals) for page, totals in document["pages"].items()}
+            return {
+                "job": job,
+                "totals": _rounded(entry["totals"]),
+                "models": {model: _rounded(totals) for model, totals in entry["models"].items()},
+                "documents": documents,
+            }
+
+    def prometheus_text(self) -> str:
+        """Process-lifetime counters per model in the Prometheus text exposition format."""
+        metrics = [
+            ("gemini_requests_total", "calls", "Gemini generate calls."),
+            ("gemini_request_errors_total", "errors", "Gemini calls that failed after all limiter retries."),
+            ("gemini_retries_total", "retries", "Quota/transient retries and self-correction re-asks."),
+            ("gemini_prompt_tokens_total", "prompt_tokens", "Prompt tokens, including cached ones."),
+            ("gemini_cached_tokens_total", "cached_tokens", "Prompt tokens served from a context cache."),
+            ("gemini_output_tokens_total", "output_tokens", "Response tokens."),
+            ("gemini_thinking_tokens_total", "thinking_tokens", "Thinking tokens (billed as output)."),
+            ("gemini_request_seconds_total", "seconds", "Wall time spent in Gemini calls, backoff included."),
+            ("gemini_cost_usd_total", "cost_usd", "Estimated cost at the configured prices."),
+        ]
+        with self._lock:
+            models = {model: dict(totals) for model, totals in self.models.items()}
+        lines = []
+        for name, field, help_text in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for model, totals in sorted(models.items()):
+                lines.append(f'{name}{{model="{model}"}} {totals[field]:g}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path: str):
+        """Atomically rewrites `path` with `prometheus_text()` (readers never see a partial file)."""
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write Prometheus usage file: {e}")
+
+    def flush(self):
+        """Writes the Prometheus file, if configured. Called at the end of every job."""
+        if self.prometheus_path:
+            self.export_prometheus(self.prometheus_path)
+
+_tracker: Optional[UsageTracker] = None
+_tracker_lock = threading.Lock()
+
+def get_tracker() -> UsageTracker:
+    """Returns the process-wide usage tracker."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = UsageTracker()
+    return _tracker
@@ -0,0 +1,57 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import result_cache
+from src.utils import usage
+
+class ScriptedClient:
+    """
+    Minimal `genai.Client` stand-in: every generate call (sync or async) returns `text`,
+    or `text(model, contents)` when it is callable, after `delay(call number)` seconds.
+    """
+    def __init__(self, text, delay=None, usage_metadata=None):
+        self.text = text
+        self.delay = delay or (lambda call: 0.0)
+        self.usage_metadata = usage_metadata or SimpleNamespace(prompt_token_count=100, cached_content_token_count=0, candidates_token_count=50, thoughts_token_count=0)
+        self.calls = []
+        self.models = SimpleNamespace(generate_content=self._generate_content)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self._agenerate_content))
+
+    def _respond(self, model, contents):
+        text = self.text(model, contents) if callable(self.text) else self.text
+        return SimpleNamespace(text=text, usage_metadata=self.usage_metadata)
+
+    def _generate_content(self, model, contents, config=None, **kwargs):
+        self.calls.append(model)
+        return self._respond(model, contents)
+
+    async def _agenerate_content(self, model, contents, config=None, **kwargs):
+        call = len(self.calls)
+        self.calls.append(model)
+        await asyncio.sleep(self.delay(call))
+        return self._respond(model, contents)
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    """No shared on-disk result cache and a fresh usage tracker for every test."""
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_ENABLED", False)
+    monkeypatch.setattr(usage, "_tracker", usage.UsageTracker(jsonl_path="", prometheus_path=""))
+
+@pytest.fixture
+def make_intelligence(monkeypatch):
+    """Builds an `Intelligence` whose client is a `ScriptedClient` (no streaming, no network)."""
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    from src.services.intelligence import Intelligence
+
+    def _make(text, **client_kwargs):
+        intel = Intelligence()
+        intel.client = ScriptedClient(text, **client_kwargs)
+        intel.stream = False
+        return intel
+    return _make
@@ -0,0 +1,61 @@
+import json
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from src.models.data_models import ImagePayload
+from src.services.batch_processor import BatchProcessor
+from src.utils import result_cache
+
+def _line(custom_id: str, content: str) -> str:
+    return json.dumps({"custom_id": custom_id, "response": {"body": {"choices": [{"message": {"content": content}}], "usage": {}}}})
+
+def test_only_valid_batch_results_are_cached(monkeypatch, tmp_path):
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    cache = result_cache.ResultCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(result_cache, "get_cache", lambda: cache)
+
+    valid = {"base_latex_md": {"latex": "\\section{A}", "markdown": "# A"}, "annotations_metadata": []}
+    results = "\n".join([
+        _line("DocXImage1.png", json.dumps(valid)),
+        _line("DocXImage2.png", '{"base_latex_md": {"latex": "half a page"}}'),
+        _line("DocXImage3.png", json.dumps({"base_latex_md": {"latex": "% Error processing image: DocXImage3.png", "markdown": None}, "annotations_metadata": []})),
+    ])
+    processor = BatchProcessor()
+    processor.client = SimpleNamespace(
+        batches=SimpleNamespace(get=lambda name: SimpleNamespace(state="JobState.JOB_STATE_SUCCEEDED", dest=SimpleNamespace(file_name="files/out"))),
+        files=SimpleNamespace(download=lambda file: results.encode("utf-8"))
+    )
+    keys = {f"DocXImage{i}.png": f"{i:064x}" for i in range(1, 4)}
+
+    message = processor.download_and_extract_results("batches/job", "latex", str(tmp_path), {"result_cache_keys": keys})
+
+    assert "Extracted and sorted 3 pages" in message
+    assert cache.get(keys["DocXImage1.png"]) == valid
+    assert cache.get(keys["DocXImage2.png"]) is None
+    assert cache.get(keys["DocXImage3.png"]) is None
+
+def _submit(monkeypatch, tmp_path, original_bytes):
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    pages = []
+    for i in range(2):
+        data = cv2.imencode(".png", rng.integers(0, 255, (64, 64), dtype=np.uint8))[1].tobytes()
+        pages.append(ImagePayload(data=data, source_path=f"DocXImage{i + 1}.png", original_bytes=original_bytes))
+    processor = BatchProcessor()
+    processor.client = SimpleNamespace(
+        files=SimpleNamespace(upload=lambda file, config: SimpleNamespace(name="files/input")),
+        batches=SimpleNamespace(create=lambda model, src: SimpleNamespace(name="batches/job", state="JOB_STATE_PENDING"))
+    )
+    return processor.process_directory_batch(pages, "latex"), sum(len(page.data) for page in pages)
+
+def test_payload_savings_are_only_reported_when_measured(monkeypatch, tmp_path, capsys):
+    job, after = _submit(monkeypatch, tmp_path, original_bytes=None)
+    assert job["payload_bytes"] == {"before": None, "after": after}
+    assert "plain PNG" not in capsys.readouterr().out
+
+    job, after = _submit(monkeypatch, tmp_path, original_bytes=10_000_000)
+    assert job["payload_bytes"] == {"before": 20_000_000, "after": after}
+    assert "plain PNG would have been 20.0MB" in capsys.readouterr().out
@@ -0,0 +1,16 @@
+from src.utils import client_pool
+
+def test_http_options_pool_sync_and_async_clients():
+    options = client_pool._http_options({"timeout": 60000})
+    for args in (options.client_args, options.async_client_args):
+        limits = args["limits"]
+        assert limits.max_keepalive_connections == client_pool.GEMINI_POOL_CONNECTIONS
+        assert limits.keepalive_expiry == client_pool.GEMINI_KEEPALIVE_SECONDS
+    assert options.timeout == 60000
+
+def test_client_is_shared_and_async_pool_keeps_connections_alive():
+    client = client_pool.get_client("test-key-pool")
+    assert client_pool.get_client("test-key-pool") is client
+    api_client = client._api_client
+    for http_client in (api_client._httpx_client, api_client._async_httpx_client):
+        assert http_client._transport._pool._keepalive_expiry == client_pool.GEMINI_KEEPALIVE_SECONDS
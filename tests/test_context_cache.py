@@ -0,0 +1,86 @@
+import json
+import multiprocessing
+import time
+from types import SimpleNamespace
+
+from src.utils import context_cache
+
+def _fake_client(created: list):
+    def _create(model, config):
+        created.append(model)
+        return SimpleNamespace(name=f"cachedContents/{model}-{len(created)}")
+    return SimpleNamespace(caches=SimpleNamespace(create=_create, update=lambda **kwargs: None, delete=lambda **kwargs: None))
+
+def _acquire_modes(registry_path: str, worker: int, modes: int):
+    registry = context_cache.ContextCacheRegistry(registry_path)
+    client = _fake_client([])
+    for mode in range(modes):
+        registry.acquire(client, "test-key", f"model-{worker}", f"mode-{mode}", "prompt")
+
+def test_acquire_reuses_live_cache(tmp_path):
+    registry = context_cache.ContextCacheRegistry(str(tmp_path / "registry.json"))
+    created = []
+    client = _fake_client(created)
+    first = registry.acquire(client, "test-key", "model", "latex", "prompt")
+    assert registry.acquire(client, "test-key", "model", "latex", "prompt") == first
+    assert created == ["model"]
+
+def test_concurrent_processes_keep_every_entry(tmp_path):
+    registry_path = str(tmp_path / "registry.json")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_acquire_modes, args=(registry_path, worker, 10)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+    with open(registry_path) as f:
+        assert len(json.load(f)) == 40
+
+def _clocked(monkeypatch, start=1_000_000.0):
+    clock = [start]
+    monkeypatch.setattr(context_cache, "time", SimpleNamespace(time=lambda: clock[0], sleep=time.sleep))
+    return clock
+
+def test_held_cache_is_kept_alive_and_never_reaped(tmp_path, monkeypatch):
+    clock = _clocked(monkeypatch)
+    registry_path = str(tmp_path / "registry.json")
+    long_job = context_cache.ContextCacheRegistry(registry_path)
+    other = context_cache.ContextCacheRegistry(registry_path)
+    other._holder = lambda: "other-process"
+    deleted, updated = [], []
+    client = _fake_client([])
+    client.caches.delete = lambda name: deleted.append(name)
+    client.caches.update = lambda name, config: updated.append(name)
+
+    held = long_job.acquire(client, "test-key", "model", "latex", "prompt")
+    # A long document: two hours of heartbeats, well past the idle limit and the original TTL
+    for _ in range(24):
+        clock[0] += context_cache.CONTEXT_CACHE_HEARTBEAT_SECONDS
+        long_job.heartbeat()
+        other.acquire(client, "test-key", "model", "markdown", "prompt")
+    assert held not in deleted
+    assert held in updated
+    assert long_job.acquire(client, "test-key", "model", "latex", "prompt") == held
+
+    long_job.release(client, "test-key", held)
+    long_job.release(client, "test-key", held)
+    clock[0] += context_cache.CONTEXT_CACHE_IDLE_SECONDS + 1
+    other.acquire(client, "test-key", "model", "markdown", "prompt")
+    assert held in deleted
+
+def test_registry_lock_is_not_held_during_api_calls(tmp_path):
+    registry_path = str(tmp_path / "registry.json")
+    registry = context_cache.ContextCacheRegistry(registry_path)
+    lock_free = []
+
+    def _create(model, config):
+        with open(registry_path + ".lock", "a") as lock_file:
+            context_cache.fcntl.flock(lock_file, context_cache.fcntl.LOCK_EX | context_cache.fcntl.LOCK_NB)
+            context_cache.fcntl.flock(lock_file, context_cache.fcntl.LOCK_UN)
+        lock_free.append(model)
+        return SimpleNamespace(name="cachedContents/1")
+
+    client = SimpleNamespace(caches=SimpleNamespace(create=_create, update=lambda **kwargs: None, delete=lambda **kwargs: None))
+    assert registry.acquire(client, "test-key", "model", "latex", "prompt") == "cachedContents/1"
+    assert lock_free == ["model"]
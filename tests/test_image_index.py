@@ -0,0 +1,30 @@
+import os
+
+from src.services import vision
+from src.utils.image_index import ImageIndex
+
+def test_page_edited_in_place_is_rechecked(tmp_path):
+    folder = tmp_path / "notes"
+    folder.mkdir()
+    page = folder / "NotesXImage1.png"
+    page.write_bytes(b"first scan")
+    index = ImageIndex(str(folder), index_path=str(tmp_path / "index.json"))
+    assert index.refresh() == 1
+
+    dir_mtime = os.stat(folder).st_mtime_ns
+    page.write_bytes(b"a longer second scan")
+    os.utime(folder, ns=(dir_mtime, dir_mtime))
+
+    assert index.refresh() == 1
+    assert index.state["entries"]["NotesXImage1.png"][0] == len(b"a longer second scan")
+    assert index.refresh() == 0
+
+def test_grouping_keeps_the_callers_folder_form(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.utils.image_index.INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("notes")
+    for page in (10, 2, 1):
+        with open(os.path.join("notes", f"NotesXImage{page}.png"), "wb") as f:
+            f.write(b"page")
+
+    assert vision.get_image_grouping("notes") == {"Notes": [os.path.join("notes", f"NotesXImage{page}.png") for page in (1, 2, 10)]}
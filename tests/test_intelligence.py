@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import pytest
+
+from src.models.data_models import DocumentPayload, BaseLatexMd
+from src.services.intelligence import error_payload, is_error_payload
+
+MARKDOWN_ONLY = DocumentPayload(base_latex_md=BaseLatexMd(markdown="# Notes\n\n" + "\n".join(f"Let $f_{i}(x) = x^{i}$ on $[0, {i}]$." for i in range(10))), annotations_metadata=[]).model_dump()
+
+def test_is_error_payload_handles_null_fields():
+    assert MARKDOWN_ONLY["base_latex_md"]["latex"] is None
+    assert not is_error_payload(MARKDOWN_ONLY)
+    assert not is_error_payload({"base_latex_md": None})
+    assert is_error_payload(error_payload("page.png", "boom"))
+    assert is_error_payload({"base_latex_md": {"latex": None, "markdown": "% Error processing image: page.png"}})
+
+def test_markdown_only_page_is_transcribed(make_intelligence, tmp_path):
+    pages = []
+    for i in range(3):
+        path = tmp_path / f"NotesXImage{i + 1}.png"
+        path.write_bytes(b"\x89PNG page %d" % i)
+        pages.append(str(path))
+    intel = make_intelligence(json.dumps(MARKDOWN_ONLY))
+
+    results = intel.transcribe_many(pages, mode="markdown", hedge=True)
+
+    assert results == [MARKDOWN_ONLY] * 3
+    assert intel.client.calls == [intel.cascade[0]] * 3
+
+def test_failing_page_does_not_fail_the_batch(make_intelligence, tmp_path):
+    pages = []
+    for i in range(4):
+        path = tmp_path / f"NotesXImage{i + 1}.png"
+        path.write_bytes(b"\x89PNG page %d" % i)
+        pages.append(str(path))
+    intel = make_intelligence(json.dumps(MARKDOWN_ONLY))
+    transcribe = intel.atranscribe_image
+
+    async def _flaky(image, mode="both", on_partial=None):
+        if image == pages[1]:
+            raise RuntimeError("unexpected failure")
+        return await transcribe(image, mode, on_partial)
+    intel.atranscribe_image = _flaky
+
+    saved = {}
+    def _save(index, image, result):
+        if index == 2:
+            raise OSError("disk full")
+        saved[index] = result
+
+    results = intel.transcribe_many(pages, mode="markdown", on_result=_save)
+
+    assert len(results) == 4
+    assert is_error_payload(results[1]) and "unexpected failure" in results[1]["base_latex_md"]["latex"]
+    assert results[0] == results[2] == results[3] == MARKDOWN_ONLY
+    assert sorted(saved) == [0, 1, 3]
+
+def test_inline_plan_caps_each_page_and_the_request(make_intelligence, monkeypatch):
+    from src.services import intelligence
+    from src.models.data_models import ImagePayload
+    monkeypatch.setattr(intelligence, "INLINE_IMAGE_MAX_BYTES", 4)
+    monkeypatch.setattr(intelligence, "INLINE_REQUEST_MAX_BYTES", 10)
+    intel = make_intelligence("{}")
+    pages = [ImagePayload(data=b"x" * size) for size in (3, 5, 4, 3, 2)]
+    assert intel.inline_plan(pages) == [True, False, True, True, False]
+
+def test_hedged_call_is_accounted_once(make_intelligence, tmp_path, monkeypatch):
+    from src.utils import hedging, usage
+    hedger = hedging.Hedger(max_fraction=1.0)
+    for _ in range(hedging.HEDGE_MIN_SAMPLES):
+        hedger.tracker.record(0.2)
+    hedger.stats["calls"] = hedging.HEDGE_MIN_SAMPLES
+    monkeypatch.setattr(hedging, "_hedger", hedger)
+
+    path = tmp_path / "NotesXImage1.png"
+    path.write_bytes(b"\x89PNG page")
+    escalated = json.loads(json.dumps(MARKDOWN_ONLY))
+    escalated["base_latex_md"]["markdown"] += "\n[COMPLEX/OMITTED CONTENT]"
+    # The first tier asks for escalation; the second tier's first request hangs and its duplicate answers
+    intel = make_intelligence(
+        lambda model, contents: json.dumps(escalated if model == intel.cascade[0] else MARKDOWN_ONLY),
+        delay=lambda call: 2.0 if call == 1 else 0.01
+    )
+
+    results = intel.transcribe_many([str(path)], mode="markdown", hedge=True)
+
+    assert results == [MARKDOWN_ONLY]
+    assert intel.client.calls == [intel.cascade[0], intel.cascade[1], intel.cascade[1]]
+    assert hedger.stats["hedge_wins"] == 1
+    totals = usage.get_tracker().summary()["totals"]
+    assert totals["calls"] == 2 and totals["retries"] == 0
+    assert totals["prompt_tokens"] == 2 * intel.client.usage_metadata.prompt_token_count
+    stats = intel.cascade_stats.summary()
+    assert [stats["tiers"][tier]["calls"] for tier in intel.cascade] == [1, 1]
+    assert stats["escalations"] == {"placeholder": 1}
+
+def test_iterator_failure_finishes_started_pages(make_intelligence, tmp_path):
+    pages = []
+    for i in range(3):
+        path = tmp_path / f"NotesXImage{i + 1}.png"
+        path.write_bytes(b"\x89PNG page %d" % i)
+        pages.append(str(path))
+    intel = make_intelligence(json.dumps(MARKDOWN_ONLY), delay=lambda call: 0.2)
+
+    def _pages():
+        yield from pages
+        raise RuntimeError("renderer crashed")
+
+    saved = {}
+    def _save(index, image, result):
+        # Callbacks run off the event loop, so blocking writes don't stall other requests
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        saved[index] = result
+
+    with pytest.raises(RuntimeError, match="renderer crashed"):
+        intel.transcribe_many(_pages(), mode="markdown", on_result=_save)
+    assert saved == {0: MARKDOWN_ONLY, 1: MARKDOWN_ONLY, 2: MARKDOWN_ONLY}
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from src.models.data_models import DocumentPayload
+from src.utils import llm_utils
+
+def _payload(latex: str) -> str:
+    # A JSON document exactly as the model would write it, single LaTeX backslashes included
+    return '{"base_latex_md": {"latex": "' + latex + '", "markdown": null}, "annotations_metadata": []}'
+
+@pytest.mark.parametrize("latex", [r"\frac{a}{b}", r"\beta + \gamma", r"\textbf{Theorem}", r"\nabla f", r"x = 1 \tag{1}", r"\rho \rightarrow 0"])
+def test_latex_commands_that_are_json_escapes_survive(latex):
+    parsed = llm_utils.validate_with_repair(DocumentPayload, _payload(latex))
+    assert parsed.base_latex_md.latex == latex
+
+def test_valid_escapes_are_kept():
+    raw = json.dumps({"base_latex_md": {"latex": "\\frac{1}{2}\nNext line\tcell \"q\"", "markdown": None}, "annotations_metadata": []})
+    parsed = llm_utils.validate_with_repair(DocumentPayload, raw)
+    assert parsed.base_latex_md.latex == "\\frac{1}{2}\nNext line\tcell \"q\""
+
+def test_loads_with_repair_keeps_latex():
+    assert llm_utils.loads_with_repair("```json\n" + _payload(r"\frac{x}{y} \beta") + "\n```")["base_latex_md"]["latex"] == r"\frac{x}{y} \beta"
+
+def test_invalid_payload_still_raises():
+    with pytest.raises(Exception):
+        llm_utils.validate_with_repair(DocumentPayload, '{"annotations_metadata": []}')
+
+@pytest.mark.parametrize("latex", ["$$\ne^{i\\pi}+1=0\n$$", "\\[\nu(x) = 1\n\\]", "Case 1\ni.e. the base case"])
+def test_valid_newlines_before_letters_are_not_rewritten(latex):
+    raw = json.dumps({"base_latex_md": {"latex": latex, "markdown": None}, "annotations_metadata": []})
+    before = llm_utils.parse_stats()["repaired"]
+    assert llm_utils.validate_with_repair(DocumentPayload, raw).base_latex_md.latex == latex
+    assert llm_utils.loads_with_repair(raw)["base_latex_md"]["latex"] == latex
+    assert llm_utils.parse_stats()["repaired"] == before
+
+def test_truncated_output_is_repaired_locally():
+    before = llm_utils.parse_stats()["repaired"]
+    raw = '```json\n{"base_latex_md": {"latex": "\\frac{a}{b}\nline two", "markdown": null,}, "annotations_metadata": ['
+    parsed = llm_utils.validate_with_repair(DocumentPayload, raw)
+    assert parsed.base_latex_md.latex == "\\frac{a}{b}\nline two"
+    assert llm_utils.parse_stats()["repaired"] == before + 1
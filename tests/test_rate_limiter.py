@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+
+from src.utils import rate_limiter
+
+class ApiError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(message or f"{code} error")
+        self.code = code
+
+def _flaky(errors, result="ok"):
+    calls = []
+    def _call():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return _call, calls
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda error_class, attempt: 0.0)
+
+@pytest.mark.parametrize("error, expected", [
+    (ApiError(429), "quota"),
+    (RuntimeError("RESOURCE_EXHAUSTED: quota exceeded"), "quota"),
+    (ApiError(503), "transient"),
+    (TimeoutError("read timed out"), "transient"),
+    (json.JSONDecodeError("bad", "{", 0), "validation"),
+    (ApiError(400, "INVALID_ARGUMENT"), "fatal"),
+    (rate_limiter.CircuitOpenError("open"), "fatal"),
+])
+def test_errors_are_classified(error, expected):
+    assert rate_limiter.classify_error(error) == expected
+
+def test_quota_errors_back_off_and_slow_the_rate():
+    limiter = rate_limiter.RateLimiter(rpm=6000, max_attempts=5)
+    call, calls = _flaky([ApiError(429), ApiError(429)])
+
+    assert limiter.call(call) == "ok"
+    assert len(calls) == 3
+    assert limiter.stats["quota"] == 2 and limiter.stats["retries"] == 2
+    assert limiter.rate_factor == pytest.approx(rate_limiter.RATE_DECREASE ** 2 + rate_limiter.RATE_INCREASE)
+
+def test_fatal_errors_are_not_retried():
+    limiter = rate_limiter.RateLimiter(rpm=6000)
+    call, calls = _flaky([ApiError(400)])
+    with pytest.raises(ApiError):
+        limiter.call(call)
+    assert len(calls) == 1 and limiter.stats["retries"] == 0
+
+def test_breaker_opens_after_repeated_failures_and_fails_fast():
+    limiter = rate_limiter.RateLimiter(rpm=6000, max_attempts=3, breaker_threshold=3, breaker_cooldown=60)
+    call, calls = _flaky([ApiError(503)] * 10)
+    with pytest.raises(ApiError):
+        limiter.call(call)
+    assert limiter.stats["circuit_opened"] == 1
+
+    with pytest.raises(rate_limiter.CircuitOpenError):
+        limiter.call(call)
+    assert len(calls) == 3
+
+def test_async_calls_share_the_retry_policy():
+    limiter = rate_limiter.RateLimiter(rpm=6000)
+    errors = [ApiError(502)]
+
+    async def _call():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert asyncio.run(limiter.acall(_call)) == "ok"
+    assert limiter.stats["transient"] == 1 and limiter.stats["retries"] == 1
@@ -0,0 +1,38 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import streaming
+
+class SlowStreamClient:
+    """`client.aio.models.generate_content_stream` that takes `create_delay` to open and `chunk_delays` per chunk."""
+    def __init__(self, create_delay: float, chunk_delays: list):
+        self.create_delay = create_delay
+        self.chunk_delays = chunk_delays
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self._stream))
+
+    async def _stream(self, model, contents, config):
+        await asyncio.sleep(self.create_delay)
+
+        async def _chunks():
+            for i, delay in enumerate(self.chunk_delays):
+                await asyncio.sleep(delay)
+                yield SimpleNamespace(text='{"base_latex_md": {"latex": "x"}}' if i == 0 else "", usage_metadata=None)
+        return _chunks()
+
+def _run(client, **timeouts):
+    return asyncio.run(streaming.stream_generate(client, "model", [], None, **timeouts))
+
+def test_first_token_deadline_covers_stream_creation():
+    # Each step fits the timeout on its own, but together they miss it
+    with pytest.raises(streaming.StreamTimeoutError, match="first token"):
+        _run(SlowStreamClient(0.3, [0.3]), first_token_timeout=0.5, stall_timeout=5, total_timeout=5)
+
+def test_slow_first_token_within_deadline_then_flowing_chunks():
+    response = _run(SlowStreamClient(0.2, [0.2, 0.1, 0.1]), first_token_timeout=0.6, stall_timeout=0.3, total_timeout=5)
+    assert response.text.startswith('{"base_latex_md"')
+
+def test_stall_after_first_chunk():
+    with pytest.raises(streaming.StreamTimeoutError, match="stalled"):
+        _run(SlowStreamClient(0.0, [0.0, 0.5]), first_token_timeout=5, stall_timeout=0.2, total_timeout=5)
@@ -0,0 +1,33 @@
+from src.services import text_layer
+
+PAGE = (612.0, 792.0)
+
+def _lines(top, count, step=14.0):
+    return [(72.0, top + i * step, 468.0, 12.0) for i in range(count)]
+
+def test_vector_figure_gap_sends_page_to_vision(monkeypatch):
+    # Text above and below a 250pt blank band where a vector plot is drawn.
+    figure_page = _lines(72.0, 15) + _lines(540.0, 15)
+    text_page = _lines(72.0, 45)
+    layer = {
+        1: {"text": "a" * 200, "fonts": {"Times"}, "size": PAGE, "boxes": text_page},
+        2: {"text": "b" * 200, "fonts": {"Times"}, "size": PAGE, "boxes": figure_page},
+    }
+    monkeypatch.setattr(text_layer, "extract_text_layer", lambda path: layer)
+    monkeypatch.setattr(text_layer, "count_page_figures", lambda path: {})
+
+    pages = text_layer.classify_pages("doc.pdf")
+    assert [(p["kind"], p["vector_figure"]) for p in pages] == [("text", False), ("math", True)]
+
+def test_low_text_coverage_is_a_figure_page():
+    assert text_layer.has_vector_figure(PAGE, _lines(72.0, 3))
+    assert not text_layer.has_vector_figure(PAGE, [])
+
+def test_figure_above_the_first_line_is_detected():
+    assert text_layer.has_vector_figure(PAGE, _lines(300.0, 31))
+
+def test_figure_below_the_last_line_is_detected():
+    assert text_layer.has_vector_figure(PAGE, _lines(72.0, 28))
+
+def test_normal_margins_are_not_figures():
+    assert not text_layer.has_vector_figure(PAGE, [(72.0, 36.0, 300.0, 10.0)] + _lines(90.0, 46) + [(300.0, 750.0, 12.0, 10.0)])
@@ -0,0 +1,65 @@
+import numpy as np
+
+from src.services import vision
+
+def _page() -> np.ndarray:
+    page = np.full((400, 300), 255, np.uint8)
+    page[100:140, 60:240] = 0
+    return page
+
+def test_optimize_payload_only_encodes_baseline_when_reporting():
+    assert vision.optimize_payload(_page()).original_bytes is None
+    assert vision.optimize_payload(_page(), report_savings=True).original_bytes > 0
+
+def test_enhance_image_skips_baseline_encode_by_default(monkeypatch):
+    encoded = []
+    encode_image = vision.encode_image
+    monkeypatch.setattr(vision, "encode_image", lambda img, ext=".png", params=None: encoded.append((img.shape, ext, params)) or encode_image(img, ext, params))
+
+    payload = vision.enhance_image(_page(), use_cache=False)
+
+    assert payload.original_bytes is None
+    # Candidates and the signature thumbnail only; no plain full-page PNG
+    assert not any(ext == ".png" and not params and shape == (400, 300) for shape, ext, params in encoded)
+
+def test_failed_window_does_not_drop_later_pages(monkeypatch, tmp_path):
+    monkeypatch.setattr(vision, "get_pdf_page_count", lambda pdf_path: 6)
+
+    def _render(pdf_path, output_dir, first, last, dpi, fmt, grayscale):
+        if first == 3:
+            raise RuntimeError("pdftoppm crashed")
+        return [str(output_dir / f"DocXImage{page}.png") for page in range(first, last + 1)]
+    monkeypatch.setattr(vision, "_render_window", _render)
+
+    stats = {}
+    pages = list(vision.iter_pdf_pages(tmp_path / "Doc.pdf", tmp_path, window_size=2, workers=1, stats=stats))
+
+    assert [p.rsplit("XImage", 1)[1] for p in pages] == ["1.png", "2.png", "5.png", "6.png"]
+    assert stats["failed_pages"] == [3, 4]
+
+def _fake_renderer(monkeypatch, page_count):
+    rendered = []
+    monkeypatch.setattr(vision, "get_pdf_page_count", lambda pdf_path: page_count)
+
+    def _render(pdf_path, output_dir, first, last, dpi, fmt, grayscale):
+        rendered.append((first, last))
+        return [str(output_dir / f"DocXImage{page}.png") for page in range(first, last + 1)]
+    monkeypatch.setattr(vision, "_render_window", _render)
+    return rendered
+
+def test_pdf_pages_stream_with_bounded_windows_in_flight(monkeypatch, tmp_path):
+    rendered = _fake_renderer(monkeypatch, 20)
+    pages = vision.iter_pdf_pages(tmp_path / "Doc.pdf", tmp_path, window_size=2, workers=1)
+
+    assert next(pages).endswith("DocXImage1.png")
+    # The first window is consumed while at most one more is queued; the rest wait
+    assert len(rendered) <= 2
+    assert [p.rsplit("XImage", 1)[1] for p in pages] == [f"{page}.png" for page in range(2, 21)]
+    assert len(rendered) == 10
+
+def test_pdf_windows_only_cover_requested_pages(monkeypatch, tmp_path):
+    rendered = _fake_renderer(monkeypatch, 8)
+    paths = vision.process_pdf(tmp_path / "Doc.pdf", tmp_path, window_size=2, workers=2, pages=[7, 1, 2, 5, 6])
+
+    assert sorted(rendered) == [(1, 2), (5, 6), (7, 7)]
+    assert [p.rsplit("XImage", 1)[1] for p in paths] == ["1.png", "2.png", "5.png", "6.png", "7.png"]